@@ -0,0 +1 @@
+"""Бенчмарки и генераторы тестовых файлов (не входят в бота)"""
@@ -0,0 +1,111 @@
+"""Заглушка Telegram Bot API для нагрузочных прогонов.
+
+Отвечает на методы бота правдоподобными объектами, по желанию с задержкой
+и долей ответов 429, и сообщает о каждом вызове подписчику — так
+bench.loadgen узнает, когда бот ответил пользователю. Бот направляется
+сюда через TELEGRAM_API_URL.
+
+    python -m bench.fakeapi --port 8082 --latency 30
+"""
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+from collections import Counter
+
+from aiohttp import web
+
+logger = logging.getLogger("fakeapi")
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': "Расписание", 'username': "raspisanie_load_bot"}
+# Методы, которые возвращают отправленное или измененное сообщение
+MESSAGE_METHODS = {
+    'sendmessage', 'editmessagetext', 'editmessagereplymarkup', 'senddocument', 'sendphoto', 'copymessage',
+}
+
+
+class FakeBotAPI:
+    def __init__(self, latency=0, jitter=0, flood_rate=0, retry_after=1, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.calls = Counter()
+        self.flooded = 0
+        self._message_id = 0
+        # Вызывается как listener(method, params, time.perf_counter()) на каждый принятый вызов
+        self.listeners = []
+
+    def _message(self, params):
+        self._message_id += 1
+        chat_id = int(params.get('chat_id') or 0)
+        return {
+            'message_id': int(params.get('message_id') or self._message_id),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': "private"},
+            'from': BOT_USER,
+            'text': params.get('text', ""),
+        }
+
+    def _result(self, method, params):
+        if method == 'getme':
+            return BOT_USER
+        if method == 'getwebhookinfo':
+            return {'url': "", 'has_custom_certificate': False, 'pending_update_count': 0}
+        if method in MESSAGE_METHODS:
+            return self._message(params)
+        return True
+
+    async def handle(self, request):
+        method = request.match_info['method'].lower()
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        delay = self.latency + self.rng.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay / 1000)
+        if method not in ('getme', 'setwebhook') and self.rng.random() < self.flood_rate:
+            self.flooded += 1
+            return web.json_response({
+                'ok': False, 'error_code': 429, 'description': f"Too Many Requests: retry after {self.retry_after}",
+                'parameters': {'retry_after': self.retry_after},
+            }, status=429)
+        self.calls[method] += 1
+        for listener in self.listeners:
+            listener(method, params, time.perf_counter())
+        return web.json_response({'ok': True, 'result': self._result(method, params)}, dumps=json.dumps)
+
+    def stats(self):
+        return {'calls': dict(self.calls), 'flooded': self.flooded}
+
+    async def handle_stats(self, request):
+        return web.json_response(self.stats())
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_get("/bot{token}/{method}", self.handle)
+        app.router.add_get("/__stats", self.handle_stats)
+        return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Заглушка Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--latency", type=float, default=0, help="задержка ответа, мс")
+    parser.add_argument("--jitter", type=float, default=0, help="случайная добавка к задержке, мс")
+    parser.add_argument("--flood-rate", type=float, default=0, help="доля ответов 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s %(name)s: %(message)s')
+    api = FakeBotAPI(args.latency, args.jitter, args.flood_rate, args.retry_after)
+    web.run_app(api.make_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""Генераторы синтетических raspisanie.xls и zameni.docx заданного масштаба.
+
+Раскладка собрана по тому, что читают парсеры bot/parsers/schedule.py:
+колонки «День» и «Интервал», пара колонок «группа + аудитория» на каждую
+группу с периодическим повтором «День/Интервал», разделители недель
+«-----», раздел «ПРАКТИКИ» в конце листа и таблицы замен со строками на 9
+и на 4 колонки. С настоящим файлом колледжа она не сверена: для времени
+разбора этого хватает, а число пар по неделям (Fixture.week_lessons) —
+лишь то, что задумано в раскладке фикстуры.
+"""
+import random
+from io import BytesIO
+from dataclasses import dataclass
+
+from openpyxl import Workbook
+from docx import Document
+
+DAYS = ['Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота']
+GROUP_PREFIXES = ['Исп', 'Бд', 'Вет', 'Зчс', 'Пкд', 'Тод', 'Одл', 'Пб', 'Св', 'Тг', 'Юр', 'Мхт']
+SUBJECTS = [
+    'Математика', 'История России', 'Физическая культура', 'Иностранный язык', 'Информатика',
+    'МДК.01.01', 'МДК.02.03', 'Основы философии', 'Русский язык', 'Литература', 'Химия',
+    'Экономика организации', 'Охрана труда', 'Инженерная графика', 'Электротехника',
+]
+SURNAMES = [
+    'Иванов', 'Петрова', 'Сидоров', 'Литвинова', 'Лыкова', 'Кузнецов', 'Смирнова', 'Попов',
+    'Волкова', 'Соколов', 'Морозова', 'Новиков', 'Федорова', 'Егоров', 'Никитина', 'Орлов',
+]
+INITIALS = 'АБВГДЕИКЛМНОПРСТ'
+
+
+@dataclass
+class Fixture:
+    content: bytes
+    # Сколько непустых ячеек и строк таблиц в файле — знаменатель для «ячеек в секунду»
+    cells: int
+    groups: int
+    # Сколько пар по неделям задумано в раскладке, без групп на практике: {1: n, 2: n}
+    week_lessons: dict = None
+    # Группы, у которых вместо пар раздел «ПРАКТИКИ»
+    practice: tuple = ()
+
+
+def _teacher(rng):
+    return f"{rng.choice(SURNAMES)} {rng.choice(INITIALS)}.{rng.choice(INITIALS)}."
+
+
+def _lesson_cells(rng):
+    """Ячейка пары и ячейка аудитории; иногда аудитория записана прямо в ячейке пары"""
+    subject = rng.choice(SUBJECTS)
+    subgroup = f" ({rng.randint(1, 2)}п)" if rng.random() < 0.1 else ""
+    room = str(rng.randint(100, 450))
+    if rng.random() < 0.2:
+        return f"{subject}{subgroup} {_teacher(rng)} {room}", None
+    return f"{subject}{subgroup} {_teacher(rng)}", room
+
+
+def group_names(count, seed=0):
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < count:
+        names.add(f"{rng.choice(GROUP_PREFIXES)}-{rng.choice((22, 23, 24, 25))}{rng.randint(1, 9)}")
+    return sorted(names)
+
+
+def make_schedule(groups=40, days=6, lessons=4, split_ratio=0.15, practice_groups=2,
+                  repeat_every=10, seed=0, path=None):
+    """Книга xlsx с расписанием; openpyxl не пишет старый xls, pandas читает оба формата"""
+    rng = random.Random(seed)
+    names = group_names(groups, seed)
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Расписание"
+    header = []
+    layout = []
+    for idx, name in enumerate(names):
+        if idx % repeat_every == 0:
+            header += ['День', 'Интервал']
+            layout += ['day', 'time']
+        header += [name, 'Ауд.']
+        layout += [name, ('room', name)]
+    ws.append(header)
+    cells = len(header)
+    expected = {name: {1: 0, 2: 0} for name in names}
+
+    for day in DAYS[:days]:
+        day_lessons = lessons - 1 if day == 'Суббота' else lessons
+        first_row = True
+        for number in range(1, day_lessons + 1):
+            # Пара с разными предметами по неделям занимает три строки: 1 неделя, «-----», 2 неделя
+            split = {name: rng.random() < split_ratio for name in names}
+            rows = 3 if any(split.values()) else 1
+            for part in range(rows):
+                row = []
+                rooms = {}
+                for column in layout:
+                    if column == 'day':
+                        row.append(day if first_row else None)
+                    elif column == 'time':
+                        row.append(f"{number} пара" if part == 0 else None)
+                    elif isinstance(column, tuple):
+                        row.append(rooms.get(column[1]))
+                    elif part == 1:
+                        row.append("-----" if split[column] else None)
+                    elif (part == 2 and not split[column]) or rng.random() < 0.1:
+                        row.append(None)
+                    else:
+                        text, rooms[column] = _lesson_cells(rng)
+                        row.append(text)
+                        # Над «-----» — первая неделя, под ним — вторая, без разделителя — обе
+                        for week in ((1 if part == 0 else 2,) if split[column] else (1, 2)):
+                            expected[column][week] += 1
+                first_row = False
+                ws.append(row)
+                cells += sum(1 for value in row if value is not None)
+
+    ws.append(["ПРАКТИКИ"])
+    ws.append(["Шифр группы", "Вид практики", "Сроки"])
+    cells += 4
+    practice = tuple(rng.sample(names, min(practice_groups, len(names))))
+    for name in practice:
+        ws.append([name, "Учебная практика", f"с 01.{rng.randint(10, 12)} по 14.{rng.randint(10, 12)}"])
+        cells += 3
+        # Вместо пар у группы на практике парсер отдает только практику
+        del expected[name]
+    week_lessons = {week: sum(counts[week] for counts in expected.values()) for week in (1, 2)}
+
+    buffer = BytesIO()
+    wb.save(buffer)
+    content = buffer.getvalue()
+    if path:
+        with open(path, "wb") as f:
+            f.write(content)
+    return Fixture(content, cells, len(names), week_lessons, practice)
+
+
+def make_replacements(groups=40, dates=2, rows_per_date=30, wide_ratio=0.6, seed=0, path=None):
+    """Документ docx с заменами: широкие строки (две замены) и короткие на 4 колонки"""
+    rng = random.Random(seed + 1)
+    names = group_names(groups, seed)
+    doc = Document()
+    doc.add_paragraph("Изменения в расписании")
+    wide = doc.add_table(rows=1, cols=9)
+    for cell, title in zip(wide.rows[0].cells, [
+        "Шифр группы", "№ пары", "№ пары по замене", "Дисциплина", "ФИО преподавателя",
+        "№ пары", "Дисциплина", "ФИО преподавателя", "Аудитория",
+    ]):
+        cell.text = title
+    narrow = doc.add_table(rows=1, cols=4)
+    for cell, title in zip(narrow.rows[0].cells, ["Шифр группы", "№ пары", "Дисциплина", "Аудитория"]):
+        cell.text = title
+    cells = 13
+    for offset in range(dates):
+        date = f"{20 + offset:02d}.10.2026 {DAYS[(1 + offset) % 6]}"
+        for table in (wide, narrow):
+            table.add_row().cells[0].text = date
+            cells += 1
+        for name in rng.sample(names, min(rows_per_date, len(names))):
+            lesson = rng.choice(["1", "2", "3", "4", "1-2", "3-4"])
+            if rng.random() < wide_ratio:
+                values = [
+                    name, lesson, lesson, rng.choice(SUBJECTS), _teacher(rng),
+                    lesson, rng.choice(SUBJECTS), _teacher(rng), f"{rng.randint(100, 450)}",
+                ]
+                row = wide.add_row()
+            else:
+                values = [name, lesson, rng.choice(SUBJECTS), f"{rng.randint(100, 450)}"]
+                row = narrow.add_row()
+            for cell, value in zip(row.cells, values):
+                cell.text = value
+            cells += len(values)
+
+    buffer = BytesIO()
+    doc.save(buffer)
+    content = buffer.getvalue()
+    if path:
+        with open(path, "wb") as f:
+            f.write(content)
+    return Fixture(content, cells, len(names))
@@ -0,0 +1,415 @@
+"""Нагрузочный прогон вебхука: синтетические апдейты с заданной частотой.
+
+Генератор шлет на /webhook бота смесь апдейтов утреннего часа пик — кнопку
+«Расписание 📝», колбэки schedule_<группа>_<вид>, листание списка групп и
+выбор группы — и ждет ответа бота на встроенной заглушке Bot API
+(bench.fakeapi). Пока идет прогон, он снимает /metrics бота, чтобы видеть
+загрузку пулов соединений и очереди вебхука.
+
+    TELEGRAM_API_URL=http://127.0.0.1:8082 BOT_TOKEN=123456:load WEBHOOK_URL=http://127.0.0.1:8080 \\
+        WEBHOOK_SECRET=load python -m bot.main
+    python -m bench.loadgen --rate 200 --duration 60 --users 5000 --secret load \\
+        --database-url postgresql://localhost/raspisanie --output bench-loadgen.json
+
+Пользователи с выбранной группой заводятся в users с id от --user-base
+(--cleanup удаляет их после прогона). Нагрузка открытая: апдейты уходят по
+расписанию независимо от ответов, но у каждого пользователя не больше
+одного апдейта в работе, как у живого человека.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import platform
+from datetime import datetime
+
+import aiohttp
+import asyncpg
+from aiohttp import web
+
+from .fakeapi import FakeBotAPI
+
+logger = logging.getLogger("loadgen")
+
+# Сценарий -> доля в смеси по умолчанию
+DEFAULT_MIX = {'menu': 0.35, 'schedule': 0.45, 'page': 0.1, 'group': 0.1}
+VIEWS = ("today", "tomorrow", "week")
+# Ответ бота, после которого апдейт считается обработанным
+DONE_METHODS = {'sendmessage', 'editmessagetext'}
+GROUPS_PER_PAGE = 15
+# Метрики бота, которые снимаются во время прогона
+SAMPLED_METRICS = (
+    "db_pool_connections", "db_pool_max_size", "db_pool_acquire_timeouts_total",
+    "db_pool_acquire_wait_seconds_total", "webhook_pending_updates", "webhook_running_updates",
+)
+
+
+def percentiles(values):
+    if not values:
+        return {'count': 0}
+    values = sorted(values)
+
+    def at(q):
+        return values[min(len(values) - 1, int(q * len(values)))] * 1000
+
+    return {
+        'count': len(values), 'p50_ms': at(0.5), 'p90_ms': at(0.9), 'p95_ms': at(0.95),
+        'p99_ms': at(0.99), 'max_ms': values[-1] * 1000,
+    }
+
+
+def parse_metrics(text):
+    """Строки Prometheus нужных метрик -> {(имя, метки): значение}"""
+    result = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        name, _, value = line.rpartition(" ")
+        metric, _, labels = name.partition("{")
+        if metric not in SAMPLED_METRICS:
+            continue
+        try:
+            result[(metric, labels.rstrip("}"))] = float(value)
+        except ValueError:
+            pass
+    return result
+
+
+class Pending:
+    """Апдейт в работе: ждем от заглушки первый ответ и итоговое сообщение"""
+
+    def __init__(self, scenario, sent):
+        self.scenario = scenario
+        self.sent = sent
+        self.acked = None
+        self.done = asyncio.get_running_loop().create_future()
+
+
+class LoadGenerator:
+    def __init__(self, args, groups):
+        self.args = args
+        self.groups = groups
+        self.rng = random.Random(args.seed)
+        self.mix = args.mix
+        self.users = list(range(args.user_base, args.user_base + args.users))
+        self.idle = set(self.users)
+        self.user_groups = {user_id: self.rng.choice(groups) for user_id in self.users}
+        self.pending = {}
+        self.update_id = 0
+        self.api = FakeBotAPI(args.api_latency, args.api_jitter, args.flood_rate, seed=args.seed)
+        self.api.listeners.append(self._on_api_call)
+        self.results = {scenario: {'webhook': [], 'ack': [], 'done': []} for scenario in self.mix}
+        self.errors = {'webhook_status': {}, 'webhook_exceptions': 0, 'timeouts': 0, 'no_idle_user': 0}
+        self.samples = []
+
+    # ---- Ответы бота ----
+
+    def _on_api_call(self, method, params, now):
+        if method == 'answercallbackquery':
+            user_id = int(str(params.get('callback_query_id', "0")).split(":")[0])
+            entry = self.pending.get(user_id)
+            if entry and entry.acked is None:
+                entry.acked = now
+            return
+        if method not in DONE_METHODS:
+            return
+        entry = self.pending.get(int(params.get('chat_id') or 0))
+        if entry and not entry.done.done():
+            entry.done.set_result(now)
+
+    # ---- Апдейты ----
+
+    def _user(self, user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': "Load", 'username': f"load{user_id}"}
+
+    def _message(self, user_id, text, from_bot=False):
+        return {
+            'message_id': self.update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': "private", 'first_name': "Load"},
+            'from': {'id': 1, 'is_bot': True, 'first_name': "Расписание"} if from_bot else self._user(user_id),
+            'text': text,
+        }
+
+    def _callback(self, user_id, data):
+        return {
+            'id': f"{user_id}:{self.update_id}",
+            'from': self._user(user_id),
+            'chat_instance': str(user_id),
+            'message': self._message(user_id, "Выберите период расписания:", from_bot=True),
+            'data': data,
+        }
+
+    def build_update(self, scenario, user_id):
+        self.update_id += 1
+        update = {'update_id': self.update_id}
+        if scenario == 'menu':
+            update['message'] = self._message(user_id, "Расписание 📝")
+        elif scenario == 'schedule':
+            group = self.user_groups[user_id]
+            update['callback_query'] = self._callback(user_id, f"schedule_{group}_{self.rng.choice(VIEWS)}")
+        elif scenario == 'page':
+            pages = max(1, (len(self.groups) + GROUPS_PER_PAGE - 1) // GROUPS_PER_PAGE)
+            update['callback_query'] = self._callback(user_id, f"page_{self.rng.randrange(pages)}")
+        else:
+            group = self.rng.choice(self.groups)
+            self.user_groups[user_id] = group
+            update['callback_query'] = self._callback(user_id, f"group_{group}")
+        return update
+
+    async def send(self, session, scenario, user_id):
+        update = self.build_update(scenario, user_id)
+        entry = Pending(scenario, time.perf_counter())
+        self.pending[user_id] = entry
+        result = self.results[scenario]
+        try:
+            try:
+                async with session.post(self.args.url, json=update, headers=self.headers) as resp:
+                    await resp.read()
+                    status = resp.status
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                self.errors['webhook_exceptions'] += 1
+                return
+            result['webhook'].append(time.perf_counter() - entry.sent)
+            if status != 200:
+                key = str(status)
+                self.errors['webhook_status'][key] = self.errors['webhook_status'].get(key, 0) + 1
+                return
+            try:
+                done = await asyncio.wait_for(entry.done, timeout=self.args.timeout)
+            except asyncio.TimeoutError:
+                self.errors['timeouts'] += 1
+                return
+            result['done'].append(done - entry.sent)
+            if entry.acked is not None:
+                result['ack'].append(entry.acked - entry.sent)
+        finally:
+            del self.pending[user_id]
+            self.idle.add(user_id)
+
+    # ---- Метрики бота ----
+
+    async def sample_metrics(self, session):
+        headers = {"Authorization": f"Bearer {self.args.metrics_token}"} if self.args.metrics_token else {}
+        while True:
+            try:
+                async with session.get(self.args.metrics_url, headers=headers) as resp:
+                    self.samples.append((time.perf_counter(), parse_metrics(await resp.text())))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning(f"Не удалось снять метрики: {e}")
+            await asyncio.sleep(self.args.sample_interval)
+
+    def saturation(self):
+        """Загрузка пулов и очереди вебхука по снятым образцам"""
+        if not self.samples:
+            return {}
+        pools = {}
+        for _, values in self.samples:
+            for (metric, labels), value in values.items():
+                if metric != "db_pool_connections" or 'state="in_use"' not in labels:
+                    continue
+                pool = labels.split('pool="')[1].split('"')[0]
+                max_size = values.get(("db_pool_max_size", f'pool="{pool}"')) or 1
+                pools.setdefault(pool, []).append(value / max_size)
+        first, last = self.samples[0][1], self.samples[-1][1]
+
+        def delta(metric, labels):
+            return last.get((metric, labels), 0) - first.get((metric, labels), 0)
+
+        report = {'samples': len(self.samples), 'pools': {}}
+        for pool, utilization in pools.items():
+            report['pools'][pool] = {
+                'utilization_mean': sum(utilization) / len(utilization),
+                'utilization_max': max(utilization),
+                'saturated_share': sum(1 for u in utilization if u >= 1) / len(utilization),
+                'acquire_timeouts': delta("db_pool_acquire_timeouts_total", f'pool="{pool}"'),
+                'acquire_wait_s': delta("db_pool_acquire_wait_seconds_total", f'pool="{pool}"'),
+            }
+        for metric in ("webhook_pending_updates", "webhook_running_updates"):
+            series = [values.get((metric, ""), 0) for _, values in self.samples]
+            report[metric] = {'mean': sum(series) / len(series), 'max': max(series)}
+        return report
+
+    # ---- Прогон ----
+
+    async def run(self):
+        self.headers = {"X-Telegram-Bot-Api-Secret-Token": self.args.secret} if self.args.secret else {}
+        runner = web.AppRunner(self.api.make_app())
+        await runner.setup()
+        await web.TCPSite(runner, self.args.api_host, self.args.api_port).start()
+        scenarios, weights = list(self.mix), list(self.mix.values())
+        connector = aiohttp.TCPConnector(limit=self.args.connections)
+        timeout = aiohttp.ClientTimeout(total=self.args.timeout)
+        tasks = set()
+        try:
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+                sampler = asyncio.create_task(self.sample_metrics(session)) if self.args.metrics_url else None
+                started = time.perf_counter()
+                next_at = started
+                sent = 0
+                while next_at - started < self.args.duration:
+                    delay = next_at - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    interval = 1 / self.args.rate
+                    next_at += self.rng.expovariate(1 / interval) if self.args.poisson else interval
+                    if not self.idle:
+                        self.errors['no_idle_user'] += 1
+                        continue
+                    user_id = self.idle.pop()
+                    scenario = self.rng.choices(scenarios, weights)[0]
+                    task = asyncio.create_task(self.send(session, scenario, user_id))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                    sent += 1
+                    if sent % max(1, int(self.args.rate * 10)) == 0:
+                        logger.info(f"Отправлено {sent}, в работе {len(self.pending)}")
+                generation_time = time.perf_counter() - started
+                if tasks:
+                    await asyncio.wait(tasks)
+                elapsed = time.perf_counter() - started
+                if sampler:
+                    sampler.cancel()
+        finally:
+            await runner.cleanup()
+        return self.report(sent, generation_time, elapsed)
+
+    def report(self, sent, generation_time, elapsed):
+        completed = sum(len(r['done']) for r in self.results.values())
+        return {
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'params': {k: v for k, v in vars(self.args).items() if k not in ('output', 'database_url', 'secret')},
+            'sent': sent,
+            'completed': completed,
+            'offered_rate': sent / generation_time if generation_time else 0,
+            'throughput': completed / elapsed if elapsed else 0,
+            'errors': self.errors,
+            'latency': {
+                scenario: {stage: percentiles(values) for stage, values in result.items()}
+                for scenario, result in self.results.items()
+            },
+            'latency_all': percentiles([v for r in self.results.values() for v in r['done']]),
+            'saturation': self.saturation(),
+            'bot_api': self.api.stats(),
+        }
+
+
+async def prepare_users(args):
+    """Группы из базы и пользователи нагрузочного прогона с выбранной группой"""
+    conn = await asyncpg.connect(args.database_url)
+    try:
+        groups = [row['name'] for row in await conn.fetch("SELECT name FROM groups ORDER BY name")]
+        if not groups:
+            raise SystemExit("В таблице groups нет групп: запустите бота, чтобы он загрузил расписание")
+        rng = random.Random(args.seed)
+        await conn.executemany(
+            """
+            INSERT INTO users (user_id, group_name, username) VALUES ($1, $2, $3)
+            ON CONFLICT (user_id) DO UPDATE SET group_name = EXCLUDED.group_name
+            """,
+            [(user_id, rng.choice(groups), f"load{user_id}") for user_id in range(args.user_base, args.user_base + args.users)]
+        )
+        return groups
+    finally:
+        await conn.close()
+
+
+async def cleanup_users(args):
+    conn = await asyncpg.connect(args.database_url)
+    try:
+        status = await conn.execute(
+            "DELETE FROM users WHERE user_id >= $1 AND user_id < $2", args.user_base, args.user_base + args.users
+        )
+        logger.info(f"Пользователи прогона удалены: {status}")
+    finally:
+        await conn.close()
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"неизвестный сценарий {name!r}, есть: {', '.join(DEFAULT_MIX)}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон вебхука с заглушкой Bot API")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook", help="адрес вебхука бота")
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET"), help="WEBHOOK_SECRET бота")
+    parser.add_argument("--metrics-url", default="http://127.0.0.1:8080/metrics", help="пусто — не снимать метрики")
+    parser.add_argument("--metrics-token", default=os.getenv("METRICS_TOKEN"))
+    parser.add_argument("--sample-interval", type=float, default=1)
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"), help="база бота для заведения пользователей")
+    parser.add_argument("--api-host", default="127.0.0.1")
+    parser.add_argument("--api-port", type=int, default=8082, help="порт заглушки Bot API (TELEGRAM_API_URL бота)")
+    parser.add_argument("--api-latency", type=float, default=30, help="задержка заглушки Bot API, мс")
+    parser.add_argument("--api-jitter", type=float, default=20, help="случайная добавка к задержке, мс")
+    parser.add_argument("--flood-rate", type=float, default=0, help="доля ответов 429 от заглушки")
+    parser.add_argument("--rate", type=float, default=50, help="апдейтов в секунду")
+    parser.add_argument("--poisson", action="store_true", help="пуассоновский поток вместо равномерного")
+    parser.add_argument("--duration", type=float, default=30, help="длительность генерации, с")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--user-base", type=int, default=9_000_000_000, help="первый id пользователя прогона")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help="смесь сценариев, например menu=0.35,schedule=0.45,page=0.1,group=0.1")
+    parser.add_argument("--connections", type=int, default=100, help="одновременных HTTP-соединений к вебхуку")
+    parser.add_argument("--timeout", type=float, default=15, help="сколько ждать ответа бота, с")
+    parser.add_argument("--cleanup", action="store_true", help="удалить пользователей прогона в конце")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench-loadgen.json")
+    return parser.parse_args(argv)
+
+
+def print_report(report):
+    print(
+        f"Отправлено {report['sent']} ({report['offered_rate']:.1f}/с), обработано {report['completed']} "
+        f"({report['throughput']:.1f}/с), ошибки: {report['errors']}"
+    )
+    for scenario, stages in report['latency'].items():
+        for stage, p in stages.items():
+            if p['count']:
+                print(
+                    f"{scenario:<9} {stage:<8} n={p['count']:<6} p50 {p['p50_ms']:7.1f}  p95 {p['p95_ms']:7.1f}  "
+                    f"p99 {p['p99_ms']:7.1f}  max {p['max_ms']:7.1f} мс"
+                )
+    for pool, s in report['saturation'].get('pools', {}).items():
+        print(
+            f"пул {pool:<12} загрузка avg {s['utilization_mean']:.0%} max {s['utilization_max']:.0%}, "
+            f"в насыщении {s['saturated_share']:.0%} времени, таймаутов {s['acquire_timeouts']:.0f}"
+        )
+    pending = report['saturation'].get('webhook_pending_updates')
+    if pending:
+        print(f"очередь вебхука avg {pending['mean']:.1f} max {pending['max']:.0f}")
+
+
+async def amain(args):
+    if not args.database_url:
+        raise SystemExit("Нужен --database-url (или DATABASE_URL): пользователям прогона нужна группа в базе бота")
+    groups = await prepare_users(args)
+    try:
+        return await LoadGenerator(args, groups).run()
+    finally:
+        if args.cleanup:
+            await cleanup_users(args)
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s %(name)s: %(message)s')
+    args = parse_args(argv)
+    report = asyncio.run(amain(args))
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print_report(report)
+    print(f"Результаты сохранены в {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
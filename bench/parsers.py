@@ -0,0 +1,204 @@
+"""Бенчмарк парсеров расписания и замен на синтетических файлах.
+
+    python -m bench.parsers --groups 100 --repeat 5 --output bench-parsers.json
+
+Для каждого движка чтения таблиц меряются время разбора (min/медиана),
+пиковая память (tracemalloc) и ячеек в секунду. Результаты пишутся в JSON,
+чтобы сравнивать прогоны между коммитами. Реальный файл колледжа можно
+добавить к прогону через --xls/--docx.
+
+Разбор синтетического файла сверяется с генератором: если парсер не нашел
+все группы или практики, время ничего не говорит, и бенчмарк завершается с
+кодом 1. Число пар по неделям только сравнивается с раскладкой фикстуры и
+пишется в отчет: раскладка не сверена с настоящим файлом колледжа.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import warnings
+import tracemalloc
+import statistics
+import contextlib
+import importlib.util
+from datetime import datetime
+
+import pandas as pd
+
+from bot.parsers.schedule import parse_schedule, parse_replacements
+from .fixtures import make_schedule, make_replacements
+
+# Движок pandas -> модуль, без которого он недоступен
+ENGINES = {'xlrd': 'xlrd', 'openpyxl': 'openpyxl', 'calamine': 'python_calamine'}
+
+
+def available_engines():
+    return [engine for engine, module in ENGINES.items() if importlib.util.find_spec(module)]
+
+
+@contextlib.contextmanager
+def _quiet():
+    # Парсеры пишут в stdout и лог на каждую строку; в бенчмарке это шум, а не нагрузка
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        logging.disable(logging.CRITICAL)
+        try:
+            yield
+        finally:
+            logging.disable(logging.NOTSET)
+
+
+def week_lessons(schedule):
+    """Число пар по неделям в результате parse_schedule, без групп на практике"""
+    counts = {1: 0, 2: 0}
+    for days in (schedule or {}).values():
+        if not isinstance(days, dict) or 'practice' in days:
+            continue
+        for day_data in days.values():
+            if isinstance(day_data, dict):
+                for week in counts:
+                    counts[week] += len(day_data.get(week) or [])
+    return counts
+
+
+def parsed_groups(schedule):
+    """Число групп в результате parse_schedule и множество групп на практике"""
+    schedule = schedule or {}
+    practice = {group for group, days in schedule.items() if isinstance(days, dict) and 'practice' in days}
+    return len(schedule), practice
+
+
+def measure(parse, content, cells, repeat):
+    """Время и пиковая память одного парсера на одном файле"""
+    timings = []
+    result = None
+    with _quiet():
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = parse(content)
+            timings.append(time.perf_counter() - started)
+        tracemalloc.start()
+        parse(content)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    median = statistics.median(timings)
+    return {
+        'file_bytes': len(content),
+        'cells': cells,
+        'runs': repeat,
+        'min_s': min(timings),
+        'median_s': median,
+        'cells_per_s': cells / median if median else None,
+        'peak_memory_bytes': peak,
+        'groups_parsed': len(result or {}),
+        'result': result,
+    }
+
+
+def run(args):
+    results = []
+    schedule = make_schedule(
+        groups=args.groups, days=args.days, lessons=args.lessons, split_ratio=args.split_ratio,
+        practice_groups=args.practice_groups, seed=args.seed,
+    )
+    replacements = make_replacements(
+        groups=args.groups, dates=args.dates, rows_per_date=args.rows, seed=args.seed,
+    )
+    inputs = [('synthetic.xlsx', schedule.content, schedule.cells)]
+    if args.xls:
+        with open(args.xls, "rb") as f:
+            content = f.read()
+        # Для настоящего файла число ячеек заранее неизвестно, скорость в ячейках не считается
+        inputs.append((os.path.basename(args.xls), content, None))
+
+    engines = args.engines.split(",") if args.engines else available_engines()
+    for name, content, cells in inputs:
+        for engine in engines:
+            print(f"schedule {name} [{engine}]...", file=sys.stderr)
+            row = measure(lambda data: parse_schedule(data, engines=(engine,)), content, cells or 0, args.repeat)
+            row.update({'parser': 'schedule', 'input': name, 'engine': engine})
+            result = row.pop('result')
+            parsed = week_lessons(result)
+            row['week_lessons'] = parsed
+            # Движок, не понимающий формат (xlrd и xlsx), возвращает пустой результат
+            if not row['groups_parsed']:
+                row['error'] = "формат не поддерживается или разбор не удался"
+                row['cells_per_s'] = None
+            elif cells is not None:
+                groups, practice = parsed_groups(result)
+                if groups != schedule.groups or practice != set(schedule.practice):
+                    row['error'] = (
+                        f"неверный разбор: {groups} групп и практики {sorted(practice)}, "
+                        f"ожидалось {schedule.groups} и {sorted(schedule.practice)}"
+                    )
+                    row['structure_error'] = True
+                    row['cells_per_s'] = None
+                row['expected_week_lessons'] = schedule.week_lessons
+                if parsed != schedule.week_lessons:
+                    row['layout_mismatch'] = True
+            results.append(row)
+
+    docx_inputs = [('synthetic.docx', replacements.content, replacements.cells)]
+    if args.docx:
+        with open(args.docx, "rb") as f:
+            docx_inputs.append((os.path.basename(args.docx), f.read(), 0))
+    for name, content, cells in docx_inputs:
+        print(f"replacements {name} [python-docx]...", file=sys.stderr)
+        row = measure(parse_replacements, content, cells, args.repeat)
+        row.pop('result')
+        row.update({'parser': 'replacements', 'input': name, 'engine': 'python-docx'})
+        results.append(row)
+
+    return {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+        'params': {k: v for k, v in vars(args).items() if k != 'output'},
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк парсеров расписания и замен")
+    parser.add_argument("--groups", type=int, default=100)
+    parser.add_argument("--days", type=int, default=6)
+    parser.add_argument("--lessons", type=int, default=4)
+    parser.add_argument("--split-ratio", type=float, default=0.15, help="доля пар с разделением по неделям")
+    parser.add_argument("--practice-groups", type=int, default=3)
+    parser.add_argument("--dates", type=int, default=2, help="дней в файле замен")
+    parser.add_argument("--rows", type=int, default=40, help="строк замен на день")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--engines", help="движки через запятую (по умолчанию все установленные)")
+    parser.add_argument("--xls", help="реальный файл расписания для сравнения")
+    parser.add_argument("--docx", help="реальный файл замен для сравнения")
+    parser.add_argument("--output", default="bench-parsers.json")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    for row in report['results']:
+        status = row.get('error') or f"{row['groups_parsed']} групп"
+        rate = f"{row['cells_per_s']:,.0f} ячеек/с" if row['cells_per_s'] else "-"
+        print(
+            f"{row['parser']:<13} {row['engine']:<11} {row['input']:<16} "
+            f"median {row['median_s'] * 1000:8.1f} мс  {rate:>18}  "
+            f"peak {row['peak_memory_bytes'] / 1048576:6.1f} МБ  {status}"
+        )
+        if row.get('layout_mismatch'):
+            print(
+                f"  пары по неделям {row['week_lessons']} не совпадают с раскладкой фикстуры "
+                f"{row['expected_week_lessons']}"
+            )
+    print(f"Результаты сохранены в {args.output}")
+    if any(row.get('structure_error') for row in report['results']):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""Локальная замена сайта колледжа для офлайн-прогонов конвейера скачивание → разбор → запись → уведомления.
+
+    python -m bench.standin --port 8081 --groups 100 --latency 200 --bandwidth 262144 \\
+        --error-rate 0.05 --rotate 300
+    SCHEDULE_URL=http://127.0.0.1:8081/doc/raspisanie/raspisanie.xls \\
+    REPLACEMENTS_URL=http://127.0.0.1:8081/doc/raspisanie/zameni.docx python -m bot.main
+
+Файлы берутся из --fixtures (raspisanie*.xls[x], zameni*.docx) или
+генерируются bench.fixtures. Ротация подменяет файлы по кругу (или с новым
+seed), чтобы проверять реакцию бота на изменившееся расписание и замены.
+Статистика запросов — GET /__stats, внеочередная ротация — POST /__rotate.
+"""
+import os
+import glob
+import random
+import asyncio
+import hashlib
+import logging
+import argparse
+from email.utils import formatdate
+
+from aiohttp import web
+
+from .fixtures import make_schedule, make_replacements
+
+logger = logging.getLogger("standin")
+
+SCHEDULE_PATH = "/doc/raspisanie/raspisanie.xls"
+REPLACEMENTS_PATH = "/doc/raspisanie/zameni.docx"
+CONTENT_TYPES = {
+    SCHEDULE_PATH: "application/vnd.ms-excel",
+    REPLACEMENTS_PATH: "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+}
+# Виды внедряемых ошибок
+FAULTS = ("500", "503", "stall", "truncated", "empty")
+
+
+class FixtureSet:
+    """Текущие файлы стенда и их ротация"""
+
+    def __init__(self, args):
+        self.args = args
+        self.seed = args.seed
+        self.position = 0
+        self.files = {}
+        self.rotations = 0
+        self._schedules = sorted(glob.glob(os.path.join(args.fixtures, "raspisanie*"))) if args.fixtures else []
+        self._replacements = sorted(glob.glob(os.path.join(args.fixtures, "zameni*"))) if args.fixtures else []
+        self.load()
+
+    def _set(self, path, content):
+        self.files[path] = {
+            'content': content,
+            'etag': '"' + hashlib.sha1(content).hexdigest() + '"',
+            'last_modified': formatdate(usegmt=True),
+        }
+
+    def load(self):
+        if self._schedules:
+            with open(self._schedules[self.position % len(self._schedules)], "rb") as f:
+                self._set(SCHEDULE_PATH, f.read())
+        else:
+            self._set(SCHEDULE_PATH, make_schedule(groups=self.args.groups, seed=self.seed).content)
+        if self._replacements:
+            with open(self._replacements[self.position % len(self._replacements)], "rb") as f:
+                self._set(REPLACEMENTS_PATH, f.read())
+        else:
+            self._set(REPLACEMENTS_PATH, make_replacements(
+                groups=self.args.groups, rows_per_date=self.args.replacement_rows, seed=self.seed
+            ).content)
+
+    def rotate(self):
+        self.position += 1
+        self.seed += 1
+        self.rotations += 1
+        self.load()
+        logger.info(f"Ротация #{self.rotations}: " + ", ".join(
+            f"{path} {len(f['content'])} байт {f['etag']}" for path, f in self.files.items()
+        ))
+
+
+class StandIn:
+    def __init__(self, args):
+        self.args = args
+        self.fixtures = FixtureSet(args)
+        self.rng = random.Random(args.seed)
+        self.stats = {'requests': 0, 'ok': 0, 'not_modified': 0, **{f"fault_{f}": 0 for f in FAULTS}}
+
+    async def _send(self, request, path, body, status=200, truncate=False):
+        entry = self.fixtures.files[path]
+        response = web.StreamResponse(status=status, headers={
+            "Content-Type": CONTENT_TYPES[path],
+            "ETag": entry['etag'],
+            "Last-Modified": entry['last_modified'],
+        })
+        response.content_length = len(entry['content']) if truncate else len(body)
+        await response.prepare(request)
+        if truncate:
+            body = body[:len(body) // 2]
+        # Ограничение полосы: порции по 1/10 секундного объема
+        chunk = max(1024, self.args.bandwidth // 10) if self.args.bandwidth else len(body) or 1
+        for offset in range(0, len(body), chunk):
+            await response.write(body[offset:offset + chunk])
+            if self.args.bandwidth:
+                await asyncio.sleep(chunk / self.args.bandwidth)
+        if truncate:
+            # Обрываем соединение, не дописав объявленную длину
+            request.transport.close()
+            return response
+        await response.write_eof()
+        return response
+
+    async def handle_file(self, request):
+        path = request.path
+        entry = self.fixtures.files[path]
+        self.stats['requests'] += 1
+        latency = self.args.latency + self.rng.uniform(0, self.args.jitter)
+        if latency:
+            await asyncio.sleep(latency / 1000)
+
+        if self.rng.random() < self.args.error_rate:
+            fault = self.rng.choice(self.args.faults)
+            self.stats[f"fault_{fault}"] += 1
+            if fault in ("500", "503"):
+                return web.Response(status=int(fault), text="Service Unavailable")
+            if fault == "stall":
+                await asyncio.sleep(self.args.stall)
+            elif fault == "empty":
+                return await self._send(request, path, b"")
+            elif fault == "truncated":
+                return await self._send(request, path, entry['content'], truncate=True)
+
+        if self.args.etag and entry['etag'] in request.headers.get("If-None-Match", ""):
+            self.stats['not_modified'] += 1
+            return web.Response(status=304, headers={"ETag": entry['etag']})
+        self.stats['ok'] += 1
+        return await self._send(request, path, entry['content'])
+
+    async def handle_stats(self, request):
+        return web.json_response({
+            **self.stats,
+            'rotations': self.fixtures.rotations,
+            'files': {path: {'bytes': len(f['content']), 'etag': f['etag']} for path, f in self.fixtures.files.items()},
+        })
+
+    async def handle_rotate(self, request):
+        self.fixtures.rotate()
+        return await self.handle_stats(request)
+
+    async def _rotate_forever(self, app):
+        while True:
+            await asyncio.sleep(self.args.rotate)
+            self.fixtures.rotate()
+
+    async def on_startup(self, app):
+        if self.args.rotate:
+            app['rotate_task'] = asyncio.create_task(self._rotate_forever(app))
+
+    async def on_cleanup(self, app):
+        task = app.get('rotate_task')
+        if task:
+            task.cancel()
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_get(SCHEDULE_PATH, self.handle_file)
+        app.router.add_get(REPLACEMENTS_PATH, self.handle_file)
+        app.router.add_get("/__stats", self.handle_stats)
+        app.router.add_post("/__rotate", self.handle_rotate)
+        app.on_startup.append(self.on_startup)
+        app.on_cleanup.append(self.on_cleanup)
+        return app
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Локальный стенд файлов расписания и замен")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--fixtures", help="каталог с raspisanie*.xls[x] и zameni*.docx (по умолчанию генерация)")
+    parser.add_argument("--groups", type=int, default=100)
+    parser.add_argument("--replacement-rows", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0, help="задержка ответа, мс")
+    parser.add_argument("--jitter", type=float, default=0, help="случайная добавка к задержке, мс")
+    parser.add_argument("--bandwidth", type=int, default=0, help="полоса, байт/с (0 — без ограничения)")
+    parser.add_argument("--no-etag", dest="etag", action="store_false", help="не отвечать 304 на If-None-Match")
+    parser.add_argument("--error-rate", type=float, default=0, help="доля запросов с внедренной ошибкой")
+    parser.add_argument("--faults", default=",".join(FAULTS), help=f"виды ошибок через запятую: {', '.join(FAULTS)}")
+    parser.add_argument("--stall", type=float, default=60, help="на сколько секунд зависает ответ при stall")
+    parser.add_argument("--rotate", type=float, default=0, help="период ротации файлов, с (0 — без ротации)")
+    args = parser.parse_args(argv)
+    args.faults = [fault for fault in args.faults.split(",") if fault in FAULTS] or list(FAULTS)
+    return args
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s %(name)s: %(message)s')
+    args = parse_args(argv)
+    web.run_app(StandIn(args).make_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
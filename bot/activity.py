@@ -0,0 +1,172 @@
+import os
+import asyncio
+import logging
+from datetime import datetime
+
+import asyncpg
+
+from .bus import bus, USER_GROUP_CHANGED
+
+logger = logging.getLogger("activity")
+
+FLUSH_INTERVAL = int(os.getenv("USER_WRITES_FLUSH_MS", 500)) / 1000
+MAX_BATCH = int(os.getenv("USER_WRITES_BATCH", 500))
+
+# Одна многострочная вставка на всю пачку. NULL в колонке означает "не менять"
+UPSERT_USERS_SQL = """
+    INSERT INTO users (user_id, group_name, role, username, last_seen)
+    SELECT * FROM unnest($1::bigint[], $2::text[], $3::text[], $4::text[], $5::timestamp[])
+    ON CONFLICT (user_id) DO UPDATE SET
+        group_name = COALESCE(EXCLUDED.group_name, users.group_name),
+        role = COALESCE(EXCLUDED.role, users.role),
+        username = COALESCE(EXCLUDED.username, users.username),
+        last_seen = GREATEST(users.last_seen, EXCLUDED.last_seen)
+"""
+
+
+class UserWriteBehind:
+    """Отложенная пакетная запись пользователей: выбор группы, роль, last_seen"""
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL, max_batch=MAX_BATCH):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        # {user_id: {'group_name': ..., 'role': ..., 'username': ..., 'last_seen': ...}}
+        self._pending = {}
+        # Пачка, которая сейчас пишется в БД; до коммита ее выбор группы виден в pending_group
+        self._in_flight = {}
+        self._wakeup = asyncio.Event()
+        self._pool = None
+        self._task = None
+        self.flushed = 0
+        self.batches = 0
+        self.failed = 0
+
+    def start(self, pool):
+        """Запускает фоновый сброс буфера в БД"""
+        self._pool = pool
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает фоновый сброс и записывает остаток буфера"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def _record(self, user_id, **fields):
+        entry = self._pending.setdefault(user_id, {})
+        entry.update({k: v for k, v in fields.items() if v is not None})
+        entry['last_seen'] = datetime.now()
+        if len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+
+    def touch(self, user_id, username=None):
+        """Отмечает активность пользователя"""
+        self._record(user_id, username=username or None)
+
+    def set_group(self, user_id, group_name, username=None):
+        self._record(user_id, group_name=group_name, username=username or None)
+        # Другие реплики не должны перезаписать выбор устаревшей группой из своего буфера
+        bus.emit(USER_GROUP_CHANGED, user_id=user_id)
+
+    def set_role(self, user_id, role):
+        self._record(user_id, role=role)
+
+    def pending_group(self, user_id):
+        """Группа, выбранная пользователем, но еще не записанная в БД"""
+        for buffer in (self._pending, self._in_flight):
+            entry = buffer.get(user_id)
+            if entry and entry.get('group_name'):
+                return entry['group_name']
+        return None
+
+    def forget_group(self, user_id):
+        """Отбрасывает незаписанный выбор группы (пользователь сменил ее на другой реплике)"""
+        for buffer in (self._pending, self._in_flight):
+            entry = buffer.get(user_id)
+            if entry:
+                entry.pop('group_name', None)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка при сбросе буфера пользователей: {e}")
+
+    async def flush(self):
+        """Записывает накопленные изменения одной вставкой"""
+        if not self._pending or self._pool is None:
+            return 0
+        batch, self._pending = self._pending, {}
+        self._in_flight = batch
+        rows = [
+            (user_id, e.get('group_name'), e.get('role'), e.get('username'), e.get('last_seen'))
+            for user_id, e in batch.items()
+        ]
+        try:
+            async with self._pool.acquire() as conn:
+                try:
+                    await conn.execute(UPSERT_USERS_SQL, *[list(col) for col in zip(*rows)])
+                except (asyncpg.InterfaceError, asyncpg.PostgresConnectionError):
+                    raise
+                except Exception as e:
+                    # Одна плохая строка (например, несуществующая группа) не должна терять остальные
+                    logger.warning(f"Пакетная запись {len(rows)} пользователей не удалась: {e}, пишем по одному")
+                    for row in rows:
+                        try:
+                            await conn.execute(UPSERT_USERS_SQL, *[[v] for v in row])
+                        except Exception as row_error:
+                            self.failed += 1
+                            logger.error(f"Не удалось записать пользователя {row[0]}: {row_error}")
+        except BaseException:
+            # Нет соединения или таймаут пула: пачка возвращается в буфер до следующего сброса
+            self._restore(batch)
+            raise
+        finally:
+            self._in_flight = {}
+        self.flushed += len(rows)
+        self.batches += 1
+        return len(rows)
+
+    def _restore(self, batch):
+        """Возвращает неудачную пачку в буфер, не затирая более свежие изменения"""
+        for user_id, entry in batch.items():
+            newer = self._pending.get(user_id)
+            if newer is None:
+                self._pending[user_id] = entry
+                continue
+            merged = {**entry, **newer}
+            if entry.get('last_seen') and newer.get('last_seen'):
+                merged['last_seen'] = max(entry['last_seen'], newer['last_seen'])
+            self._pending[user_id] = merged
+
+    def stats(self):
+        return {
+            'pending': len(self._pending) + len(self._in_flight),
+            'flushed': self.flushed,
+            'batches': self.batches,
+            'failed': self.failed,
+        }
+
+
+# Общий буфер процесса
+user_activity = UserWriteBehind()
+
+
+def _on_user_group_changed(data):
+    if data.get('user_id'):
+        user_activity.forget_group(data['user_id'])
+
+
+bus.subscribe(USER_GROUP_CHANGED, _on_user_group_changed)
@@ -1,28 +1,47 @@
 from aiogram import Router, types
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 import asyncpg
+import asyncio
+import inspect
+import logging
 import os
 
+from .pools import format_pools_stats
+from .activity import user_activity
+from .outbox import outbox
+from .bus import bus
+from .leader import leader
+from .querystats import format_query_stats, reset_query_stats
+from .tracing import format_traces, reset_traces
+from .profiling import (
+    ProfilingBusy, profile_cpu, sample_stacks, format_samples, memory_diff, memory_stop,
+    format_memory_diff, loop_monitor, format_loop_stats,
+)
+
 router = Router()
 
 ADMINS = [int(x) for x in os.getenv("ADMINS", "").split(",") if x]
+# Ссылки на фоновые задачи, иначе сборщик мусора может снять их на полпути
+_background_tasks = set()
 
 def admin_only(func):
+    # aiogram передает во wrapper все данные апдейта, оставляем только те, что ждет обработчик
+    params = set(inspect.signature(func).parameters)
     async def wrapper(message: types.Message, *args, **kwargs):
         if message.from_user.id not in ADMINS:
             await message.answer("⛔️ Доступ только для админов!")
             return
-        return await func(message, *args, **kwargs)
+        return await func(message, *args, **{k: v for k, v in kwargs.items() if k in params})
     return wrapper
 
 @router.message(Command("stats"))
 @admin_only
-async def stats(message: types.Message, bot):
-    pool: asyncpg.Pool = message.bot.dispatcher['db']
+async def stats(message: types.Message, pools):
+    pool: asyncpg.Pool = pools['admin']
     async with pool.acquire() as conn:
         total = await conn.fetchval("SELECT COUNT(*) FROM users")
         today = await conn.fetchval("SELECT COUNT(*) FROM users WHERE joined_at::date = CURRENT_DATE")
-        week = await conn.fetchval("SELECT COUNT(*) FROM users WHERE joined_at >= CURRENT_DATE - INTERVAL '7 days'")
+        week = await conn.fetchval("SELECT COUNT(*) FROM users WHERE last_seen >= CURRENT_DATE - INTERVAL '7 days'")
         students = await conn.fetchval("SELECT COUNT(*) FROM users WHERE role='student'")
         teachers = await conn.fetchval("SELECT COUNT(*) FROM users WHERE role='teacher'")
         no_role = await conn.fetchval("SELECT COUNT(*) FROM users WHERE role IS NULL")
@@ -39,8 +58,8 @@ async def stats(message: types.Message, bot):
 
 @router.message(Command("groups"))
 @admin_only
-async def group_stats(message: types.Message, bot):
-    pool: asyncpg.Pool = message.bot.dispatcher['db']
+async def group_stats(message: types.Message, pools):
+    pool: asyncpg.Pool = pools['admin']
     async with pool.acquire() as conn:
         group_rows = await conn.fetch("SELECT group_name, COUNT(*) as cnt FROM users WHERE group_name IS NOT NULL GROUP BY group_name ORDER BY cnt DESC")
     text = "<b>📚 Статистика по группам:</b>\n"
@@ -49,3 +68,98 @@ async def group_stats(message: types.Message, bot):
     await message.answer(text, parse_mode="HTML")
 
     # The group_stats function and its command handler have been removed.
+
+@router.message(Command("pools"))
+@admin_only
+async def pools_stats(message: types.Message, pools):
+    writes = user_activity.stats()
+    text = format_pools_stats(pools)
+    text += (f"\n\n<b>✍️ Отложенная запись пользователей:</b>\n"
+             f"В буфере: {writes['pending']}, записано: {writes['flushed']} "
+             f"за {writes['batches']} пачек, ошибок: {writes['failed']}")
+    text += "\n\n<b>📤 Очередь отправки:</b>"
+    for lane_name, lane_stats in outbox.stats().items():
+        text += (f"\n{lane_name}: в очереди {lane_stats['queued']}, отправляется {lane_stats['in_flight']}"
+                 f"/{lane_stats['workers']}")
+        if lane_stats['paused_for']:
+            text += f", пауза {lane_stats['paused_for']:.0f} с"
+    bus_stats = bus.stats()
+    text += (f"\n\n<b>📡 Шина инвалидации:</b> {'подключена' if bus_stats['connected'] else 'отключена'}, "
+             f"получено {bus_stats['received']}, отправлено {bus_stats['published']}, "
+             f"переподключений {bus_stats['reconnects']}")
+    text += f"\n<b>👑 Лидер фоновых задач:</b> {'эта реплика' if leader.is_leader else 'другая реплика'}"
+    await message.answer(text, parse_mode="HTML")
+
+
+@router.message(Command("queries"))
+@admin_only
+async def queries_stats(message: types.Message, command: CommandObject):
+    args = (command.args or "").strip()
+    if args == "reset":
+        reset_query_stats()
+        await message.answer("🧹 Статистика запросов сброшена")
+        return
+    limit = int(args) if args.isdigit() else 10
+    await message.answer(format_query_stats(limit), parse_mode="HTML")
+
+@router.message(Command("traces"))
+@admin_only
+async def traces(message: types.Message, command: CommandObject):
+    args = (command.args or "").strip()
+    if args == "reset":
+        reset_traces()
+        await message.answer("🧹 Трассировки сброшены")
+        return
+    limit = int(args) if args.isdigit() else 5
+    await message.answer(format_traces(limit), parse_mode="HTML")
+
+
+async def _send_profile(message: types.Message, mode, seconds):
+    try:
+        if mode == "sample":
+            text = format_samples(await sample_stacks(seconds))
+        else:
+            text = await profile_cpu(seconds)
+    except ProfilingBusy as e:
+        await message.answer(f"⏳ {e}")
+        return
+    except Exception as e:
+        logging.error(f"[profile] Ошибка профилирования: {e}")
+        await message.answer("❌ Ошибка профилирования")
+        return
+    await message.answer_document(
+        types.BufferedInputFile(text.encode(), filename=f"profile-{mode}.txt"),
+        caption=f"⏱ {'Сэмплирование' if mode == 'sample' else 'cProfile'} за {seconds:.0f} с",
+    )
+
+@router.message(Command("profile"))
+@admin_only
+async def profile(message: types.Message, command: CommandObject):
+    args = (command.args or "").split()
+    seconds = float(args[0]) if args and args[0].isdigit() else 10
+    mode = "sample" if "sample" in args else "cpu"
+    await message.answer(f"⏱ Профилирую {seconds:.0f} с ({mode}), результат придет файлом")
+    # Профилирование идет в фоне, чтобы не держать очередь апдейтов админа
+    task = asyncio.create_task(_send_profile(message, mode, seconds))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+@router.message(Command("memory"))
+@admin_only
+async def memory(message: types.Message, command: CommandObject):
+    args = (command.args or "").strip()
+    if args == "stop":
+        memory_stop()
+        await message.answer("🧠 tracemalloc выключен")
+        return
+    limit = int(args) if args.isdigit() else 15
+    await message.answer(format_memory_diff(memory_diff(limit)), parse_mode="HTML")
+
+@router.message(Command("loop"))
+@admin_only
+async def loop_lag(message: types.Message, command: CommandObject):
+    if (command.args or "").strip() == "reset":
+        loop_monitor.reset()
+        await message.answer("🧹 Статистика event loop сброшена")
+        return
+    await message.answer(format_loop_stats(loop_monitor.stats()), parse_mode="HTML")
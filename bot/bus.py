@@ -0,0 +1,180 @@
+import os
+import uuid
+import json
+import asyncio
+import logging
+
+import asyncpg
+
+from .metrics import Counter, register_collector
+
+logger = logging.getLogger("bus")
+
+# Канал NOTIFY, общий для всех реплик бота
+BUS_CHANNEL = os.getenv("BUS_CHANNEL", "bot_invalidation")
+# LISTEN не работает через pgbouncer в режиме transaction, поэтому адрес можно задать отдельно
+BUS_DSN = os.getenv("BUS_DSN") or os.getenv("DATABASE_URL")
+# Пауза между попытками переподключения слушателя, секунды
+BUS_RECONNECT_DELAY = float(os.getenv("BUS_RECONNECT_DELAY", 5))
+
+# Типы событий
+SNAPSHOT_PUBLISHED = "snapshot"
+WEEK_FLIPPED = "week"
+USER_GROUP_CHANGED = "user_group"
+GROUPS_CHANGED = "groups"
+FSM_CHANGED = "fsm"
+
+BUS_EVENTS = Counter(
+    "bus_events_total", "События шины инвалидации", ("type", "direction"),
+)
+
+
+class InvalidationBus:
+    """Шина инвалидации кэшей между репликами поверх Postgres LISTEN/NOTIFY.
+
+    Слушает канал на отдельном соединении, публикует через пул. Свои же
+    уведомления процесс пропускает: инициатор сбрасывает кэши сам.
+    """
+
+    def __init__(self, channel=BUS_CHANNEL):
+        self.channel = channel
+        self.origin = uuid.uuid4().hex[:12]
+        self._handlers = {}
+        self._pool = None
+        self._dsn = None
+        self._task = None
+        self._lost = asyncio.Event()
+        self._pending = set()
+        self.connected = False
+        self.received = 0
+        self.published = 0
+        self.reconnects = 0
+
+    def subscribe(self, event_type, handler):
+        """Регистрирует обработчик события: handler(data), sync или async"""
+        self._handlers.setdefault(event_type, []).append(handler)
+
+    def start(self, pool, dsn=BUS_DSN):
+        """Запускает слушателя; pool используется для публикации"""
+        self._pool = pool
+        self._dsn = dsn
+        if self._task is None and dsn:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+
+    async def publish(self, event_type, **data):
+        """Рассылает событие остальным репликам"""
+        if self._pool is None:
+            return
+        payload = json.dumps({'type': event_type, 'origin': self.origin, 'data': data}, ensure_ascii=False)
+        try:
+            async with self._pool.acquire() as conn:
+                await conn.execute("SELECT pg_notify($1, $2)", self.channel, payload)
+        except Exception as e:
+            # Реплики догонят состояние по TTL кэшей, сообщение не критично
+            logger.error(f"Не удалось опубликовать событие {event_type}: {e}")
+            return
+        self.published += 1
+        BUS_EVENTS.inc(type=event_type, direction="out")
+
+    def emit(self, event_type, **data):
+        """publish для синхронного кода: отправка уходит в фоновую задачу"""
+        if self._pool is None:
+            return
+        task = asyncio.get_running_loop().create_task(self.publish(event_type, **data))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _dispatch(self, event_type, data):
+        for handler in self._handlers.get(event_type, ()):
+            try:
+                result = handler(data)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                logger.error(f"Ошибка обработчика события {event_type}: {e}")
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            logger.warning(f"Некорректное сообщение шины: {payload[:200]}")
+            return
+        if message.get('origin') == self.origin:
+            return
+        event_type = message.get('type')
+        self.received += 1
+        BUS_EVENTS.inc(type=event_type, direction="in")
+        task = asyncio.get_running_loop().create_task(self._dispatch(event_type, message.get('data') or {}))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _resync(self):
+        # Пока слушателя не было, уведомления терялись: сбрасываем все, что умеем сбрасывать целиком.
+        # FSM_CHANGED без ключа очищает весь кэш состояний
+        for event_type in (SNAPSHOT_PUBLISHED, WEEK_FLIPPED, GROUPS_CHANGED, FSM_CHANGED):
+            await self._dispatch(event_type, {})
+
+    async def _run(self):
+        first = True
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(
+                    self._dsn, server_settings={'application_name': "raspisanie-bot:bus"}
+                )
+                self._lost.clear()
+                conn.add_termination_listener(lambda _: self._lost.set())
+                await conn.add_listener(self.channel, self._on_notify)
+                self.connected = True
+                logger.info(f"Шина инвалидации слушает канал {self.channel}")
+                if not first:
+                    self.reconnects += 1
+                    await self._resync()
+                first = False
+                await self._lost.wait()
+                logger.warning("Соединение шины инвалидации потеряно")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка соединения шины инвалидации: {e}")
+            finally:
+                self.connected = False
+                if conn is not None and not conn.is_closed():
+                    try:
+                        await conn.close(timeout=5)
+                    except Exception:
+                        conn.terminate()
+            await asyncio.sleep(BUS_RECONNECT_DELAY)
+
+    def stats(self):
+        return {
+            'connected': self.connected,
+            'received': self.received,
+            'published': self.published,
+            'reconnects': self.reconnects,
+        }
+
+
+# Общая шина процесса
+bus = InvalidationBus()
+
+
+def _bus_metrics():
+    return [
+        ("bus_connected", "gauge", "Слушатель шины инвалидации подключен", [({}, int(bus.connected))]),
+        ("bus_reconnects_total", "counter", "Переподключения слушателя шины", [({}, bus.reconnects)]),
+    ]
+
+
+register_collector(_bus_metrics)
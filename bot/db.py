@@ -1,3 +1,5 @@
+from .metrics import cache_hit, cache_miss
+from .bus import bus, WEEK_FLIPPED, GROUPS_CHANGED, SNAPSHOT_PUBLISHED
 
 GROUPS_TABLE = """
 CREATE TABLE IF NOT EXISTS groups (
@@ -11,7 +13,9 @@ CREATE TABLE IF NOT EXISTS users (
     user_id BIGINT PRIMARY KEY,
     group_name TEXT REFERENCES groups(name),
     joined_at TIMESTAMP DEFAULT NOW(),
-    role TEXT DEFAULT NULL -- роль: 'student', 'teacher', NULL
+    role TEXT DEFAULT NULL, -- роль: 'student', 'teacher', NULL
+    username TEXT,
+    last_seen TIMESTAMP -- пишется пачками через bot.activity
 );
 """
 
@@ -155,6 +159,8 @@ async def update_groups_list(pool, groups):
                 "INSERT INTO groups (name) VALUES ($1) ON CONFLICT (name) DO NOTHING",
                 [(group,) for group in groups]
             )
+    if groups:
+        await bus.publish(GROUPS_CHANGED, count=len(groups))
 
 def clear_schedule_cache():
     """Очищает кэш расписания"""
@@ -179,9 +185,20 @@ async def update_current_week(pool):
             WHERE id = 1
         """)
         
-    # Очищаем кэши после обновления недели
+    # Очищаем кэши после обновления недели, в том числе на остальных репликах
     clear_week_cache()
     clear_schedule_cache()
+    await bus.publish(WEEK_FLIPPED)
+
+
+def _on_week_flipped(data):
+    clear_week_cache()
+    clear_schedule_cache()
+
+
+bus.subscribe(WEEK_FLIPPED, _on_week_flipped)
+bus.subscribe(GROUPS_CHANGED, lambda data: clear_schedule_cache())
+bus.subscribe(SNAPSHOT_PUBLISHED, lambda data: clear_schedule_cache())
 
 # Кэш для текущей недели
 _current_week_cache = {'value': None, 'timestamp': 0}
@@ -194,7 +211,9 @@ async def get_current_week(pool):
     # Проверяем кэш
     if _current_week_cache['value'] is not None:
         if time() - _current_week_cache['timestamp'] < _week_cache_ttl:
+            cache_hit("current_week")
             return _current_week_cache['value']
+    cache_miss("current_week")
     
     async with pool.acquire() as conn:
         value = await conn.fetchval("""
@@ -401,7 +420,9 @@ async def get_schedule(pool, group_name, day_of_week=None, week_number=None):
     if cache_key in _schedule_cache:
         data, timestamp = _schedule_cache[cache_key]
         if time() - timestamp < _cache_ttl:
+            cache_hit("db_schedule")
             return data
+    cache_miss("db_schedule")
     
     async with pool.acquire() as conn:
         # Если неделя не указана, получаем текущую
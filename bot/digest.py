@@ -0,0 +1,147 @@
+import os
+import logging
+from datetime import datetime, timedelta
+
+from .snapshot_store import refresh_and_publish
+from .notifications import enqueue_group_message, fanout, FANOUT_RATE
+from .workers import WEB_WORKERS
+
+logger = logging.getLogger("digest")
+
+try:
+    from zoneinfo import ZoneInfo
+    TZ_MSK = ZoneInfo("Europe/Moscow")
+except ImportError:
+    from pytz import timezone
+    TZ_MSK = timezone("Europe/Moscow")
+
+# Время утренней рассылки по Москве, ЧЧ:ММ
+DIGEST_TIME = os.getenv("DIGEST_TIME", "07:00")
+# За сколько минут рассылка должна уложиться; неотправленное к этому моменту устаревает
+DIGEST_WINDOW_MINUTES = int(os.getenv("DIGEST_WINDOW_MINUTES", 30))
+
+DIGEST_RUNS_TABLE = """
+CREATE TABLE IF NOT EXISTS digest_runs (
+    run_date DATE PRIMARY KEY,
+    started_at TIMESTAMP DEFAULT NOW(),
+    groups_total INT DEFAULT 0,
+    groups_done INT DEFAULT 0,
+    last_group TEXT, -- последняя обработанная группа (группы идут по алфавиту)
+    enqueued INT DEFAULT 0,
+    finished_at TIMESTAMP
+);
+"""
+
+
+async def create_digest_tables(conn):
+    await conn.execute(DIGEST_RUNS_TABLE)
+    await conn.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS digest_enabled BOOLEAN DEFAULT FALSE")
+
+
+def digest_time():
+    """Час и минута рассылки из DIGEST_TIME"""
+    try:
+        hour, minute = (int(part) for part in DIGEST_TIME.split(":", 1))
+        return hour, minute
+    except ValueError:
+        logger.error(f"Некорректное DIGEST_TIME={DIGEST_TIME}, используем 07:00")
+        return 7, 0
+
+
+def render_group_digest(snapshot, group, date):
+    """Текст сводки для одной группы: пары на день с уже наложенными заменами"""
+    _, day_text = snapshot.day(group, date)
+    return "☀️ Доброе утро! Расписание на сегодня:\n\n" + day_text
+
+
+async def send_daily_digest(pool, now=None):
+    """Рисует сводку один раз на группу и ставит ее в очередь подписчикам группы.
+
+    Прогресс сохраняется в digest_runs после каждой группы: при повторном запуске
+    в тот же день уже обработанные группы пропускаются.
+    """
+    now = now or datetime.now(TZ_MSK)
+    if now.weekday() == 6:
+        logger.info("Воскресенье, утренняя сводка не отправляется")
+        return 0
+    run_date = now.date()
+
+    async with pool.acquire() as conn:
+        await conn.execute(
+            "INSERT INTO digest_runs (run_date) VALUES ($1) ON CONFLICT (run_date) DO NOTHING", run_date
+        )
+        # Срок годности считает сама БД: expires_at сравнивается с NOW() в часовом поясе сессии,
+        # а продолженная рассылка устаревает в тот же момент, что и начатая
+        run = await conn.fetchrow(
+            """
+            SELECT last_group, groups_done, finished_at,
+                   started_at + make_interval(mins => $2) AS expires_at
+            FROM digest_runs WHERE run_date = $1
+            """,
+            run_date, DIGEST_WINDOW_MINUTES
+        )
+        if run['finished_at']:
+            logger.info(f"Сводка за {run_date} уже разослана")
+            return 0
+        # Порядок и отсечка продолжения — в одном сравнении COLLATE "C", иначе порядок
+        # сортировки БД и сравнение строк в Python расходятся и группы теряются или дублируются
+        groups = await conn.fetch(
+            """
+            SELECT group_name, COUNT(*) AS users FROM users
+            WHERE digest_enabled AND group_name IS NOT NULL
+              AND ($1::text IS NULL OR group_name COLLATE "C" > $1::text COLLATE "C")
+            GROUP BY group_name ORDER BY group_name COLLATE "C"
+            """,
+            run['last_group']
+        )
+        if not run['last_group']:
+            await conn.execute(
+                "UPDATE digest_runs SET groups_total = $2 WHERE run_date = $1", run_date, len(groups)
+            )
+    expires_at = run['expires_at']
+    if run['last_group']:
+        logger.info(f"Продолжаем сводку за {run_date} после группы {run['last_group']}")
+    if not groups:
+        return 0
+
+    total_users = sum(g['users'] for g in groups)
+    # FANOUT_RATE — лимит одного процесса; при WEB_WORKERS > 1 очередь разбирают все воркеры
+    total_rate = FANOUT_RATE * WEB_WORKERS
+    if total_users / total_rate > DIGEST_WINDOW_MINUTES * 60:
+        logger.warning(
+            f"Сводка для {total_users} пользователей не уложится в {DIGEST_WINDOW_MINUTES} мин "
+            f"при {total_rate:g} сообщений/с (FANOUT_RATE={FANOUT_RATE:g} x {WEB_WORKERS} воркеров)"
+        )
+
+    # Обновляем снимок перед рассылкой: утренние замены могли появиться после последнего обновления
+    snapshot = await refresh_and_publish()
+    if not snapshot.schedule:
+        logger.error("Сводка не отправлена: расписание недоступно")
+        return 0
+
+    enqueued = 0
+    for group in groups:
+        if group['group_name'] not in snapshot.schedule:
+            continue
+        text = render_group_digest(snapshot, group['group_name'], now)
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                count = await enqueue_group_message(
+                    conn, group['group_name'], 'digest', text,
+                    opt_in="digest_enabled", expires_at=expires_at
+                )
+                await conn.execute(
+                    """
+                    UPDATE digest_runs
+                    SET last_group = $2, groups_done = groups_done + 1, enqueued = enqueued + $3
+                    WHERE run_date = $1
+                    """,
+                    run_date, group['group_name'], count
+                )
+        enqueued += count
+        fanout.wake()
+
+    async with pool.acquire() as conn:
+        await conn.execute("UPDATE digest_runs SET finished_at = NOW() WHERE run_date = $1", run_date)
+    logger.info(f"Утренняя сводка: {len(groups)} групп, в очередь поставлено {enqueued} сообщений")
+    return enqueued
@@ -0,0 +1,56 @@
+import hashlib
+from collections import OrderedDict
+
+from aiogram.exceptions import TelegramBadRequest
+
+from .metrics import Counter
+
+# Сколько сообщений помнить; старые вытесняются первыми
+EDIT_CACHE_SIZE = 10000
+
+MESSAGE_EDITS = Counter(
+    "message_edits_total", "Редактирования сообщений бота", ("result",),
+)
+
+# {(chat_id, message_id): отпечаток последнего отправленного текста и клавиатуры}
+_fingerprints = OrderedDict()
+
+
+def fingerprint(text, reply_markup=None):
+    """Отпечаток содержимого сообщения: текст и клавиатура"""
+    digest = hashlib.sha1(text.encode("utf-8"))
+    if reply_markup is not None:
+        digest.update(b"\0")
+        digest.update(reply_markup.model_dump_json(exclude_none=True).encode("utf-8"))
+    return digest.digest()
+
+
+def _remember(key, value):
+    _fingerprints[key] = value
+    _fingerprints.move_to_end(key)
+    if len(_fingerprints) > EDIT_CACHE_SIZE:
+        _fingerprints.popitem(last=False)
+
+
+async def edit_message(message, text, reply_markup=None, **kwargs):
+    """Редактирует сообщение, только если текст или клавиатура изменились.
+
+    Возвращает False, если запрос к Telegram не понадобился.
+    """
+    key = (message.chat.id, message.message_id)
+    value = fingerprint(text, reply_markup)
+    if _fingerprints.get(key) == value:
+        MESSAGE_EDITS.inc(result="skipped")
+        return False
+    try:
+        await message.edit_text(text, reply_markup=reply_markup, **kwargs)
+    except TelegramBadRequest as e:
+        # Отпечатка не было (перезапуск, другой процесс), а содержимое то же
+        if "message is not modified" not in str(e):
+            raise
+        MESSAGE_EDITS.inc(result="not_modified")
+        _remember(key, value)
+        return False
+    MESSAGE_EDITS.inc(result="edited")
+    _remember(key, value)
+    return True
@@ -4,6 +4,10 @@ from aiogram.utils.keyboard import InlineKeyboardBuilder
 from datetime import datetime
 import asyncpg
 
+from .activity import user_activity
+from .digest import DIGEST_TIME
+from .handlers import get_main_menu, ADMINS
+
 router = Router()
 
 @router.message(Command("profile"))
@@ -18,6 +22,38 @@ async def profile(message: types.Message, bot):
 async def support(message: types.Message):
     await message.answer("💬 По всем вопросам пишите: @support_username")
 
+@router.message(Command("notify"))
+async def toggle_notifications(message: types.Message, db=None):
+    if not db:
+        await message.answer("Ошибка подключения к базе данных")
+        return
+    enabled = await db.fetchval(
+        "UPDATE users SET notify_replacements = NOT COALESCE(notify_replacements, TRUE) WHERE user_id=$1 RETURNING notify_replacements",
+        message.from_user.id
+    )
+    if enabled is None:
+        await message.answer("Сначала выберите группу через /start")
+    elif enabled:
+        await message.answer("🔔 Уведомления об изменениях в заменах включены")
+    else:
+        await message.answer("🔕 Уведомления об изменениях в заменах выключены")
+
+@router.message(Command("digest"))
+async def toggle_digest(message: types.Message, db=None):
+    if not db:
+        await message.answer("Ошибка подключения к базе данных")
+        return
+    enabled = await db.fetchval(
+        "UPDATE users SET digest_enabled = NOT COALESCE(digest_enabled, FALSE) WHERE user_id=$1 RETURNING digest_enabled",
+        message.from_user.id
+    )
+    if enabled is None:
+        await message.answer("Сначала выберите группу через /start")
+    elif enabled:
+        await message.answer(f"☀️ Утренняя сводка включена: расписание на день будет приходить в {DIGEST_TIME} по Москве")
+    else:
+        await message.answer("🌙 Утренняя сводка выключена")
+
 @router.message(Command("change_group"))
 async def change_group(message: types.Message, bot, state):
     await message.answer("🔄 Выберите новую группу:", reply_markup=await group_keyboard(bot))
@@ -37,15 +73,8 @@ async def group_keyboard(bot):
 @router.callback_query(F.data.startswith("group_"))
 async def choose_group_callback(callback: types.CallbackQuery, bot, state):
     group_name = callback.data.replace("group_", "")
-    pool = bot.dispatcher['db']
-    user_id = callback.from_user.id
-    username = callback.from_user.username or ""
-    # Регистрируем пользователя с ролью None и username
-    async with pool.acquire() as conn:
-        await conn.execute(
-            "INSERT INTO users (user_id, group_name, joined_at, role, username) VALUES ($1, $2, NOW(), NULL, $3) ON CONFLICT (user_id) DO UPDATE SET group_name = $2, joined_at = NOW(), username = $3",
-            user_id, group_name, username
-        )
+    # Регистрируем пользователя: запись уйдет в БД пачкой через bot.activity
+    user_activity.set_group(callback.from_user.id, group_name, callback.from_user.username)
     await callback.message.answer(f"✅ Ваша группа: <b>{group_name}</b> успешно выбрана!", parse_mode="HTML")
     await state.clear()
 
@@ -73,11 +102,14 @@ async def choose_role_callback(callback: types.CallbackQuery, bot):
 @router.callback_query(F.data.startswith("role_"))
 async def set_role_callback(callback: types.CallbackQuery, bot):
     role = callback.data.replace("role_", "")
-    pool = bot.dispatcher['db']
-    user_id = callback.from_user.id
-    async with pool.acquire() as conn:
-        await conn.execute("UPDATE users SET role=$1 WHERE user_id=$2", role, user_id)
+    user_activity.set_role(callback.from_user.id, role)
     await callback.message.answer(f"✅ Ваша роль теперь: <b>{'Ученик' if role=='student' else 'Преподаватель'}</b>", parse_mode="HTML")
+    if role == 'teacher':
+        await callback.message.answer(
+            "Найдите свое расписание: <code>/teacher Фамилия</code> и нажмите «✅ Это я»",
+            parse_mode="HTML",
+            reply_markup=get_main_menu(callback.from_user.id in ADMINS, is_teacher=True)
+        )
 
 @router.message(Command("time"))
 async def time_to_lesson(message: types.Message, bot):
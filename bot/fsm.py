@@ -0,0 +1,131 @@
+import os
+import json
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StorageKey, StateType
+
+from .bus import bus, FSM_CHANGED
+from .metrics import cache_hit, cache_miss
+
+logger = logging.getLogger("fsm")
+
+# Сколько секунд доверять локальной копии состояния; изменения с других реплик приходят через шину
+FSM_CACHE_TTL = float(os.getenv("FSM_CACHE_TTL", 60))
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", 10000))
+# Через сколько дней без изменений состояние считается брошенным
+FSM_TTL_DAYS = int(os.getenv("FSM_TTL_DAYS", 7))
+
+FSM_TABLE = """
+CREATE TABLE IF NOT EXISTS fsm_states (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data JSONB NOT NULL DEFAULT '{}'::jsonb,
+    updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+"""
+
+
+async def create_fsm_tables(conn):
+    await conn.execute(FSM_TABLE)
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_fsm_states_updated_at ON fsm_states(updated_at)")
+
+
+class PostgresStorage(BaseStorage):
+    """Хранилище FSM в Postgres с коротким локальным кэшем.
+
+    Чтение состояния идет на каждый апдейт, поэтому обычно обслуживается из
+    кэша (в том числе отрицательного: у большинства пользователей состояния
+    нет). Запись сразу уходит в базу, а остальные реплики сбрасывают свою
+    копию по событию шины инвалидации.
+    """
+
+    def __init__(self, cache_ttl=FSM_CACHE_TTL, cache_size=FSM_CACHE_SIZE):
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        # {ключ: (состояние, данные, момент устаревания)}
+        self._cache = OrderedDict()
+        self._pool = None
+
+    def start(self, pool):
+        self._pool = pool
+
+    def forget(self, key=None):
+        """Сбрасывает ключ из кэша; без ключа — весь кэш"""
+        if key is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(key, None)
+
+    def _remember(self, key, state, data):
+        self._cache[key] = (state, data, time.monotonic() + self.cache_ttl)
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _load(self, key):
+        entry = self._cache.get(key)
+        if entry is not None and entry[2] > time.monotonic():
+            cache_hit("fsm")
+            return entry
+        cache_miss("fsm")
+        async with self._pool.acquire() as conn:
+            row = await conn.fetchrow("SELECT state, data FROM fsm_states WHERE key = $1", key)
+        state, data = (row['state'], json.loads(row['data'])) if row else (None, {})
+        self._remember(key, state, data)
+        return self._cache[key]
+
+    async def _write(self, key, column, value, state, data):
+        async with self._pool.acquire() as conn:
+            await conn.execute(
+                f"""
+                INSERT INTO fsm_states (key, {column}, updated_at) VALUES ($1, $2, NOW())
+                ON CONFLICT (key) DO UPDATE SET {column} = EXCLUDED.{column}, updated_at = NOW()
+                """,
+                key, value
+            )
+        entry = self._cache.get(key)
+        if entry is not None and entry[2] > time.monotonic():
+            self._remember(key, state if column == 'state' else entry[0], data if column == 'data' else entry[1])
+        else:
+            self.forget(key)
+        bus.emit(FSM_CHANGED, key=key)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        await self._write(self.key_builder.build(key), 'state', state, state, None)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._load(self.key_builder.build(key)))[0]
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        data = dict(data)
+        await self._write(self.key_builder.build(key), 'data', json.dumps(data, ensure_ascii=False), None, data)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict((await self._load(self.key_builder.build(key)))[1])
+
+    async def close(self) -> None:
+        self._cache.clear()
+
+
+# Общее хранилище FSM процесса
+fsm_storage = PostgresStorage()
+bus.subscribe(FSM_CHANGED, lambda data: fsm_storage.forget(data.get('key')))
+
+
+async def cleanup_fsm_states(pool, ttl_days=FSM_TTL_DAYS):
+    """Удаляет пустые и брошенные состояния"""
+    async with pool.acquire() as conn:
+        status = await conn.execute(
+            """
+            DELETE FROM fsm_states
+            WHERE (state IS NULL AND data = '{}'::jsonb) OR updated_at < NOW() - make_interval(days => $1)
+            """,
+            ttl_days
+        )
+    logger.info(f"Очистка состояний FSM: {status}")
@@ -15,6 +15,10 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram import Bot
 
+from .activity import user_activity
+from .tracing import traced
+from .edits import edit_message
+
 router = Router()
 
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
@@ -22,12 +26,14 @@ import os
 
 ADMINS = [int(x) for x in os.getenv("ADMINS", "").split(",") if x]
 
-def get_main_menu(is_admin: bool = False):
+def get_main_menu(is_admin: bool = False, is_teacher: bool = False):
     # Кнопки для всех пользователей
     buttons = [
         [KeyboardButton(text="Расписание 📝"), KeyboardButton(text="Замены ✏️")],
         [KeyboardButton(text="Время 🕒"), KeyboardButton(text="Профиль 🧑")]
     ]
+    if is_teacher:
+        buttons.append([KeyboardButton(text="Мои пары 👨‍🏫")])
     # Можно добавить админские кнопки, если нужно
     if is_admin:
         buttons.append([KeyboardButton(text="Админ панель 🛠")])
@@ -36,11 +42,23 @@ def get_main_menu(is_admin: bool = False):
 class ProfileStates(StatesGroup):
     choosing_group = State()
 
+async def get_user_group(db, user_id):
+    """Группа пользователя с учетом выбора, еще не записанного в БД"""
+    group = user_activity.pending_group(user_id)
+    if group:
+        return group
+    user = await db.fetchrow("SELECT group_name FROM users WHERE user_id = $1", user_id)
+    return user['group_name'] if user and user['group_name'] else None
+
 @router.message(CommandStart())
-async def cmd_start(message: types.Message, state: FSMContext, bot: Bot, pool=None):
+async def cmd_start(message: types.Message, state: FSMContext, bot: Bot, pool=None, db=None):
     try:
         is_admin = message.from_user.id in ADMINS
-        menu = get_main_menu(is_admin)
+        # Кнопка «Мои пары» нужна тем, кто уже привязал себя к преподавателю
+        is_teacher = bool(db and await db.fetchval(
+            "SELECT teacher_name FROM users WHERE user_id = $1", message.from_user.id
+        ))
+        menu = get_main_menu(is_admin, is_teacher=is_teacher)
         builder = InlineKeyboardBuilder()
         builder.button(text="📚 Выбрать группу", callback_data="show_groups")
         await message.answer(
@@ -64,14 +82,13 @@ async def main_schedule(message: types.Message, bot, db=None):
             await message.answer("Ошибка подключения к базе данных")
             logger.error(f"[main_schedule] Нет подключения к БД для пользователя {message.from_user.id}")
             return
-        user = await db.fetchrow("SELECT group_name FROM users WHERE user_id = $1", message.from_user.id)
-        if not user or not user['group_name']:
+        group = await get_user_group(db, message.from_user.id)
+        if not group:
             builder = InlineKeyboardBuilder()
             builder.button(text="📚 Выбрать группу", callback_data="show_groups")
             await message.answer("Сначала выберите вашу группу:", reply_markup=builder.as_markup())
             logger.info(f"[main_schedule] Пользователь {message.from_user.id} не выбрал группу")
             return
-        group = user['group_name']
         builder = InlineKeyboardBuilder()
         builder.button(text="Сегодня", callback_data=f"schedule_{group}_today")
         builder.button(text="Завтра", callback_data=f"schedule_{group}_tomorrow")
@@ -88,14 +105,13 @@ async def main_replacements(message: types.Message, bot, db=None):
             await message.answer("Ошибка подключения к базе данных")
             logger.error(f"[main_replacements] Нет подключения к БД для пользователя {message.from_user.id}")
             return
-        user = await db.fetchrow("SELECT group_name FROM users WHERE user_id = $1", message.from_user.id)
-        if not user or not user['group_name']:
+        group = await get_user_group(db, message.from_user.id)
+        if not group:
             builder = InlineKeyboardBuilder()
             builder.button(text="📚 Выбрать группу", callback_data="show_groups")
             await message.answer("Сначала выберите вашу группу:", reply_markup=builder.as_markup())
             logger.info(f"[main_replacements] Пользователь {message.from_user.id} не выбрал группу")
             return
-        group = user['group_name']
         replacements_data = fetch_replacements()
         if not replacements_data or not isinstance(replacements_data, dict) or group not in replacements_data:
             await message.answer("✅ Замен для вашей группы нет")
@@ -105,19 +121,7 @@ async def main_replacements(message: types.Message, bot, db=None):
             await message.answer("✅ Замен для вашей группы нет")
             logger.info(f"[main_replacements] Нет замен для группы {group}")
             return
-        text = f"🔄 Замены для группы {group}:\n\n"
-        for date, replacements in replacements_data[group].items():
-            if not isinstance(replacements, (list, tuple)):
-                continue
-            text += f"📅 {date}:\n"
-            for rep in replacements:
-                if not isinstance(rep, dict):
-                    continue
-                text += f"{'_' * 7} Занятие №{rep.get('lesson', '')} {'_' * 7}\n"
-                text += f"📚 Предмет: {rep.get('subject', '')}\n"
-                if rep.get('teacher'):
-                    text += f"👤 Преподаватель: {rep.get('teacher', '')}\n"
-                text += f"🚪 Кабинет: {rep.get('room', '')}\n\n"
+        text = format_replacements(group, replacements_data[group])
         await message.answer(text)
         logger.info(f"[main_replacements] Отправлены замены для группы {group}")
     except Exception as e:
@@ -142,18 +146,18 @@ async def main_profile(message: types.Message, bot, db=None):
     if not db:
         await message.answer("Ошибка подключения к базе данных")
         return
-    user = await db.fetchrow("SELECT group_name FROM users WHERE user_id = $1", message.from_user.id)
-    if not user or not user['group_name']:
+    group = await get_user_group(db, message.from_user.id)
+    if not group:
         await message.answer("Вы не выбрали группу. Выберите группу через меню.")
         return
     builder = InlineKeyboardBuilder()
     builder.button(text="Изменить группу", callback_data="show_groups")
-    await message.answer(f"👤 Ваш профиль:\nГруппа: <b>{user['group_name']}</b>", reply_markup=builder.as_markup(), parse_mode="HTML")
+    await message.answer(f"👤 Ваш профиль:\nГруппа: <b>{group}</b>", reply_markup=builder.as_markup(), parse_mode="HTML")
 
 @router.message(F.text == "Админ панель 🛠")
 async def main_admin_panel(message: types.Message, bot):
     if message.from_user.id in ADMINS:
-        await message.answer("🛠 Добро пожаловать в админ-панель! Используйте /stats и /groups для статистики.")
+        await message.answer("🛠 Добро пожаловать в админ-панель! Используйте /stats, /groups, /pools, /queries и /traces для статистики.")
     else:
         await message.answer("⛔️ Доступ только для админов!")
 
@@ -172,14 +176,14 @@ async def show_groups_list(callback: types.CallbackQuery, state: FSMContext, db=
 
         # Получаем список групп из базы
         if not db:
-            await callback.message.edit_text("Ошибка подключения к базе данных")
+            await edit_message(callback.message, "Ошибка подключения к базе данных")
             return
             
         groups = await db.fetch("SELECT name FROM groups ORDER BY name")
     except Exception as e:
         logging.error(f"Error in show_groups_list: {e}")
         try:
-            await callback.message.edit_text(
+            await edit_message(callback.message,
                 "Произошла ошибка при получении списка групп. Попробуйте позже."
             )
         except:
@@ -231,20 +235,22 @@ async def show_groups_list(callback: types.CallbackQuery, state: FSMContext, db=
     if nav_buttons:
         builder.row(*nav_buttons)
     
-    page_info = f"Страница {current_page + 1} из {total_pages}"
+    page_info = f"Страница {current_page + 1} из {total_pages}\n💡 Или просто напишите название группы в чат"
     
-    await callback.message.edit_text(
+    await edit_message(callback.message,
         f"Выберите вашу группу из списка:\n{page_info}",
         reply_markup=builder.as_markup()
     )
 
-from .parsers.schedule import fetch_schedule, fetch_replacements, format_day_schedule
+from .parsers.schedule import fetch_schedule, fetch_replacements, format_day_schedule, format_replacements
 
-def get_schedule_text(group: str, day: str = None, date_str: str = None, lessons: list = None, last_update=None) -> str:
+@traced("render")
+def get_schedule_text(group: str, day: str = None, date_str: str = None, lessons: list = None, last_update=None, schedule_data=None) -> str:
     """Формирует текст расписания для группы (без замен), формат с эмодзи и правильным порядком"""
     from .parsers.lesson_times import LESSON_TIMES, WEEKDAY_TIMES, SATURDAY_TIMES
     from datetime import datetime
-    schedule_data = fetch_schedule()
+    if schedule_data is None:
+        schedule_data = fetch_schedule()
     
     if not schedule_data or not isinstance(schedule_data, dict):
         return "❌ Ошибка получения расписания"
@@ -319,6 +325,9 @@ def get_schedule_text(group: str, day: str = None, date_str: str = None, lessons
             else:
                 room_str = f"Каб. {room}"
         lines.append(f"{num} {subject} | {time_str}")
+        if lesson.get('replacement'):
+            replaced = lesson.get('replaced')
+            lines.append(f"🔄 Замена (вместо: {replaced})" if replaced else "🔄 Замена")
         if teacher:
             lines.append(f"👤 {teacher}")
         if room_str:
@@ -337,25 +346,17 @@ async def choose_group(callback: types.CallbackQuery, state: FSMContext, db=None
         group = callback.data.replace("group_", "")
         
         if not db:
-            await callback.message.edit_text("Ошибка подключения к базе данных")
+            await edit_message(callback.message, "Ошибка подключения к базе данных")
             return
             
         # Проверяем существование группы
         group_exists = await db.fetchval("SELECT name FROM groups WHERE name = $1", group)
         if not group_exists:
-            await callback.message.edit_text("❌ Выбранная группа не найдена в базе данных")
+            await edit_message(callback.message, "❌ Выбранная группа не найдена в базе данных")
             return
             
-        # Сохраняем выбор группы в транзакции
-        async with db.transaction():
-            await db.execute(
-                """
-                INSERT INTO users (user_id, group_name) 
-                VALUES ($1, $2)
-                ON CONFLICT (user_id) DO UPDATE SET group_name = $2
-                """,
-                callback.from_user.id, group
-            )
+        # Сохраняем выбор группы: запись уйдет в БД пачкой через bot.activity
+        user_activity.set_group(callback.from_user.id, group, callback.from_user.username)
             
         # Подтверждаем сохранение
         await callback.answer("✅ Группа сохранена!", show_alert=True)
@@ -363,7 +364,7 @@ async def choose_group(callback: types.CallbackQuery, state: FSMContext, db=None
     except Exception as e:
         logging.error(f"Error in choose_group: {e}")
         try:
-            await callback.message.edit_text(
+            await edit_message(callback.message,
                 "Произошла ошибка при сохранении группы. Попробуйте позже."
             )
         except:
@@ -375,7 +376,7 @@ async def choose_group(callback: types.CallbackQuery, state: FSMContext, db=None
     builder.button(text="📋 Показать расписание", callback_data=f"schedule_{group}")
     builder.button(text="📚 Выбрать другую группу", callback_data="show_groups")
     
-    await callback.message.edit_text(
+    await edit_message(callback.message,
         f"✅ Ваша группа: <b>{group}</b>\n"
         f"Нажмите кнопку ниже, чтобы посмотреть расписание:",
         reply_markup=builder.as_markup(),
@@ -387,6 +388,7 @@ async def choose_group(callback: types.CallbackQuery, state: FSMContext, db=None
 @router.callback_query(F.data.startswith("schedule_"))
 async def show_schedule(callback: types.CallbackQuery, state: FSMContext, pool=None):
     from datetime import datetime, timedelta
+    from .snapshot import get_snapshot, refresh_snapshot
     try:
         from zoneinfo import ZoneInfo
         tz_msk = ZoneInfo("Europe/Moscow")
@@ -402,69 +404,27 @@ async def show_schedule(callback: types.CallbackQuery, state: FSMContext, pool=N
     await callback.answer("⏳ Загружаю расписание...")
 
     try:
-        schedule_data = fetch_schedule()
-        if not schedule_data or not isinstance(schedule_data, dict):
-            await callback.message.edit_text("❌ Ошибка получения расписания")
+        # Расписание берется из снимка в памяти; сегодня и завтра уже собраны с заменами
+        snapshot = get_snapshot()
+        if not snapshot.version:
+            snapshot = await refresh_snapshot()
+        if not snapshot.schedule or group not in snapshot.schedule:
+            await edit_message(callback.message, "❌ Ошибка получения расписания")
             logging.error(f"[show_schedule] schedule_data invalid for group {group}")
             return
 
-        weekday_map = {
-            0: 'Понедельник',
-            1: 'Вторник',
-            2: 'Среда',
-            3: 'Четверг',
-            4: 'Пятница',
-            5: 'Суббота',
-            6: 'Воскресенье'
-        }
-
-        if view_type == "today":
-            day = weekday_map[today.weekday()]
-            if today.weekday() == 6:
-                day = "Понедельник"
-            date_str = today.strftime('%d.%m.%Y')
-            group_data = schedule_data.get(group) if isinstance(schedule_data, dict) else None
-            lessons = group_data.get(day, []) if isinstance(group_data, dict) else []
-            last_update = today
-            if pool:
-                async with pool.acquire() as conn:
-                    update_time = await conn.fetchval(
-                        "SELECT updated_at FROM schedule_updates ORDER BY updated_at DESC LIMIT 1"
-                    )
-                    if update_time:
-                        last_update = update_time
-            schedule_text = get_schedule_text(group, day, date_str, lessons, last_update)
-        elif view_type == "tomorrow":
-            day = weekday_map[tomorrow.weekday()]
-            if tomorrow.weekday() == 6:
-                day = "Понедельник"
-            date_str = tomorrow.strftime('%d.%m.%Y')
-            group_data = schedule_data.get(group) if isinstance(schedule_data, dict) else None
-            lessons = group_data.get(day, []) if isinstance(group_data, dict) else []
-            last_update = today
-            if pool:
-                async with pool.acquire() as conn:
-                    update_time = await conn.fetchval(
-                        "SELECT updated_at FROM schedule_updates ORDER BY updated_at DESC LIMIT 1"
-                    )
-                    if update_time:
-                        last_update = update_time
-            schedule_text = get_schedule_text(group, day, date_str, lessons, last_update)
+        if view_type in ("today", "tomorrow"):
+            date = today if view_type == "today" else tomorrow
+            # В воскресенье показываем понедельник
+            if date.weekday() == 6:
+                date = date + timedelta(days=1)
+            _, schedule_text = snapshot.day(group, date)
         else:
             week_days = ['Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота']
-            texts = []
-            last_update = today
-            if pool:
-                async with pool.acquire() as conn:
-                    update_time = await conn.fetchval(
-                        "SELECT updated_at FROM schedule_updates ORDER BY updated_at DESC LIMIT 1"
-                    )
-                    if update_time:
-                        last_update = update_time
-            for d in week_days:
-                group_data = schedule_data.get(group) if isinstance(schedule_data, dict) else None
-                lessons = group_data.get(d, []) if isinstance(group_data, dict) else []
-                texts.append(get_schedule_text(group, d, None, lessons, last_update))
+            texts = [
+                get_schedule_text(group, d, None, None, snapshot.last_update, schedule_data=snapshot.schedule)
+                for d in week_days
+            ]
             schedule_text = '\n'.join(texts)
 
         builder = InlineKeyboardBuilder()
@@ -479,18 +439,18 @@ async def show_schedule(callback: types.CallbackQuery, state: FSMContext, pool=N
             builder.button(text="На завтра ➡️", callback_data=f"schedule_{group}_tomorrow")
 
         try:
-            await callback.message.edit_text(
+            await edit_message(callback.message,
                 schedule_text,
                 reply_markup=builder.as_markup(),
                 parse_mode="HTML"
             )
         except Exception as e:
             logging.error(f"[show_schedule] Error sending schedule for group {group}: {e}")
-            await callback.message.edit_text("❌ Ошибка при отправке расписания. Попробуйте позже.")
+            await edit_message(callback.message, "❌ Ошибка при отправке расписания. Попробуйте позже.")
     except Exception as e:
         logging.error(f"[show_schedule] Fatal error for group {group}: {e}")
         try:
-            await callback.message.edit_text("❌ Критическая ошибка при обработке расписания. Попробуйте позже.")
+            await edit_message(callback.message, "❌ Критическая ошибка при обработке расписания. Попробуйте позже.")
         except:
             pass
 
@@ -506,6 +466,7 @@ async def admin_stats(message: types.Message, db=None):
     groups_count = await db.fetchval("SELECT COUNT(*) FROM groups")
     teachers_count = await db.fetchval("SELECT COUNT(*) FROM users WHERE role='teacher'")
     students_count = await db.fetchval("SELECT COUNT(*) FROM users WHERE role='student'")
+    active_week = await db.fetchval("SELECT COUNT(*) FROM users WHERE last_seen >= NOW() - INTERVAL '7 days'")
     last_update = await db.fetchval("SELECT updated_at FROM schedule_updates ORDER BY updated_at DESC LIMIT 1")
     await message.answer(
         f"<b>Статистика</b>\n"
@@ -513,6 +474,7 @@ async def admin_stats(message: types.Message, db=None):
         f"Групп: <b>{groups_count}</b>\n"
         f"Учителей: <b>{teachers_count}</b>\n"
         f"Студентов: <b>{students_count}</b>\n"
+        f"Активных за неделю: <b>{active_week}</b>\n"
         f"Последнее обновление расписания: <b>{last_update}</b>",
         parse_mode="HTML"
     )
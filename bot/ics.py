@@ -0,0 +1,226 @@
+import os
+import hashlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from aiohttp import web
+
+from .snapshot import get_snapshot
+from .indexes import replacement_lessons, week_number_for
+from .metrics import cache_hit, cache_miss
+from .parsers.lesson_times import LESSON_TIMES, WEEKDAY_TIMES, SATURDAY_TIMES
+
+try:
+    from zoneinfo import ZoneInfo
+    TZ_MSK = ZoneInfo("Europe/Moscow")
+except ImportError:
+    from pytz import timezone
+    TZ_MSK = timezone("Europe/Moscow")
+
+# На сколько недель вперед разворачивать расписание в события
+ICS_WEEKS = int(os.getenv("ICS_WEEKS", 4))
+# Как часто календарю имеет смысл перепроверять ленту
+ICS_MAX_AGE = int(os.getenv("ICS_MAX_AGE", 1800))
+# Сколько лент держать в памяти
+ICS_CACHE_SIZE = 1024
+
+WEEKDAYS = ['Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье']
+
+# {(тип, имя): (версия снимка, дата начала, etag, тело)}
+_feeds = {}
+
+
+def _times_for(date):
+    if date.weekday() == 0:
+        return LESSON_TIMES
+    if date.weekday() == 5:
+        return SATURDAY_TIMES
+    return WEEKDAY_TIMES
+
+
+def _lesson_bounds(date, time_key, lesson_number):
+    """Начало и конец пары в UTC по таблице звонков; None, если время неизвестно"""
+    times = _times_for(date)
+    time_range = times.get(time_key) or times.get(f"{lesson_number} пара")
+    if not time_range or '-' not in time_range:
+        return None
+    start_str, end_str = [part.strip() for part in time_range.split('-', 1)]
+    bounds = []
+    for value in (start_str, end_str):
+        hour, minute = (int(part) for part in value.split(':'))
+        local = datetime(date.year, date.month, date.day, hour, minute, tzinfo=TZ_MSK)
+        bounds.append(local.astimezone(dt_timezone.utc))
+    return bounds
+
+
+def _escape(value):
+    return (str(value).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def _fold(line):
+    # Строки длиннее 75 октетов переносятся (RFC 5545, 3.1)
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line
+    parts = []
+    current = ''
+    for char in line:
+        if len((current + char).encode('utf-8')) > (75 if not parts else 74):
+            parts.append(current)
+            current = char
+        else:
+            current += char
+    parts.append(current)
+    return '\r\n '.join(parts)
+
+
+def _utc(value):
+    return value.strftime('%Y%m%dT%H%M%SZ')
+
+
+def _event(uid, start, end, summary, location, description, stamp):
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{uid}",
+        f"DTSTAMP:{stamp}",
+        f"DTSTART:{_utc(start)}",
+        f"DTEND:{_utc(end)}",
+        f"SUMMARY:{_escape(summary)}",
+    ]
+    if location:
+        lines.append(f"LOCATION:{_escape(location)}")
+    if description:
+        lines.append(f"DESCRIPTION:{_escape(description)}")
+    lines.append("END:VEVENT")
+    return lines
+
+
+def _calendar(name, events):
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//raspisanie-bot//RU",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        f"X-WR-CALNAME:{_escape(name)}",
+        "X-WR-TIMEZONE:Europe/Moscow",
+        f"REFRESH-INTERVAL;VALUE=DURATION:PT{max(1, ICS_MAX_AGE // 60)}M",
+    ]
+    for event in events:
+        lines.extend(event)
+    lines.append("END:VCALENDAR")
+    return '\r\n'.join(_fold(line) for line in lines) + '\r\n'
+
+
+def _dates(start, days):
+    for offset in range(days):
+        date = start + timedelta(days=offset)
+        if date.weekday() != 6:
+            yield date
+
+
+def _uid(*parts):
+    return hashlib.sha1(':'.join(str(p) for p in parts).encode('utf-8')).hexdigest() + "@raspisanie-bot"
+
+
+def render_group_ics(snapshot, group, start, days):
+    """Календарь группы: пары с заменами на days дней начиная с start"""
+    stamp = _utc(datetime.fromtimestamp(snapshot.built_at, dt_timezone.utc))
+    events = []
+    for date in _dates(start, days):
+        lessons, _ = snapshot.day(group, date)
+        for idx, lesson in enumerate(lessons):
+            bounds = _lesson_bounds(date, lesson.get('time', ''), lesson.get('lesson_number'))
+            if not bounds:
+                continue
+            summary = lesson.get('subject', '')
+            description = lesson.get('teacher', '')
+            if lesson.get('replacement'):
+                summary = f"🔄 {summary}"
+                if lesson.get('replaced'):
+                    description = f"{description}\nЗамена вместо: {lesson['replaced']}".strip()
+            room = lesson.get('room') or lesson.get('classroom') or ''
+            events.append(_event(
+                _uid(group, date.isoformat(), lesson.get('lesson_number'), idx), bounds[0], bounds[1],
+                summary, '' if room == '—' else room, description, stamp,
+            ))
+    return _calendar(f"Расписание {group}", events)
+
+
+def render_teacher_ics(snapshot, name, start, days):
+    """Календарь преподавателя: пары по расписанию и замены с его участием"""
+    stamp = _utc(datetime.fromtimestamp(snapshot.built_at, dt_timezone.utc))
+    events = []
+    for date in _dates(start, days):
+        for lesson in snapshot.teachers.day(name, WEEKDAYS[date.weekday()], week_number_for(date)):
+            bounds = _lesson_bounds(date, lesson.time, lesson.lesson_number)
+            if not bounds:
+                continue
+            events.append(_event(
+                _uid(name, date.isoformat(), lesson.lesson_number, lesson.group), bounds[0], bounds[1],
+                f"{lesson.subject} ({lesson.group})", '' if lesson.room == '—' else lesson.room, lesson.group, stamp,
+            ))
+        for rep in snapshot.teachers.replacements_on(name, date.strftime('%d.%m.%Y')):
+            for number in replacement_lessons(rep.lesson):
+                bounds = _lesson_bounds(date, f"{number} пара", number)
+                if not bounds:
+                    continue
+                events.append(_event(
+                    _uid(name, date.isoformat(), number, rep.group, 'replacement'), bounds[0], bounds[1],
+                    f"🔄 {rep.subject} ({rep.group})", rep.room, f"Замена, {rep.group}", stamp,
+                ))
+    return _calendar(f"Расписание {name}", events)
+
+
+def get_feed(kind, name, today=None):
+    """(etag, тело) ленты; пересобирается при смене снимка или дня"""
+    snapshot = get_snapshot()
+    today = today or datetime.now(TZ_MSK).date()
+    key = (kind, name)
+    cached = _feeds.get(key)
+    if cached and cached[0] == snapshot.version and cached[1] == today:
+        cache_hit("ics")
+        return cached[2], cached[3]
+    cache_miss("ics")
+    # Лента начинается с понедельника, чтобы в календаре была вся текущая неделя,
+    # и покрывает ICS_WEEKS недель вперед от сегодняшнего дня
+    start = today - timedelta(days=today.weekday())
+    days = today.weekday() + ICS_WEEKS * 7
+    if kind == 'teacher':
+        body = render_teacher_ics(snapshot, name, start, days)
+    else:
+        body = render_group_ics(snapshot, name, start, days)
+    etag = '"' + hashlib.sha1(body.encode('utf-8')).hexdigest() + '"'
+    if len(_feeds) >= ICS_CACHE_SIZE and key not in _feeds:
+        _feeds.pop(next(iter(_feeds)))
+    _feeds[key] = (snapshot.version, today, etag, body)
+    return etag, body
+
+
+def _resolve(snapshot, kind, name):
+    if kind == 'teacher':
+        names = snapshot.teachers.find(name)
+    else:
+        names = [name] if name in snapshot.groups else snapshot.find_groups(name)
+    return names[0] if len(names) == 1 else None
+
+
+async def handle_ics(request: web.Request):
+    """iCalendar-лента группы (/ics/<группа>.ics) или преподавателя (/ics/teacher/<ФИО>.ics)"""
+    snapshot = get_snapshot()
+    if not snapshot.version:
+        return web.Response(text="Schedule is loading", status=503, headers={"Retry-After": "60"})
+    kind = 'teacher' if request.path.startswith("/ics/teacher/") else 'group'
+    name = _resolve(snapshot, kind, request.match_info['name'])
+    if not name:
+        return web.Response(text="Not found", status=404)
+    etag, body = get_feed(kind, name)
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={ICS_MAX_AGE}"}
+    if etag in [tag.strip() for tag in request.headers.get("If-None-Match", "").split(",")]:
+        return web.Response(status=304, headers=headers)
+    return web.Response(
+        body=body.encode('utf-8'),
+        content_type="text/calendar",
+        charset="utf-8",
+        headers=headers,
+    )
@@ -0,0 +1,408 @@
+import re
+import bisect
+from collections import namedtuple
+
+# Занятие преподавателя из основного расписания
+TeacherLesson = namedtuple('TeacherLesson', 'day week lesson_number time group subject room subgroup')
+# Замена, в которой указан преподаватель
+TeacherReplacement = namedtuple('TeacherReplacement', 'date lesson group subject room')
+
+_key_re = re.compile(r"[^0-9a-zа-я]+")
+_date_re = re.compile(r"\d{2}\.\d{2}\.\d{4}")
+
+
+def teacher_key(name):
+    """Ключ преподавателя: без регистра, пробелов и точек (Иванов И.И. -> ивановии)"""
+    return _key_re.sub("", str(name).lower().replace("ё", "е"))
+
+
+def surname_key(name):
+    parts = str(name).split()
+    return teacher_key(parts[0]) if parts else ""
+
+
+def week_number_for(date):
+    """Номер недели (1 или 2) по четности ISO-недели, как в основном расписании"""
+    return 2 if date.isocalendar()[1] % 2 == 0 else 1
+
+
+def replacement_date(key):
+    """Дата замены dd.mm.yyyy из заголовка в файле замен"""
+    match = _date_re.search(str(key))
+    return match.group(0) if match else str(key)
+
+
+class TeacherIndex:
+    """Обратный индекс: преподаватель -> его пары и замены.
+
+    Строится один раз на снимок, дальше выборка дня — обращение к словарю.
+    """
+
+    __slots__ = ('names', '_lessons', '_replacements', '_by_key', '_surnames')
+
+    def __init__(self, schedule, replacements):
+        self._lessons = {}
+        self._replacements = {}
+        self._by_key = {}
+        for group, days in schedule.items():
+            if not isinstance(days, dict):
+                continue
+            for day, day_data in days.items():
+                if isinstance(day_data, dict):
+                    weeks = [(week, day_data.get(week) or []) for week in (1, 2)]
+                elif isinstance(day_data, list):
+                    weeks = [(1, day_data), (2, day_data)]
+                else:
+                    continue
+                for week, lessons in weeks:
+                    for lesson in lessons:
+                        if not isinstance(lesson, dict):
+                            continue
+                        teacher = (lesson.get('teacher') or '').strip()
+                        subject = (lesson.get('subject') or '').strip()
+                        if not teacher or not subject or subject == "-----":
+                            continue
+                        self._by_key.setdefault(teacher_key(teacher), teacher)
+                        self._lessons.setdefault(teacher, {}).setdefault((day, week), []).append(TeacherLesson(
+                            day, week, lesson.get('lesson_number'), (lesson.get('time') or '').strip(),
+                            group, subject, (lesson.get('room') or lesson.get('classroom') or '').strip(),
+                            lesson.get('subgroup') or '',
+                        ))
+        for by_day in self._lessons.values():
+            for lessons in by_day.values():
+                lessons.sort(key=lambda l: (l.lesson_number or 0, l.group))
+
+        self._build_surnames()
+
+        for group, dates in (replacements or {}).items():
+            if not isinstance(dates, dict):
+                continue
+            for date, changes in dates.items():
+                for change in changes or ():
+                    if not isinstance(change, dict) or not (change.get('teacher') or '').strip():
+                        continue
+                    name = self._resolve(change['teacher'].strip())
+                    self._by_key.setdefault(teacher_key(name), name)
+                    self._replacements.setdefault(name, {}).setdefault(replacement_date(date), []).append(
+                        TeacherReplacement(replacement_date(date), str(change.get('lesson', '')), group,
+                                           str(change.get('subject', '')), str(change.get('room', '')))
+                    )
+        # Преподаватели, которые есть только в заменах, тоже находятся поиском
+        self._build_surnames()
+
+    def _build_surnames(self):
+        surnames = {}
+        for name in self._by_key.values():
+            surnames.setdefault(surname_key(name), []).append(name)
+        self._surnames = sorted((key, sorted(names)) for key, names in surnames.items())
+        self.names = sorted(self._by_key.values())
+
+    def _resolve(self, name):
+        # В заменах часто только фамилия: сопоставляем с расписанием, если она однозначна
+        known = self._by_key.get(teacher_key(name))
+        if known:
+            return known
+        idx = bisect.bisect_left(self._surnames, (surname_key(name),))
+        if idx < len(self._surnames) and self._surnames[idx][0] == surname_key(name):
+            names = self._surnames[idx][1]
+            if len(names) == 1:
+                return names[0]
+        return name
+
+    def by_key(self, key):
+        """Преподаватель по ключу teacher_key (для callback_data)"""
+        return self._by_key.get(key)
+
+    def find(self, query, limit=None):
+        """Преподаватели по фамилии или ее началу"""
+        exact = self._by_key.get(teacher_key(query))
+        if exact:
+            return [exact]
+        key = surname_key(query)
+        if not key:
+            return []
+        found = []
+        idx = bisect.bisect_left(self._surnames, (key,))
+        while idx < len(self._surnames) and self._surnames[idx][0].startswith(key):
+            found.extend(self._surnames[idx][1])
+            idx += 1
+        return found[:limit] if limit else found
+
+    def day(self, name, day, week):
+        """Пары преподавателя в день недели для недели 1 или 2"""
+        return self._lessons.get(name, {}).get((day, week), [])
+
+    def replacements_on(self, name, date_str):
+        """Замены с участием преподавателя на дату dd.mm.yyyy"""
+        return self._replacements.get(name, {}).get(date_str, [])
+
+    def __contains__(self, name):
+        return name in self._lessons or name in self._replacements
+
+    def __len__(self):
+        return len(self.names)
+
+
+# Кто занимает кабинет на паре
+Occupant = namedtuple('Occupant', 'group subject teacher replacement')
+
+_DAYS = ['Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье']
+_room_split_re = re.compile(r"[\n,;/]+")
+_lesson_range_re = re.compile(r"^(\d+)\s*-\s*(\d+)$")
+
+
+def room_key(room):
+    """Нормализованное название кабинета (Каб. 305 -> 305); пустая строка, если кабинета нет"""
+    room = str(room or '').strip().lower()
+    if room.startswith('каб.'):
+        room = room[4:]
+    room = room.replace(' ', '')
+    return '' if room in ('', '—', '-', 'nan') else room
+
+
+def split_rooms(value):
+    return [key for key in (room_key(part) for part in _room_split_re.split(str(value or ''))) if key]
+
+
+def replacement_lessons(value):
+    """Номера пар из колонки замен: "3" -> [3], "3-4" (академические часы) -> [2]"""
+    value = str(value or '').strip()
+    if value.isdigit():
+        return [int(value)]
+    match = _lesson_range_re.match(value)
+    if match:
+        first, last = int(match.group(1)), int(match.group(2))
+        if last == first + 1 and first % 2 == 1:
+            return [last // 2]
+        return list(range(first, last + 1)) if first <= last <= first + 8 else []
+    return []
+
+
+class RoomIndex:
+    """Занятость кабинетов: битовые маски по (день, неделя, пара) с наложением замен.
+
+    Для каждого слота хранится число, в котором бит i означает, что кабинет
+    rooms[i] занят; свободные кабинеты — это просто инверсия маски.
+    """
+
+    __slots__ = ('rooms', '_room_ids', '_all_bits', '_slot_bits', '_occupants', '_group_rooms',
+                 '_replacements', '_dated')
+
+    def __init__(self, schedule, replacements):
+        self._slot_bits = {}
+        self._occupants = {}
+        self._group_rooms = {}
+        self._replacements = {}
+        self._dated = {}
+        rooms = set()
+        entries = []
+        for group, days in schedule.items():
+            if not isinstance(days, dict):
+                continue
+            for day, day_data in days.items():
+                if isinstance(day_data, dict):
+                    weeks = [(week, day_data.get(week) or []) for week in (1, 2)]
+                elif isinstance(day_data, list):
+                    weeks = [(1, day_data), (2, day_data)]
+                else:
+                    continue
+                for week, lessons in weeks:
+                    for lesson in lessons:
+                        if not isinstance(lesson, dict) or not isinstance(lesson.get('lesson_number'), int):
+                            continue
+                        subject = (lesson.get('subject') or '').strip()
+                        if not subject or subject == "-----":
+                            continue
+                        occupant = Occupant(group, subject, (lesson.get('teacher') or '').strip(), False)
+                        for room in split_rooms(lesson.get('room') or lesson.get('classroom')):
+                            rooms.add(room)
+                            entries.append(((day, week, lesson['lesson_number']), room, occupant))
+        for group, dates in (replacements or {}).items():
+            if not isinstance(dates, dict):
+                continue
+            for date, changes in dates.items():
+                for change in changes or ():
+                    if not isinstance(change, dict):
+                        continue
+                    change_rooms = split_rooms(change.get('room'))
+                    rooms.update(change_rooms)
+                    occupant = Occupant(group, str(change.get('subject', '')), str(change.get('teacher', '')), True)
+                    self._replacements.setdefault(replacement_date(date), []).append(
+                        (replacement_lessons(change.get('lesson')), change_rooms, occupant)
+                    )
+
+        self.rooms = sorted(rooms)
+        self._room_ids = {room: i for i, room in enumerate(self.rooms)}
+        self._all_bits = (1 << len(self.rooms)) - 1
+        for slot, room, occupant in entries:
+            self._slot_bits[slot] = self._slot_bits.get(slot, 0) | (1 << self._room_ids[room])
+            self._occupants.setdefault(slot, {}).setdefault(room, []).append(occupant)
+            self._group_rooms.setdefault((occupant.group,) + slot, []).append(room)
+
+    def slot(self, date, lesson_number):
+        """Маска занятых кабинетов и кто в них на паре в конкретную дату (с заменами)"""
+        date_str = date.strftime('%d.%m.%Y')
+        key = (date_str, lesson_number)
+        cached = self._dated.get(key)
+        if cached is not None:
+            return cached
+        base = (_DAYS[date.weekday()], week_number_for(date), lesson_number)
+        bits = self._slot_bits.get(base, 0)
+        occupants = {room: list(items) for room, items in self._occupants.get(base, {}).items()}
+        for lessons, change_rooms, occupant in self._replacements.get(date_str, ()):
+            if lesson_number not in lessons:
+                continue
+            # Группа уходит из своего кабинета по расписанию...
+            for room in self._group_rooms.get((occupant.group,) + base, ()):
+                remaining = [o for o in occupants.get(room, ()) if o.group != occupant.group]
+                occupants[room] = remaining
+                if not remaining:
+                    bits &= ~(1 << self._room_ids[room])
+            # ...и занимает кабинет из замены
+            for room in change_rooms:
+                occupants.setdefault(room, []).append(occupant)
+                bits |= 1 << self._room_ids[room]
+        result = (bits, {room: items for room, items in occupants.items() if items})
+        if len(self._dated) > 256:
+            self._dated.clear()
+        self._dated[key] = result
+        return result
+
+    def free_rooms(self, date, lesson_number):
+        """Свободные кабинеты на паре"""
+        free = self._all_bits & ~self.slot(date, lesson_number)[0]
+        return [room for i, room in enumerate(self.rooms) if free >> i & 1]
+
+    def who_is_in(self, room, date, lessons=range(1, 9)):
+        """{номер пары: [Occupant, ...]} для кабинета на дату"""
+        room = room_key(room)
+        room_id = self._room_ids.get(room)
+        if room_id is None:
+            return {}
+        result = {}
+        for number in lessons:
+            bits, occupants = self.slot(date, number)
+            if bits >> room_id & 1:
+                result[number] = occupants.get(room, [])
+        return result
+
+    def find(self, query):
+        """Кабинеты, чье название начинается с query (305 -> 305, 305-1)"""
+        key = room_key(query)
+        if not key:
+            return []
+        if key in self._room_ids:
+            return [key]
+        idx = bisect.bisect_left(self.rooms, key)
+        found = []
+        while idx < len(self.rooms) and self.rooms[idx].startswith(key):
+            found.append(self.rooms[idx])
+            idx += 1
+        return found
+
+    def __len__(self):
+        return len(self.rooms)
+
+
+# Результат поиска: тип (group, teacher, subject), найденное значение и оценка
+SearchHit = namedtuple('SearchHit', 'kind value score')
+
+# Набор на неправильной раскладке: ghtgjl -> препод
+_EN_LAYOUT = "qwertyuiop[]asdfghjkl;'zxcvbnm,.`"
+_RU_LAYOUT = "йцукенгшщзхъфывапролджэячсмитьбюё"
+_en_to_ru = str.maketrans(_EN_LAYOUT, _RU_LAYOUT)
+_search_re = re.compile(r"[^0-9a-zа-я]+")
+
+
+def search_key(text):
+    return _search_re.sub("", str(text).lower().replace("ё", "е"))
+
+
+def query_variants(query):
+    """Варианты запроса: как есть и в русской раскладке, если набран латиницей"""
+    raw = str(query).lower()
+    variants = [search_key(raw)]
+    switched = search_key(raw.translate(_en_to_ru).replace("ё", "е"))
+    if switched not in variants:
+        variants.append(switched)
+    return [v for v in variants if v]
+
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """Нечеткий поиск по группам, преподавателям и предметам на триграммах.
+
+    Оценка — коэффициент Жаккара по триграммам с бонусом за совпадение начала,
+    поэтому "исп221", "Исп-22" и "bcg221" находят "Исп-221".
+    """
+
+    __slots__ = ('_entries', '_postings', '_subjects')
+
+    def __init__(self, groups, teacher_names, schedule):
+        self._entries = []
+        self._postings = {}
+        self._subjects = {}
+        for group, days in schedule.items():
+            if not isinstance(days, dict):
+                continue
+            for day_data in days.values():
+                # У групп на практике рядом с днями лежат 'practice' и флаг 'updated'
+                if isinstance(day_data, dict):
+                    weeks = [day_data.get(week) or [] for week in (1, 2)]
+                elif isinstance(day_data, list):
+                    weeks = [day_data]
+                else:
+                    continue
+                for lessons in weeks:
+                    if not isinstance(lessons, list):
+                        continue
+                    for lesson in lessons:
+                        if not isinstance(lesson, dict):
+                            continue
+                        subject = (lesson.get('subject') or '').strip()
+                        if not subject or subject == "-----":
+                            continue
+                        groups_set, teachers_set = self._subjects.setdefault(subject, (set(), set()))
+                        groups_set.add(group)
+                        if lesson.get('teacher'):
+                            teachers_set.add(lesson['teacher'].strip())
+        for kind, values in (('group', groups), ('teacher', teacher_names), ('subject', sorted(self._subjects))):
+            for value in values:
+                key = search_key(value)
+                if not key:
+                    continue
+                grams = trigrams(key)
+                entry_id = len(self._entries)
+                self._entries.append((kind, value, key, len(grams)))
+                for gram in grams:
+                    self._postings.setdefault(gram, []).append(entry_id)
+
+    def search(self, query, limit=10, min_score=0.3):
+        best = {}
+        for variant in query_variants(query):
+            grams = trigrams(variant)
+            hits = {}
+            for gram in grams:
+                for entry_id in self._postings.get(gram, ()):
+                    hits[entry_id] = hits.get(entry_id, 0) + 1
+            for entry_id, common in hits.items():
+                kind, value, key, size = self._entries[entry_id]
+                score = common / (len(grams) + size - common)
+                if key.startswith(variant):
+                    score += 0.5
+                if score >= min_score and score > best.get(entry_id, 0):
+                    best[entry_id] = score
+        ranked = sorted(best.items(), key=lambda item: (-item[1], self._entries[item[0]][1]))
+        return [SearchHit(self._entries[i][0], self._entries[i][1], score) for i, score in ranked[:limit]]
+
+    def subject_info(self, subject):
+        """(группы, преподаватели), у которых есть предмет"""
+        groups, teachers = self._subjects.get(subject, ((), ()))
+        return sorted(groups), sorted(teachers)
+
+    def __len__(self):
+        return len(self._entries)
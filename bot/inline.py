@@ -0,0 +1,112 @@
+import os
+import hashlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from aiogram import Router, types
+from aiogram.types import InlineQueryResultArticle, InputTextMessageContent
+
+from .handlers import get_schedule_text
+from .snapshot import get_snapshot, normalize_group
+from .metrics import cache_hit, cache_miss
+
+try:
+    from zoneinfo import ZoneInfo
+    TZ_MSK = ZoneInfo("Europe/Moscow")
+except ImportError:
+    from pytz import timezone
+    TZ_MSK = timezone("Europe/Moscow")
+
+router = Router()
+
+# Сколько секунд Telegram может сам отдавать закэшированный ответ на тот же запрос
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", 300))
+# Сколько групп показывать по одному запросу (по три результата на группу)
+INLINE_MAX_GROUPS = 5
+# Сколько разных запросов держать в памяти
+INLINE_CACHE_SIZE = 512
+# Ограничение Telegram на длину сообщения
+MESSAGE_LIMIT = 4096
+
+WEEKDAYS = ['Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье']
+WEEK_DAYS = WEEKDAYS[:6]
+
+# {(версия снимка, дата, нормализованный префикс): [результаты]}
+_results_cache = OrderedDict()
+
+
+def _school_day(date):
+    # В воскресенье показываем понедельник, как и в основном меню
+    return date + timedelta(days=1) if date.weekday() == 6 else date
+
+
+def _fit(text, limit=MESSAGE_LIMIT):
+    """Укорачивает текст до лимита по границе строки.
+
+    Теги в тексте не переходят через строку, поэтому обрезка между строками
+    не разрывает ни тег, ни HTML-сущность. Срез по символам мог бы, и
+    Telegram отклонил бы сообщение с «can't parse entities».
+    """
+    if len(text) <= limit:
+        return text
+    cut = text.rfind("\n", 0, limit - 1)
+    return text[:cut] + "\n…" if cut > 0 else "…"
+
+
+def _article(snapshot, group, kind, title, description, text):
+    result_id = hashlib.md5(f"{snapshot.version}:{group}:{kind}".encode("utf-8")).hexdigest()
+    return InlineQueryResultArticle(
+        id=result_id,
+        title=title,
+        description=description,
+        input_message_content=InputTextMessageContent(message_text=_fit(text), parse_mode="HTML"),
+    )
+
+
+def build_results(snapshot, query, now):
+    """Результаты inline-запроса: сегодня, завтра и неделя для каждой подходящей группы"""
+    today = _school_day(now)
+    tomorrow = _school_day(now + timedelta(days=1))
+    results = []
+    for group in snapshot.find_groups(query, limit=INLINE_MAX_GROUPS):
+        for kind, date, label in (('today', today, 'сегодня'), ('tomorrow', tomorrow, 'завтра')):
+            # Тексты на сегодня и завтра уже собраны в снимке вместе с заменами
+            _, day_text = snapshot.day(group, date)
+            description = f"{WEEKDAYS[date.weekday()]}, {date.strftime('%d.%m.%Y')}"
+            results.append(_article(snapshot, group, kind, f"{group} — {label}", description,
+                                    f"<b>{group}</b>\n" + day_text))
+        week = '\n'.join(
+            get_schedule_text(group, day, schedule_data=snapshot.schedule) for day in WEEK_DAYS
+        )
+        results.append(_article(snapshot, group, 'week', f"{group} — неделя", "Понедельник — суббота",
+                                f"<b>{group}</b>\n" + week))
+    return results
+
+
+def get_results(query, now=None):
+    """Результаты из кэша по (версии снимка, дате, запросу); при промахе строятся заново"""
+    snapshot = get_snapshot()
+    now = now or datetime.now(TZ_MSK)
+    key = (snapshot.version, now.date(), normalize_group(query))
+    results = _results_cache.get(key)
+    if results is not None:
+        cache_hit("inline")
+        _results_cache.move_to_end(key)
+        return results
+    cache_miss("inline")
+    results = build_results(snapshot, query, now)
+    _results_cache[key] = results
+    if len(_results_cache) > INLINE_CACHE_SIZE:
+        _results_cache.popitem(last=False)
+    return results
+
+
+@router.inline_query()
+async def inline_schedule(inline_query: types.InlineQuery):
+    query = inline_query.query or ''
+    if not get_snapshot().version:
+        # Расписание еще не загружено после запуска — просим Telegram не кэшировать пустой ответ
+        await inline_query.answer([], cache_time=5, is_personal=False)
+        return
+    results = get_results(query) if normalize_group(query) else []
+    await inline_query.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=False)
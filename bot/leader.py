@@ -0,0 +1,136 @@
+import os
+import asyncio
+import logging
+import functools
+
+import asyncpg
+
+from .metrics import register_collector
+
+logger = logging.getLogger("leader")
+
+# Ключ advisory-lock, общий для всех реплик одного бота
+LEADER_LOCK_KEY = int(os.getenv("LEADER_LOCK_KEY", 724_318_001))
+# Блокировка живет, пока живо соединение, поэтому нужен session mode (не pgbouncer transaction)
+LEADER_DSN = os.getenv("LEADER_DSN") or os.getenv("DATABASE_URL")
+# Как часто ведомые пробуют захватить блокировку, а лидер проверяет соединение, секунды
+LEADER_CHECK_INTERVAL = float(os.getenv("LEADER_CHECK_INTERVAL", 10))
+
+
+class LeaderElection:
+    """Выбор лидера через pg_try_advisory_lock на отдельном соединении.
+
+    Лидер держит сессионную блокировку, пока живо его соединение. Когда
+    процесс лидера падает, Postgres закрывает сессию и снимает блокировку,
+    и одна из ведомых реплик захватывает ее на следующей проверке.
+    """
+
+    def __init__(self, key=LEADER_LOCK_KEY, interval=LEADER_CHECK_INTERVAL):
+        self.key = key
+        self.interval = interval
+        self.is_leader = False
+        self.elections = 0
+        self._callbacks = []
+        self._conn = None
+        self._task = None
+
+    def on_elected(self, callback):
+        """Регистрирует callback(), вызываемый при получении лидерства"""
+        self._callbacks.append(callback)
+
+    def start(self, dsn=LEADER_DSN):
+        if self._task is not None:
+            return
+        if not dsn:
+            # Без базы реплика одна, она и лидер
+            self._set_leader(True)
+            return
+        self._task = asyncio.create_task(self._run(dsn))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._close()
+
+    def _set_leader(self, value):
+        if value == self.is_leader:
+            return
+        self.is_leader = value
+        if not value:
+            logger.warning("Лидерство потеряно, фоновые задачи приостановлены")
+            return
+        self.elections += 1
+        logger.info("Реплика стала лидером и выполняет фоновые задачи")
+        for callback in self._callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Ошибка обработчика получения лидерства: {e}")
+
+    async def _close(self):
+        conn, self._conn = self._conn, None
+        self._set_leader(False)
+        if conn is not None and not conn.is_closed():
+            try:
+                # Закрытие сессии снимает блокировку, отдельный unlock не нужен
+                await conn.close(timeout=5)
+            except Exception:
+                conn.terminate()
+
+    async def _check(self, dsn):
+        if self._conn is None or self._conn.is_closed():
+            self._set_leader(False)
+            self._conn = await asyncpg.connect(
+                dsn, server_settings={'application_name': "raspisanie-bot:leader"}
+            )
+            # Обрыв соединения означает, что блокировку уже может держать другая реплика
+            self._conn.add_termination_listener(lambda _: self._set_leader(False))
+        if self.is_leader:
+            # Проверяем, что сессия с блокировкой жива
+            await self._conn.fetchval("SELECT 1", timeout=self.interval)
+        else:
+            acquired = await self._conn.fetchval(
+                "SELECT pg_try_advisory_lock($1)", self.key, timeout=self.interval
+            )
+            self._set_leader(bool(acquired))
+
+    async def _run(self, dsn):
+        while True:
+            try:
+                await self._check(dsn)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка проверки лидерства: {e}")
+                await self._close()
+            await asyncio.sleep(self.interval)
+
+
+# Общий выбор лидера процесса
+leader = LeaderElection()
+
+
+def leader_only(func):
+    """Задача планировщика, которая на ведомых репликах пропускается"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if not leader.is_leader:
+            logger.debug(f"{func.__name__}: реплика не лидер, пропускаем")
+            return None
+        return await func(*args, **kwargs)
+    return wrapper
+
+
+def _leader_metrics():
+    return [
+        ("leader_is_leader", "gauge", "Реплика является лидером фоновых задач", [({}, int(leader.is_leader))]),
+        ("leader_elections_total", "counter", "Сколько раз реплика получала лидерство", [({}, leader.elections)]),
+    ]
+
+
+register_collector(_leader_metrics)
@@ -2,7 +2,7 @@ import os
 import asyncio
 import logging
 from aiogram import Bot, Dispatcher
-from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiogram.webhook.aiohttp_server import setup_application
 from aiohttp import web
 import asyncpg
 from dotenv import load_dotenv
@@ -10,16 +10,38 @@ from dotenv import load_dotenv
 from bot.handlers import router as main_router
 from bot.features import router as features_router
 from bot.admin import router as admin_router
-from bot.middlewares import DbMiddleware
+from bot.inline import router as inline_router
+from bot.teachers import router as teachers_router
+from bot.rooms import router as rooms_router
+from bot.search import router as search_router
+from bot.middlewares import DbMiddleware, MetricsMiddleware
 from bot.init_groups import add_groups_to_db
 from bot.scheduler import setup_scheduler
+from bot.pools import create_pools, close_pools, pools_metrics
+from bot.metrics import register_collector
+from bot.tracing import TracingMiddleware, TelegramTracingMiddleware
+from bot.outbox import outbox
+from bot.webhook import create_webhook_handler
+from bot.notifications import fanout, create_notification_tables
+from bot.digest import create_digest_tables
+from bot.activity import user_activity
+from bot.web import setup_routes
+from bot.snapshot_store import snapshot_store, create_snapshot_tables
+from bot.workers import WEB_WORKERS, run_workers, worker_index
+from bot.fsm import fsm_storage, create_fsm_tables
+from bot.bus import bus
+from bot.leader import leader
+from bot.profiling import loop_monitor
 
 load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 DATABASE_URL = os.getenv("DATABASE_URL")
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")
 WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Адрес Bot API: собственный сервер telegram-bot-api или заглушка нагрузочного теста (bench.loadgen)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
 def _parse_admins(env_value):
     admins = []
     for admin_id in env_value.split(","):
@@ -32,34 +54,62 @@ ADMINS = _parse_admins(os.getenv("ADMINS", ""))
 PORT = int(os.getenv("PORT", 8080))
 
 async def create_pool():
-    """Создает пул соединений с базой данных."""
-    return await asyncpg.create_pool(
-        dsn=DATABASE_URL,
-        min_size=5,  # Увеличиваем минимальный размер пула
-        max_size=20, # Увеличиваем максимальный размер пула
-        command_timeout=30,
-        max_queries=50000
-    )
+    """Создает именованные пулы соединений с базой данных (interactive, background, admin)."""
+    return await create_pools(DATABASE_URL, DATABASE_REPLICA_URL)
 
 async def on_startup(bot: Bot, dp: Dispatcher, app: web.Application):
     """Действия при запуске бота."""
-    await bot.set_webhook(f"{WEBHOOK_URL}/webhook", secret_token=WEBHOOK_SECRET)
-    logging.info(f"Webhook установлен на {WEBHOOK_URL}/webhook")
-
-    # Добавляем middleware
-    pool = app['db_pool']
+    # В режиме нескольких процессов вебхук регистрирует только первый
+    if not worker_index():
+        await bot.set_webhook(f"{WEBHOOK_URL}/webhook", secret_token=WEBHOOK_SECRET)
+        logging.info(f"Webhook установлен на {WEBHOOK_URL}/webhook")
+
+    # Сторож event loop: задержка в метриках, стеки блокирующих вызовов в /loop
+    loop_monitor.start()
+
+    # Добавляем middleware: обработчики апдейтов работают только с interactive-пулом
+    pool = app['db_pools']['interactive']
+    # Трассировка оборачивает апдейт целиком, до всех остальных middleware
+    dp.update.outer_middleware(TracingMiddleware())
     dp.message.middleware(DbMiddleware(pool))
     dp.callback_query.middleware(DbMiddleware(pool))
+    dp.message.middleware(MetricsMiddleware('message'))
+    dp.callback_query.middleware(MetricsMiddleware('callback_query'))
+
+    # Отложенная запись пользователей идет через фоновый пул
+    user_activity.start(app['db_pools']['background'])
+    # Рассылка уведомлений продолжает очередь, оставшуюся с прошлого запуска
+    fanout.start(bot, app['db_pools']['background'])
+    # Шина инвалидации держит кэши реплик согласованными (LISTEN на отдельном соединении)
+    bus.start(app['db_pools']['background'])
+    # Обновление, сводку и очистку выполняет только реплика, удерживающая advisory lock
+    leader.start()
+    # Снимок расписания загружаем сразу, не дожидаясь планировщика: готовый из базы,
+    # а если его там нет — скачиваем и разбираем файлы
+    snapshot_store.start(app['db_pools']['background'])
+    app['snapshot_task'] = asyncio.create_task(snapshot_store.load_or_refresh())
 
 async def on_shutdown(app: web.Application):
     """Действия при остановке бота."""
     logging.warning("Shutting down..")
+
+    await fanout.stop()
+    await outbox.stop()
+    await bus.stop()
+    await leader.stop()
+    await loop_monitor.stop()
+
+    # Дописываем накопленные изменения пользователей до закрытия пулов
+    try:
+        await user_activity.stop()
+    except Exception as e:
+        logging.error(f"Ошибка при сбросе буфера пользователей: {e}")
     
-    # Закрываем пул соединений
-    if 'db_pool' in app:
-        logging.info("Closing database pool...")
-        await app['db_pool'].close()
-        logging.info("Database pool closed.")
+    # Закрываем пулы соединений
+    if 'db_pools' in app:
+        logging.info("Closing database pools...")
+        await close_pools(app['db_pools'])
+        logging.info("Database pools closed.")
     
     logging.warning("Bye!")
 
@@ -72,6 +122,19 @@ async def create_tables(pool: asyncpg.Pool):
                 group_name VARCHAR(255)
             );
         """)
+        await conn.execute("""
+            ALTER TABLE users
+                ADD COLUMN IF NOT EXISTS joined_at TIMESTAMP DEFAULT NOW(),
+                ADD COLUMN IF NOT EXISTS role TEXT DEFAULT NULL,
+                ADD COLUMN IF NOT EXISTS username TEXT,
+                ADD COLUMN IF NOT EXISTS last_seen TIMESTAMP,
+                ADD COLUMN IF NOT EXISTS teacher_name TEXT;
+        """)
+        await conn.execute("CREATE INDEX IF NOT EXISTS idx_users_last_seen ON users(last_seen);")
+        await create_notification_tables(conn)
+        await create_digest_tables(conn)
+        await create_snapshot_tables(conn)
+        await create_fsm_tables(conn)
         await conn.execute("""
             CREATE TABLE IF NOT EXISTS groups (
                 name VARCHAR(255) PRIMARY KEY
@@ -82,21 +145,41 @@ async def main():
     logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s %(name)s: %(message)s')
     
     from aiogram.client.bot import DefaultBotProperties
-    bot = Bot(BOT_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
-    dp = Dispatcher()
+    session = None
+    if TELEGRAM_API_URL:
+        from aiogram.client.session.aiohttp import AiohttpSession
+        from aiogram.client.telegram import TelegramAPIServer
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+        logging.info(f"Bot API: {TELEGRAM_API_URL}")
+    bot = Bot(BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode="HTML"))
+    bot.session.middleware(TelegramTracingMiddleware())
+    # Все запросы к Bot API идут через очередь: ответы пользователям раньше рассылок
+    bot.session.middleware(outbox)
+    # Состояния FSM переживают перезапуск и общие для всех реплик
+    dp = Dispatcher(storage=fsm_storage)
 
     # Регистрируем роутеры
     dp.include_router(main_router)
     dp.include_router(features_router)
     dp.include_router(admin_router)
+    dp.include_router(inline_router)
+    dp.include_router(teachers_router)
+    dp.include_router(rooms_router)
+    # Поиск по свободному тексту — последним, после всех кнопок и команд
+    dp.include_router(search_router)
 
     app = web.Application()
-    app['db_pool'] = await create_pool()
+    app['db_pools'] = await create_pool()
+    app['db_pool'] = app['db_pools']['interactive']
+    fsm_storage.start(app['db_pools']['interactive'])
     app['bot'] = bot
+    # Пулы доступны в обработчиках как аргумент pools
+    dp['pools'] = app['db_pools']
+    register_collector(lambda: pools_metrics(app['db_pools']))
     # Создаем таблицы
     try:
-        await create_tables(app['db_pool'])
-        groups_added = await add_groups_to_db(app['db_pool'])
+        await create_tables(app['db_pools']['background'])
+        groups_added = await add_groups_to_db(app['db_pools']['background'])
         logging.info(f"Добавлено {groups_added} групп в базу данных")
     except Exception as e:
         logging.error(f"Ошибка при инициализации таблиц/групп: {e}")
@@ -106,10 +189,8 @@ async def main():
     except Exception as e:
         logging.error(f"Ошибка при запуске scheduler: {e}")
     # Configure webhook
-    webhook_requests_handler = SimpleRequestHandler(
-        dispatcher=dp,
-        bot=bot,
-    )
+    # Telegram получает ответ сразу, апдейты обрабатываются пулом воркеров (WEBHOOK_MODE)
+    webhook_requests_handler = create_webhook_handler(dp, bot, secret_token=WEBHOOK_SECRET)
     webhook_requests_handler.register(app, path="/webhook")
     # Startup and shutdown hooks
     app.on_startup.append(lambda app: on_startup(bot, dp, app))
@@ -121,6 +202,8 @@ async def main():
         logging.error(f"500 Internal Server Error: {request.method} {request.path}")
         return web.Response(text="Internal Server Error", status=500)
     app.router.add_route('*', '/error', handle_500)
+    # Служебные ручки (статистика запросов и т.п.)
+    setup_routes(app)
 
     # Setup AIOHTTP app
     setup_application(app, dp, bot=bot)
@@ -128,14 +211,19 @@ async def main():
     # Run application
     runner = web.AppRunner(app)
     await runner.setup()
-    site = web.TCPSite(runner, "0.0.0.0", PORT)
+    # Воркеры лаунчера слушают один порт, ядро распределяет соединения (SO_REUSEPORT)
+    site = web.TCPSite(runner, "0.0.0.0", PORT, reuse_port=worker_index() is not None)
     await site.start()
 
-    logging.info("Бот запущен")
+    logging.info("Бот запущен" if worker_index() is None else f"Воркер {worker_index()} запущен")
     try:
         await asyncio.Event().wait()
     finally:
         await runner.cleanup()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if WEB_WORKERS > 1:
+        logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s %(name)s: %(message)s')
+        run_workers(main, WEB_WORKERS)
+    else:
+        asyncio.run(main())
@@ -0,0 +1,65 @@
+from .handlers import get_schedule_text
+from .indexes import week_number_for, replacement_lessons
+from .parsers.schedule import replacements_for_date
+
+WEEKDAYS = ['Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье']
+
+
+def base_lessons(schedule, group, date):
+    """Пары группы по основному расписанию на дату с учетом четности недели"""
+    group_data = schedule.get(group)
+    if not isinstance(group_data, dict):
+        return []
+    day_data = group_data.get(WEEKDAYS[date.weekday()])
+    if isinstance(day_data, dict):
+        day_data = day_data.get(week_number_for(date), [])
+    return [lesson for lesson in day_data or () if isinstance(lesson, dict)]
+
+
+def effective_lessons(schedule, replacements, group, date):
+    """Итоговые пары группы на дату: основное расписание с наложенными заменами.
+
+    Замена вытесняет пару с тем же номером; если номер в файле замен не
+    разобрать, замена добавляется в конец списка.
+    """
+    lessons = {}
+    extra = []
+    for lesson in base_lessons(schedule, group, date):
+        subject = (lesson.get('subject') or '').strip()
+        if subject and subject != "-----":
+            lessons.setdefault(lesson.get('lesson_number'), []).append(lesson)
+    for changes in replacements_for_date((replacements or {}).get(group), date).values():
+        for change in changes or ():
+            if not isinstance(change, dict) or not change.get('subject'):
+                continue
+            numbers = replacement_lessons(change.get('lesson'))
+            for number in numbers or [None]:
+                replaced = lessons.get(number, [])
+                merged = {
+                    'lesson_number': number,
+                    'time': f"{number} пара" if number else str(change.get('lesson', '')),
+                    'subject': str(change.get('subject', '')).strip(),
+                    'teacher': str(change.get('teacher', '')).strip(),
+                    'room': str(change.get('room', '')).strip(),
+                    'replacement': True,
+                    'replaced': ', '.join(l.get('subject', '') for l in replaced if not l.get('replacement')),
+                }
+                if number is None:
+                    extra.append(merged)
+                elif replaced and replaced[0].get('replacement'):
+                    # Вторая замена на ту же пару (например, по подгруппам)
+                    replaced.append(merged)
+                else:
+                    lessons[number] = [merged]
+    ordered = [lesson for number in sorted(n for n in lessons if n is not None) for lesson in lessons[number]]
+    return ordered + lessons.get(None, []) + extra
+
+
+def render_day(schedule, replacements, group, date, last_update=None):
+    """(пары, текст) расписания группы на конкретную дату с заменами"""
+    lessons = effective_lessons(schedule, replacements, group, date)
+    text = get_schedule_text(
+        group, WEEKDAYS[date.weekday()], date.strftime('%d.%m.%Y'),
+        lessons=lessons, last_update=last_update, schedule_data=schedule
+    )
+    return lessons, text
@@ -0,0 +1,189 @@
+import math
+import threading
+
+# Метрики в текстовом формате Prometheus без обязательных зависимостей.
+# Если установлен prometheus_client, к выдаче добавляются его метрики (процесс, GC).
+try:
+    from prometheus_client import generate_latest as _client_generate_latest
+except ImportError:
+    _client_generate_latest = None
+
+# Границы корзин гистограмм по умолчанию, секунды
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Границы для размеров файлов, байты
+SIZE_BUCKETS = (16_384, 65_536, 262_144, 1_048_576, 4_194_304, 16_777_216)
+
+_registry = []
+_collectors = []
+_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        with _lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = 'le="' + _format_value(float(bound)) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+def register_collector(collector):
+    """Регистрирует функцию, которая при каждом опросе возвращает список метрик.
+
+    Формат: [(имя, тип, описание, [({метка: значение}, число), ...]), ...]
+    """
+    _collectors.append(collector)
+
+
+def _render_collected(families):
+    lines = []
+    for name, kind, documentation, samples in families:
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            label_str = _format_labels(list(labels.keys()), list(labels.values()))
+            lines.append(f"{name}{label_str} {_format_value(value)}")
+    return lines
+
+
+def render_metrics():
+    """Все метрики процесса в текстовом формате Prometheus"""
+    lines = []
+    for metric in list(_registry):
+        lines.extend(metric.render())
+    for collector in list(_collectors):
+        try:
+            lines.extend(_render_collected(collector()))
+        except Exception as e:
+            lines.append(f"# collector error: {_escape(e)}")
+    text = "\n".join(lines) + "\n"
+    if _client_generate_latest is not None:
+        text += _client_generate_latest().decode("utf-8")
+    return text
+
+
+# --- Метрики бота ---
+
+UPDATES = Counter(
+    "bot_updates_total", "Обработанные апдейты по обработчику и префиксу",
+    ("event", "handler", "prefix", "status"),
+)
+HANDLER_LATENCY = Histogram(
+    "bot_handler_seconds", "Время работы обработчика апдейта",
+    ("event", "handler"),
+)
+FETCH_SECONDS = Histogram(
+    "schedule_fetch_seconds", "Время скачивания файла с сайта колледжа", ("source",),
+)
+FETCH_BYTES = Histogram(
+    "schedule_fetch_bytes", "Размер скачанного файла", ("source",), buckets=SIZE_BUCKETS,
+)
+PARSE_SECONDS = Histogram(
+    "schedule_parse_seconds", "Время разбора файла", ("source",),
+)
+FETCH_ERRORS = Counter(
+    "schedule_fetch_errors_total", "Ошибки скачивания или разбора файла", ("source",),
+)
+CACHE_REQUESTS = Counter(
+    "cache_requests_total", "Обращения к кэшам", ("cache", "result"),
+)
+
+
+def cache_hit(cache):
+    CACHE_REQUESTS.inc(cache=cache, result="hit")
+
+
+def cache_miss(cache):
+    CACHE_REQUESTS.inc(cache=cache, result="miss")
+
+
+def _cache_ratio_collector():
+    totals = {}
+    for (cache, result), value in list(CACHE_REQUESTS._values.items()):
+        hits, count = totals.get(cache, (0, 0))
+        totals[cache] = (hits + (value if result == "hit" else 0), count + value)
+    samples = [({"cache": cache}, hits / count) for cache, (hits, count) in sorted(totals.items()) if count]
+    return [("cache_hit_ratio", "gauge", "Доля попаданий в кэш с запуска процесса", samples)]
+
+
+register_collector(_cache_ratio_collector)
@@ -1,9 +1,13 @@
 import logging
+import time
 from typing import Callable, Awaitable, Any
 from aiogram import BaseMiddleware
 from aiogram.types import TelegramObject
 from asyncpg.pool import Pool
 
+from .activity import user_activity
+from .metrics import UPDATES, HANDLER_LATENCY
+
 class DbMiddleware(BaseMiddleware):
     def __init__(self, pool: Pool):
         self.pool = pool
@@ -14,6 +18,9 @@ class DbMiddleware(BaseMiddleware):
         event: TelegramObject,
         data: dict[str, Any]
     ) -> Any:
+        user = data.get('event_from_user')
+        if user:
+            user_activity.touch(user.id, user.username)
         async with self.pool.acquire() as conn:
             data['db'] = conn
             try:
@@ -29,4 +36,41 @@ class DbMiddleware(BaseMiddleware):
                     logging.error("Could not send error message to user")
             finally:
                 if 'db' in data:
-                    del data['db']
\ No newline at end of file
+                    del data['db']
+
+
+def _event_prefix(event: TelegramObject) -> str:
+    """Префикс callback_data или команда сообщения, для меток метрик"""
+    data = getattr(event, 'data', None)
+    if isinstance(data, str):
+        return data.split('_', 1)[0]
+    text = getattr(event, 'text', None)
+    if isinstance(text, str) and text.startswith('/'):
+        return text.split()[0].split('@')[0]
+    return 'text'
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Считает апдейты и время работы обработчиков для /metrics"""
+
+    def __init__(self, event_type: str):
+        self.event_type = event_type
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any]
+    ) -> Any:
+        handler_object = data.get('handler')
+        name = getattr(getattr(handler_object, 'callback', None), '__name__', 'unknown')
+        status = 'ok'
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            status = 'error'
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, event=self.event_type, handler=name)
+            UPDATES.inc(event=self.event_type, handler=name, prefix=_event_prefix(event), status=status)
@@ -0,0 +1,419 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+
+from .parsers.schedule import format_replacements
+from .metrics import Counter
+
+logger = logging.getLogger("notifications")
+
+# Глобальный лимит Telegram ~30 сообщений/с, держим запас
+FANOUT_RATE = float(os.getenv("FANOUT_RATE", 25))
+# Не чаще одного сообщения в секунду в один чат
+PER_CHAT_INTERVAL = float(os.getenv("FANOUT_PER_CHAT_INTERVAL", 1.0))
+FANOUT_CONCURRENCY = int(os.getenv("FANOUT_CONCURRENCY", 8))
+FANOUT_BATCH = int(os.getenv("FANOUT_BATCH", 100))
+FANOUT_MAX_ATTEMPTS = int(os.getenv("FANOUT_MAX_ATTEMPTS", 5))
+# Через сколько секунд "зависшие" в отправке сообщения возвращаются в очередь
+STALE_CLAIM_SECONDS = 300
+# Как часто искать зависшие сообщения, секунды
+STALE_CLAIM_CHECK_INTERVAL = 60
+
+NOTIFICATIONS_SENT = Counter(
+    "notifications_total", "Результаты отправки уведомлений", ("kind", "result"),
+)
+
+NOTIFICATION_QUEUE_TABLE = """
+CREATE TABLE IF NOT EXISTS notification_queue (
+    id BIGSERIAL PRIMARY KEY,
+    chat_id BIGINT NOT NULL,
+    kind TEXT NOT NULL,
+    text TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending', -- pending, sending, sent, failed
+    attempts INT NOT NULL DEFAULT 0,
+    not_before TIMESTAMP NOT NULL DEFAULT NOW(),
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    claimed_at TIMESTAMP,
+    expires_at TIMESTAMP, -- не отправлять после этого момента (например, утренняя сводка)
+    sent_at TIMESTAMP,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_notification_queue_pending
+    ON notification_queue(id) WHERE status = 'pending';
+"""
+
+REPLACEMENT_DIGESTS_TABLE = """
+CREATE TABLE IF NOT EXISTS replacement_digests (
+    group_name TEXT NOT NULL,
+    date TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    updated_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (group_name, date)
+);
+"""
+
+# Одна строка: хэши замен уже сохранялись, и пустая replacement_digests значит «замен нет»,
+# а не «первый запуск»
+REPLACEMENT_DIGEST_STATE_TABLE = """
+CREATE TABLE IF NOT EXISTS replacement_digest_state (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    initialized_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+"""
+
+
+async def create_notification_tables(conn):
+    await conn.execute(NOTIFICATION_QUEUE_TABLE)
+    await conn.execute("ALTER TABLE notification_queue ADD COLUMN IF NOT EXISTS expires_at TIMESTAMP")
+    await conn.execute(REPLACEMENT_DIGESTS_TABLE)
+    await conn.execute(REPLACEMENT_DIGEST_STATE_TABLE)
+    # Базы, где хэши уже есть, первым запуском не считаются
+    await conn.execute(
+        """
+        INSERT INTO replacement_digest_state (id)
+        SELECT TRUE WHERE EXISTS (SELECT 1 FROM replacement_digests)
+        ON CONFLICT DO NOTHING
+        """
+    )
+    await conn.execute(
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS notify_replacements BOOLEAN DEFAULT TRUE"
+    )
+
+
+# --- Поиск изменений в заменах ---
+
+def replacement_digests(replacements):
+    """Хэш замен для каждой пары (группа, дата)"""
+    digests = {}
+    for group, dates in (replacements or {}).items():
+        if not isinstance(dates, dict):
+            continue
+        for date, changes in dates.items():
+            if not changes:
+                continue
+            payload = json.dumps(changes, ensure_ascii=False, sort_keys=True)
+            digests[(group, date)] = hashlib.sha1(payload.encode('utf-8')).hexdigest()
+    return digests
+
+
+async def diff_replacements(conn, replacements):
+    """Сравнивает замены с предыдущей версией и сохраняет новую.
+
+    Возвращает список (группа, дата), у которых замены появились или изменились.
+    При самом первом запуске ничего не возвращает, чтобы не разослать всю историю.
+    Вызывается внутри транзакции, в которой ставятся уведомления: если постановка
+    не удалась, новые хэши тоже не сохраняются.
+    """
+    current = replacement_digests(replacements)
+    # Блокировка строки-маркера упорядочивает параллельные сравнения
+    initialized = await conn.fetchval("SELECT id FROM replacement_digest_state FOR UPDATE")
+    rows = await conn.fetch("SELECT group_name, date, digest FROM replacement_digests")
+    previous = {(r['group_name'], r['date']): r['digest'] for r in rows}
+    if initialized:
+        changed = [key for key, digest in current.items() if previous.get(key) != digest]
+    else:
+        changed = []
+        await conn.execute("INSERT INTO replacement_digest_state (id) VALUES (TRUE) ON CONFLICT DO NOTHING")
+
+    await conn.execute("DELETE FROM replacement_digests")
+    if current:
+        keys = list(current)
+        await conn.execute(
+            """
+            INSERT INTO replacement_digests (group_name, date, digest)
+            SELECT * FROM unnest($1::text[], $2::text[], $3::text[])
+            """,
+            [k[0] for k in keys], [k[1] for k in keys], [current[k] for k in keys]
+        )
+    return changed
+
+
+async def enqueue_group_message(conn, group, kind, text,
+                                opt_in="COALESCE(notify_replacements, TRUE)", expires_at=None):
+    """Ставит сообщение в очередь всем подписанным пользователям группы одним запросом"""
+    status = await conn.execute(
+        f"""
+        INSERT INTO notification_queue (chat_id, kind, text, expires_at)
+        SELECT user_id, $2, $3, $4 FROM users
+        WHERE group_name = $1 AND {opt_in}
+        """,
+        group, kind, text, expires_at
+    )
+    return int(status.split()[-1])
+
+
+async def notify_replacement_changes(pool, replacements):
+    """Находит изменившиеся замены и ставит уведомления в очередь"""
+    # Хэши и уведомления сохраняются вместе: изменение не считается увиденным, пока не в очереди
+    async with pool.acquire() as conn, conn.transaction():
+        changed = await diff_replacements(conn, replacements)
+        if not changed:
+            return 0
+        by_group = {}
+        for group, date in changed:
+            by_group.setdefault(group, {})[date] = replacements[group][date]
+        total = 0
+        for group, dates in by_group.items():
+            text = "🔔 Обновились замены!\n\n" + format_replacements(group, dates)
+            total += await enqueue_group_message(conn, group, 'replacements', text)
+    logger.info(f"Замены изменились у {len(by_group)} групп, в очередь поставлено {total} уведомлений")
+    fanout.wake()
+    return total
+
+
+# --- Рассылка ---
+
+class TokenBucket:
+    """Ограничитель скорости: rate токенов в секунду, запас capacity"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        """Останавливает выдачу токенов (после RetryAfter от Telegram)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class FanoutEngine:
+    """Рассылка из таблицы notification_queue с учетом лимитов Telegram.
+
+    Очередь хранится в БД, поэтому после перезапуска рассылка продолжается
+    с того места, где остановилась.
+    """
+
+    def __init__(self, rate=FANOUT_RATE, concurrency=FANOUT_CONCURRENCY, batch_size=FANOUT_BATCH):
+        self.bucket = TokenBucket(rate)
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self._chat_last_sent = {}
+        self._wakeup = asyncio.Event()
+        self._bot = None
+        self._pool = None
+        self._task = None
+        # id сообщений, которые этот процесс забрал в отправку и еще не отметил
+        self._claimed = set()
+
+    def start(self, bot, pool):
+        self._bot = bot
+        self._pool = pool
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._claimed:
+            try:
+                await self._release_own_claims()
+            except Exception as e:
+                logger.error(f"Не удалось вернуть {len(self._claimed)} уведомлений в очередь: {e}")
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def _run(self):
+        # Зависшие после падения этой или другой реплики сообщения ищем не только при старте
+        next_release = 0.0
+        while True:
+            if time.monotonic() >= next_release:
+                try:
+                    await self._release_stale_claims()
+                except Exception as e:
+                    logger.error(f"Не удалось вернуть зависшие уведомления в очередь: {e}")
+                next_release = time.monotonic() + STALE_CLAIM_CHECK_INTERVAL
+            try:
+                processed = await self.process_batch()
+            except Exception as e:
+                logger.error(f"Ошибка рассылки: {e}")
+                processed = 0
+            if processed:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=10)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _release_stale_claims(self):
+        async with self._pool.acquire() as conn:
+            await conn.execute(
+                """
+                UPDATE notification_queue SET status = 'pending'
+                WHERE status = 'sending' AND claimed_at < NOW() - make_interval(secs => $1)
+                """,
+                STALE_CLAIM_SECONDS
+            )
+
+    async def _release_own_claims(self):
+        """Возвращает в очередь сообщения, отправку которых прервала остановка.
+
+        Сообщение, ушедшее в Telegram прямо перед остановкой, может быть отправлено
+        повторно: доставка «хотя бы раз» лучше потерянного уведомления.
+        """
+        claimed = list(self._claimed)
+        async with self._pool.acquire() as conn:
+            await conn.execute(
+                """
+                UPDATE notification_queue SET status = 'pending', attempts = GREATEST(attempts - 1, 0)
+                WHERE id = ANY($1::bigint[]) AND status = 'sending'
+                """,
+                claimed
+            )
+        self._claimed.difference_update(claimed)
+        logger.info(f"Возвращено в очередь {len(claimed)} прерванных уведомлений")
+
+    async def process_batch(self):
+        """Забирает пачку сообщений из очереди и отправляет их"""
+        async with self._pool.acquire() as conn:
+            await conn.execute(
+                """
+                UPDATE notification_queue SET status = 'failed', error = 'expired'
+                WHERE status = 'pending' AND expires_at <= NOW()
+                """
+            )
+            rows = await conn.fetch(
+                """
+                UPDATE notification_queue
+                SET status = 'sending', attempts = attempts + 1, claimed_at = NOW()
+                WHERE id IN (
+                    SELECT id FROM notification_queue
+                    WHERE status = 'pending' AND not_before <= NOW()
+                    ORDER BY id
+                    LIMIT $1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, chat_id, kind, text, attempts
+                """,
+                self.batch_size
+            )
+        if not rows:
+            return 0
+        claimed = [row['id'] for row in rows]
+        self._claimed.update(claimed)
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send(row):
+            async with semaphore:
+                return row, await self._send_one(row)
+
+        results = await asyncio.gather(*(send(row) for row in rows))
+
+        sent, retry, failed = [], [], []
+        for row, (result, detail) in results:
+            if result == 'sent':
+                sent.append(row['id'])
+            elif result == 'retry' and row['attempts'] < FANOUT_MAX_ATTEMPTS:
+                retry.append((row['id'], float(detail)))
+            elif result == 'retry':
+                failed.append((row['id'], f"Превышено число попыток ({row['attempts']})"))
+            else:
+                failed.append((row['id'], str(detail)[:500]))
+            NOTIFICATIONS_SENT.inc(kind=row['kind'], result=result)
+
+        async with self._pool.acquire() as conn:
+            if sent:
+                await conn.execute(
+                    "UPDATE notification_queue SET status = 'sent', sent_at = NOW() WHERE id = ANY($1::bigint[])",
+                    sent
+                )
+            if retry:
+                await conn.executemany(
+                    """
+                    UPDATE notification_queue
+                    SET status = 'pending', not_before = NOW() + make_interval(secs => $2)
+                    WHERE id = $1
+                    """,
+                    retry
+                )
+            if failed:
+                await conn.executemany(
+                    "UPDATE notification_queue SET status = 'failed', error = $2 WHERE id = $1",
+                    failed
+                )
+        self._claimed.difference_update(claimed)
+        return len(rows)
+
+    async def _wait_for_chat(self, chat_id):
+        last = self._chat_last_sent.get(chat_id)
+        if last is not None:
+            delay = last + PER_CHAT_INTERVAL - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        self._chat_last_sent[chat_id] = time.monotonic()
+        if len(self._chat_last_sent) > 10000:
+            border = time.monotonic() - PER_CHAT_INTERVAL
+            self._chat_last_sent = {k: v for k, v in self._chat_last_sent.items() if v > border}
+
+    async def _send_one(self, row):
+        """Отправляет одно сообщение. Возвращает (результат, подробности)"""
+        await self._wait_for_chat(row['chat_id'])
+        await self.bucket.acquire()
+        try:
+            await self._bot.send_message(row['chat_id'], row['text'])
+            return 'sent', None
+        except TelegramRetryAfter as e:
+            logger.warning(f"Flood control, пауза рассылки на {e.retry_after} с")
+            self.bucket.pause(e.retry_after)
+            return 'retry', e.retry_after
+        except TelegramForbiddenError as e:
+            # Пользователь заблокировал бота — повторять бессмысленно
+            return 'failed', e
+        except TelegramBadRequest as e:
+            return 'failed', e
+        except Exception as e:
+            logger.error(f"Ошибка отправки уведомления {row['id']}: {e}")
+            return 'retry', min(2 ** row['attempts'], 300)
+
+
+async def cleanup_notifications(pool, keep_days=7):
+    """Удаляет старые отправленные и неудачные уведомления"""
+    async with pool.acquire() as conn:
+        status = await conn.execute(
+            """
+            DELETE FROM notification_queue
+            WHERE status IN ('sent', 'failed') AND created_at < NOW() - make_interval(days => $1)
+            """,
+            keep_days
+        )
+    logger.info(f"Очистка очереди уведомлений: {status}")
+
+
+async def queue_stats(pool):
+    """Размер очереди уведомлений по статусам"""
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("SELECT status, COUNT(*) AS cnt FROM notification_queue GROUP BY status")
+    return {row['status']: row['cnt'] for row in rows}
+
+
+# Общий движок рассылки процесса
+fanout = FanoutEngine()
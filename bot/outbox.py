@@ -0,0 +1,228 @@
+import os
+import time
+import asyncio
+import logging
+import contextvars
+from contextlib import contextmanager
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter, TelegramServerError
+
+from .tracing import current_trace, add_span
+from .metrics import Counter, Histogram, register_collector
+
+logger = logging.getLogger("outbox")
+
+# Воркеры на полосу: ответы пользователям и массовые рассылки не делят между собой потоки
+OUTBOX_INTERACTIVE_WORKERS = int(os.getenv("OUTBOX_INTERACTIVE_WORKERS", 8))
+OUTBOX_BULK_WORKERS = int(os.getenv("OUTBOX_BULK_WORKERS", 4))
+# Сколько раз повторять ответ пользователю после RetryAfter или 5xx от Telegram
+OUTBOX_MAX_RETRIES = int(os.getenv("OUTBOX_MAX_RETRIES", 3))
+# Дольше этого ждать ответа нет смысла — пользователь уже ушел, ошибка отдается обработчику
+OUTBOX_MAX_RETRY_AFTER = float(os.getenv("OUTBOX_MAX_RETRY_AFTER", 30))
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+LANES = (INTERACTIVE, BULK)
+
+_lane = contextvars.ContextVar("outbox_lane", default=None)
+
+OUTBOX_REQUESTS = Counter(
+    "outbox_requests_total", "Запросы к Bot API через очередь отправки", ("lane", "method", "status"),
+)
+OUTBOX_WAIT = Histogram(
+    "outbox_wait_seconds", "Время ожидания запроса в очереди отправки", ("lane",),
+)
+OUTBOX_SEND = Histogram(
+    "outbox_send_seconds", "Время выполнения запроса к Bot API", ("lane", "method"),
+)
+
+
+@contextmanager
+def lane(name):
+    """Явно задает полосу для запросов к Bot API внутри блока"""
+    token = _lane.set(name)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+def current_lane():
+    """Полоса по умолчанию: внутри апдейта — interactive, в фоновых задачах — bulk"""
+    explicit = _lane.get()
+    if explicit is not None:
+        return explicit
+    return INTERACTIVE if current_trace() is not None else BULK
+
+
+class _Request:
+    __slots__ = ('make_request', 'bot', 'method', 'future', 'enqueued', 'started')
+
+    def __init__(self, make_request, bot, method, future):
+        self.make_request = make_request
+        self.bot = bot
+        self.method = method
+        self.future = future
+        self.enqueued = time.perf_counter()
+        self.started = None
+
+
+class Outbox(BaseRequestMiddleware):
+    """Все запросы к Bot API проходят через очереди с приоритетами.
+
+    Ответы на апдейты идут в полосу interactive, рассылки и фоновые задачи — в bulk.
+    У каждой полосы свои воркеры; bulk берет запрос, только когда в interactive
+    нет ожидающих, а flood control из рассылки не тормозит ответы пользователям.
+    RetryAfter в bulk сразу отдается вызывающему (у рассылки своя очередь повторов в БД),
+    в interactive запрос повторяется после паузы.
+    """
+
+    def __init__(self, interactive_workers=OUTBOX_INTERACTIVE_WORKERS, bulk_workers=OUTBOX_BULK_WORKERS):
+        self.workers = {INTERACTIVE: interactive_workers, BULK: bulk_workers}
+        self._queues = {}
+        self._in_flight = {name: 0 for name in LANES}
+        self._paused_until = {name: 0.0 for name in LANES}
+        self._interactive_idle = None
+        self._tasks = []
+        self._closed = False
+
+    def _ensure_started(self):
+        if self._tasks or self._closed:
+            return
+        self._queues = {name: asyncio.Queue() for name in LANES}
+        self._interactive_idle = asyncio.Event()
+        self._interactive_idle.set()
+        # Воркеры стартуют в пустом контексте, чтобы не унаследовать трассировку первого апдейта
+        for name, count in self.workers.items():
+            for _ in range(count):
+                self._tasks.append(contextvars.Context().run(asyncio.create_task, self._worker(name)))
+
+    async def stop(self):
+        """Останавливает воркеры; следующие запросы выполняются напрямую"""
+        self._closed = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for queue in self._queues.values():
+            while not queue.empty():
+                request = queue.get_nowait()
+                if not request.future.done():
+                    request.future.set_exception(RuntimeError("Очередь отправки остановлена"))
+
+    async def __call__(self, make_request, bot, method):
+        self._ensure_started()
+        if self._closed:
+            return await make_request(bot, method)
+        name = current_lane()
+        request = _Request(make_request, bot, method, asyncio.get_running_loop().create_future())
+        self._queues[name].put_nowait(request)
+        if name == INTERACTIVE:
+            self._interactive_idle.clear()
+        try:
+            return await request.future
+        finally:
+            if request.started is not None:
+                add_span('telegram.queue', request.started - request.enqueued, request.enqueued)
+
+    async def _wait_pause(self, name):
+        while True:
+            delay = self._paused_until[name] - time.monotonic()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    def _pause(self, name, seconds):
+        lanes = LANES if name == INTERACTIVE else (BULK,)
+        until = time.monotonic() + seconds
+        for lane_name in lanes:
+            self._paused_until[lane_name] = max(self._paused_until[lane_name], until)
+
+    async def _worker(self, name):
+        queue = self._queues[name]
+        while True:
+            request = await queue.get()
+            if name == INTERACTIVE and queue.empty():
+                self._interactive_idle.set()
+            if name == BULK:
+                await self._interactive_idle.wait()
+            await self._wait_pause(name)
+            if request.future.done():
+                # Вызывающий уже отменил ожидание
+                continue
+            request.started = time.perf_counter()
+            OUTBOX_WAIT.observe(request.started - request.enqueued, lane=name)
+            self._in_flight[name] += 1
+            try:
+                result = await self._send(name, request)
+            except asyncio.CancelledError:
+                if not request.future.done():
+                    request.future.cancel()
+                raise
+            except Exception as e:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            else:
+                if not request.future.done():
+                    request.future.set_result(result)
+            finally:
+                self._in_flight[name] -= 1
+
+    async def _send(self, name, request):
+        api_method = request.method.__api_method__
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                result = await request.make_request(request.bot, request.method)
+            except TelegramRetryAfter as e:
+                OUTBOX_REQUESTS.inc(lane=name, method=api_method, status="retry_after")
+                self._pause(name, e.retry_after)
+                if name == BULK or attempt >= OUTBOX_MAX_RETRIES or e.retry_after > OUTBOX_MAX_RETRY_AFTER:
+                    raise
+                logger.warning(f"Flood control на {api_method}, повтор через {e.retry_after} с")
+                await asyncio.sleep(e.retry_after)
+            except TelegramServerError:
+                OUTBOX_REQUESTS.inc(lane=name, method=api_method, status="server_error")
+                if name == BULK or attempt >= OUTBOX_MAX_RETRIES:
+                    raise
+                await asyncio.sleep(0.5 * 2 ** attempt)
+            except Exception:
+                OUTBOX_REQUESTS.inc(lane=name, method=api_method, status="error")
+                raise
+            else:
+                OUTBOX_REQUESTS.inc(lane=name, method=api_method, status="ok")
+                OUTBOX_SEND.observe(time.perf_counter() - started, lane=name, method=api_method)
+                return result
+            attempt += 1
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            name: {
+                'queued': self._queues[name].qsize() if name in self._queues else 0,
+                'in_flight': self._in_flight[name],
+                'workers': self.workers[name],
+                'paused_for': max(0.0, self._paused_until[name] - now),
+            }
+            for name in LANES
+        }
+
+
+outbox = Outbox()
+
+
+def _outbox_metrics():
+    stats = outbox.stats()
+    return [
+        ("outbox_queue_depth", "gauge", "Запросы к Bot API, ожидающие воркера",
+         [({"lane": name}, s['queued']) for name, s in stats.items()]),
+        ("outbox_in_flight", "gauge", "Запросы к Bot API в процессе выполнения",
+         [({"lane": name}, s['in_flight']) for name, s in stats.items()]),
+        ("outbox_paused_seconds", "gauge", "Сколько еще полоса стоит на паузе после RetryAfter",
+         [({"lane": name}, s['paused_for']) for name, s in stats.items()]),
+    ]
+
+
+register_collector(_outbox_metrics)
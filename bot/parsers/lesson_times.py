@@ -120,4 +120,33 @@ def get_schedule_string(day_of_week=None):
                 "1 пара: 8:30 - 10:00\n"
                 "2 пара:\n10:20 - 11:05\n11:20 - 12:05\n"
                 "3 пара:\n12:30 - 13:15\n13:30 - 14:15\n"
-                "4 пара: 14:30 - 16:00")
\ No newline at end of file
+                "4 пара: 14:30 - 16:00")
+
+def lesson_number_at(now=None):
+    """Номер пары, которая идет в момент now, или ближайшей следующей.
+
+    Возвращает (номер, идет ли она сейчас); (None, False), если пар больше нет.
+    Классные часы понедельника не считаются парами.
+    """
+    now = now or datetime.now()
+    weekday = now.weekday()
+    if weekday == 0:
+        schedule = MONDAY_SCHEDULE
+    elif weekday == 5:
+        schedule = SATURDAY_SCHEDULE
+    elif weekday < 5:
+        schedule = WEEKDAY_SCHEDULE
+    else:
+        return None, False
+    current_time = now.time()
+    for key, times in schedule.items():
+        if "пара" not in key:
+            continue
+        number = int(key.split()[0])
+        start_time = datetime.strptime(times['start'], "%H:%M").time()
+        end_time = datetime.strptime(times['end'], "%H:%M").time()
+        if current_time < start_time:
+            return number, False
+        if current_time <= end_time:
+            return number, True
+    return None, False
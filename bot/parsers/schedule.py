@@ -1,12 +1,14 @@
 import pandas as pd
 import requests
 import re
+import html
 from io import BytesIO
 from docx import Document
 import random
 import os
 from pathlib import Path
 import threading
+import time as time_module
 import logging
 from logging import Logger
 logger = logging.getLogger("schedule")
@@ -17,8 +19,16 @@ handler.setFormatter(formatter)
 if not logger.hasHandlers():
     logger.addHandler(handler)
 
-SCHEDULE_URL = "https://www.nkptiu.ru/doc/raspisanie/raspisanie.xls"
-REPLACEMENTS_URL = "https://www.nkptiu.ru/doc/raspisanie/zameni.docx"
+from ..tracing import add_span
+from ..metrics import (
+    FETCH_SECONDS, FETCH_BYTES, PARSE_SECONDS, FETCH_ERRORS, cache_hit, cache_miss, register_collector,
+)
+
+# Источники файлов; для офлайн-прогонов их можно направить на локальный стенд (bench.standin)
+SCHEDULE_URL = os.getenv("SCHEDULE_URL", "https://www.nkptiu.ru/doc/raspisanie/raspisanie.xls")
+REPLACEMENTS_URL = os.getenv("REPLACEMENTS_URL", "https://www.nkptiu.ru/doc/raspisanie/zameni.docx")
+# Сколько ждать ответа источника, секунды
+FETCH_TIMEOUT = int(os.getenv("FETCH_TIMEOUT", 30))
 
 def load_user_agents():
     """Загружает User-Agent'ы из файлов"""
@@ -49,6 +59,10 @@ USER_AGENTS = load_user_agents()
 _schedule_cache = None
 _schedule_cache_lock = threading.Lock()
 _schedule_cache_hash = None
+# Время последнего разбора файла (для метрики возраста данных)
+_schedule_cache_time = None
+# Движки чтения расписания по умолчанию: сначала xls (xlrd), затем xlsx (openpyxl)
+SCHEDULE_ENGINES = ('xlrd', 'openpyxl')
 
 # --- Новый парсер строки расписания ---
 def split_subject_teacher(cell: str):
@@ -212,6 +226,34 @@ def format_day_schedule(group_lessons, day, replacements=None, date_str=None, la
     except Exception:
         return "❌ Ошибка при формировании расписания"
 
+def format_replacements(group, replacements_by_date):
+    """
+    Форматирует замены группы по датам: {дата: [замена, ...]}
+    """
+    text = f"🔄 Замены для группы {group}:\n\n"
+    for date, replacements in replacements_by_date.items():
+        if not isinstance(replacements, (list, tuple)):
+            continue
+        text += f"📅 {date}:\n"
+        for rep in replacements:
+            if not isinstance(rep, dict):
+                continue
+            text += f"{'_' * 7} Занятие №{html.escape(str(rep.get('lesson', '')))} {'_' * 7}\n"
+            text += f"📚 Предмет: {html.escape(str(rep.get('subject', '')))}\n"
+            if rep.get('teacher'):
+                text += f"👤 Преподаватель: {html.escape(str(rep.get('teacher', '')))}\n"
+            text += f"🚪 Кабинет: {html.escape(str(rep.get('room', '')))}\n\n"
+    return text
+
+def replacements_for_date(replacements_by_date, date):
+    """
+    Выбирает замены группы на конкретную дату (ключи в файле вида "20.10.2025 ...")
+    """
+    if not isinstance(replacements_by_date, dict):
+        return {}
+    date_str = date.strftime('%d.%m.%Y')
+    return {key: value for key, value in replacements_by_date.items() if date_str in str(key)}
+
 def get_random_headers():
     """Возвращает случайный User-Agent и базовые заголовки"""
     # Выбираем платформу с разными весами
@@ -323,45 +365,71 @@ def process_teacher_and_room(value):
     # Иначе считаем что это не преподаватель и не кабинет
     return '', ''
 
-def fetch_schedule():
-    """Получает и парсит основное расписание"""
-    global _schedule_cache, _schedule_cache_lock, _schedule_cache_hash
+def _is_group_column(col):
+    """Колонка группы: буквы+дефис+цифры (например "ИСП-21")"""
+    return (isinstance(col, str) and
+            '-' in col and
+            any(c.isalpha() for c in col) and
+            any(c.isdigit() for c in col))
+
+def _room_value(value):
+    if pd.isna(value):
+        return ''
+    # Номера кабинетов в колонке с пропусками читаются как float: 101.0 -> "101"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+def _room_columns(df):
+    """Значения колонок аудиторий по группам, {группа: [кабинет по строкам]}.
+
+    Колонка аудитории идет сразу за колонкой группы, но у нее часто нет
+    заголовка (Unnamed) или она пустая, а такие колонки парсер потом
+    удаляет. Поэтому соседа ищем по исходному заголовку и берем, только
+    если это не следующая группа и не повтор «День/Интервал».
+    """
+    columns = list(df.columns)
+    rooms = {}
+    for loc, col in enumerate(columns[:-1]):
+        neighbour = columns[loc + 1]
+        if not _is_group_column(col) or _is_group_column(neighbour):
+            continue
+        if isinstance(neighbour, str) and neighbour.startswith(('День', 'Интервал')):
+            continue
+        rooms[col] = [_room_value(value) for value in df.iloc[:, loc + 1]]
+    return rooms
+
+def parse_schedule(content, file_hash=None, engines=SCHEDULE_ENGINES):
+    """Разбирает файл расписания в {группа: {день: {неделя: [пары]}}}.
+
+    engines — движки pandas.read_excel в порядке попыток: настоящий файл
+    колледжа в формате xls читает xlrd, xlsx — openpyxl.
+    """
     try:
-        with _schedule_cache_lock:
-            headers = get_random_headers()
-            resp = requests.get(SCHEDULE_URL, headers=headers, timeout=30)
-            resp.raise_for_status()
-            if resp.status_code != 200 or len(resp.content) < 1000:
-                logger.error(f"[fetch_schedule] Ошибка при получении файла расписания: статус={resp.status_code}, длина={len(resp.content)}")
-                return {}
-            file_hash = hash(resp.content)
-            # Если кэш есть и хэш совпадает — возвращаем кэш
-            if _schedule_cache is not None and _schedule_cache_hash == file_hash:
-                logger.info(f"[fetch_schedule] Кэш расписания актуален (hash={file_hash}), возврат без парсинга")
-                return _schedule_cache.copy() if isinstance(_schedule_cache, dict) else {}
-            # Если файл обновился — парсим и обновляем кэш
-            logger.info(f"[fetch_schedule] Файл расписания обновился или кэш пуст (hash={file_hash}), парсим и обновляем кэш")
-            xls = BytesIO(resp.content)
+        xls = BytesIO(content)
         try:
-            try:
-                # Читаем только нужные колонки и фильтруем Unnamed
-                df = pd.read_excel(xls, engine='xlrd', na_values=[''])
-                # Удаляем ненужные колонки
-                df = df.loc[:, ~df.columns.str.contains(r'^Unnamed:|^День\.|^Интервал\.')].copy()
-            except Exception as e1:
+            errors = []
+            for engine in engines:
                 xls.seek(0)
                 try:
-                    df = pd.read_excel(xls, engine='openpyxl', na_values=[''])
+                    # Читаем только нужные колонки и фильтруем Unnamed
+                    df = pd.read_excel(xls, engine=engine, na_values=[''])
+                    # Аудитории — до удаления колонок, пока соседство с группой не нарушено
+                    room_columns = _room_columns(df)
+                    # Удаляем ненужные колонки
                     df = df.loc[:, ~df.columns.str.contains(r'^Unnamed:|^День\.|^Интервал\.')].copy()
-                except Exception as e2:
-                    logger.error(f"[fetch_schedule] Ошибка чтения xls: xlrd={e1}, openpyxl={e2}")
-                    return {}
+                    break
+                except Exception as e:
+                    errors.append(f"{engine}={e}")
+            else:
+                logger.error(f"[parse_schedule] Ошибка чтения xls: {', '.join(errors)}")
+                return {}
             if df.empty or len(df.columns) < 3:
-                logger.error(f"[fetch_schedule] DataFrame пустой или мало колонок: shape={df.shape}, columns={df.columns}")
+                logger.error(f"[parse_schedule] DataFrame пустой или мало колонок: shape={df.shape}, columns={df.columns}")
                 return {}
-            logger.info(f"[fetch_schedule] DataFrame загружен: shape={df.shape}, columns={list(df.columns)}")
+            logger.info(f"[parse_schedule] DataFrame загружен: shape={df.shape}, columns={list(df.columns)}")
         except Exception as e:
-            logger.error(f"[fetch_schedule] Ошибка при обработке DataFrame: {e}")
+            logger.error(f"[parse_schedule] Ошибка при обработке DataFrame: {e}")
             return {}
         practice_rows = df[df.iloc[:, 0] == "ПРАКТИКИ"].index
         practice_data = {}
@@ -404,11 +472,7 @@ def fetch_schedule():
         schedule_data = {}
         
         # Определяем колонки групп по шаблону: буквы+дефис+цифры (например "ИСП-21")
-        group_cols = [col for col in df.columns 
-                     if isinstance(col, str) and 
-                     '-' in col and 
-                     any(c.isalpha() for c in col) and 
-                     any(c.isdigit() for c in col)]
+        group_cols = [col for col in df.columns if _is_group_column(col)]
         
         # if not group_cols:
         #     return {}
@@ -434,7 +498,7 @@ def fetch_schedule():
                 continue  # Пропускаем группу при ошибке
             #
             day_col = df.columns[0]
-            cabinet_col = df.columns[df.columns.get_loc(group_col) + 1]
+            cabinets = room_columns.get(group_col) or [''] * len(df)
             current_day = None
             lesson_counter = 0
             week_lessons = {1: [], 2: []}
@@ -455,7 +519,7 @@ def fetch_schedule():
                     lesson_counter = 0
                 time = str(row.get('Интервал', '')).strip()
                 cell_value = str(row.get(group_col, '')).strip()
-                cabinet_value = str(row.get(cabinet_col, '')).strip()
+                cabinet_value = cabinets[i]
                 # Пропуск пустых строк
                 if not time or cell_value.lower() == 'nan':
                     i += 1
@@ -476,7 +540,7 @@ def fetch_schedule():
                 while i < len(df):
                     row = df.iloc[i]
                     pair_value = str(row.get(group_col, '')).strip()
-                    pair_cabinet = str(row.get(cabinet_col, '')).strip()
+                    pair_cabinet = cabinets[i]
                     pair_time = str(row.get('Интервал', '')).strip()
                     if not pair_time or pair_value.lower() == 'nan':
                         i += 1
@@ -488,10 +552,12 @@ def fetch_schedule():
                     day_times.append(pair_time)
                     i += 1
 
-                # Проверяем, есть ли разделитель '-----' в этом дне
+                # Проверяем, есть ли разделитель '-----' в этом дне. Сбор блока выше
+                # останавливается на строке разделителя, поэтому она тоже проверяется:
+                # иначе i не сдвигается и цикл по строкам не завершается
                 has_split = False
                 split_index = None
-                for idx in range(start_i, i):
+                for idx in range(start_i, min(i + 1, len(df))):
                     row = df.iloc[idx]
                     if str(row.get(group_col, '')).strip() == "-----":
                         has_split = True
@@ -567,29 +633,79 @@ def fetch_schedule():
                     schedule_data[group_col][current_day] = {1: [], 2: []}
                 schedule_data[group_col][current_day][1].extend(week_lessons[1])
                 schedule_data[group_col][current_day][2].extend(week_lessons[2])
-        _schedule_cache = schedule_data
-        _schedule_cache_hash = file_hash
         return schedule_data
     except Exception:
         return {}
 
-def fetch_replacements():
-    """Получает и парсит замены в расписании"""
+def fetch_schedule():
+    """Получает и парсит основное расписание"""
+    global _schedule_cache, _schedule_cache_lock, _schedule_cache_hash, _schedule_cache_time
     try:
-        try:
+        with _schedule_cache_lock:
             headers = get_random_headers()
-            resp = requests.get(REPLACEMENTS_URL, headers=headers)
-            resp.raise_for_status()
-        except requests.exceptions.RequestException as e:
-            print(f"Ошибка при получении файла замен: {e}")
+            fetch_started = time_module.perf_counter()
+            try:
+                resp = requests.get(SCHEDULE_URL, headers=headers, timeout=FETCH_TIMEOUT)
+                resp.raise_for_status()
+            except Exception:
+                FETCH_ERRORS.inc(source="xls")
+                raise
+            FETCH_SECONDS.observe(time_module.perf_counter() - fetch_started, source="xls")
+            add_span('schedule.fetch', time_module.perf_counter() - fetch_started, fetch_started)
+            FETCH_BYTES.observe(len(resp.content), source="xls")
+            if resp.status_code != 200 or len(resp.content) < 1000:
+                logger.error(f"[fetch_schedule] Ошибка при получении файла расписания: статус={resp.status_code}, длина={len(resp.content)}")
+                FETCH_ERRORS.inc(source="xls")
+                return {}
+            file_hash = hash(resp.content)
+            # Если кэш есть и хэш совпадает — возвращаем кэш
+            if _schedule_cache is not None and _schedule_cache_hash == file_hash:
+                cache_hit("schedule_parse")
+                logger.info(f"[fetch_schedule] Кэш расписания актуален (hash={file_hash}), возврат без парсинга")
+                return _schedule_cache.copy() if isinstance(_schedule_cache, dict) else {}
+            # Если файл обновился — парсим и обновляем кэш
+            cache_miss("schedule_parse")
+            logger.info(f"[fetch_schedule] Файл расписания обновился или кэш пуст (hash={file_hash}), парсим и обновляем кэш")
+            content = resp.content
+        parse_started = time_module.perf_counter()
+        schedule_data = parse_schedule(content, file_hash)
+        if not schedule_data:
             return {}
+        _schedule_cache = schedule_data
+        _schedule_cache_hash = file_hash
+        _schedule_cache_time = time_module.time()
+        PARSE_SECONDS.observe(time_module.perf_counter() - parse_started, source="xls")
+        add_span('schedule.parse', time_module.perf_counter() - parse_started, parse_started)
+        return schedule_data
+    except Exception:
+        return {}
 
-        if not resp.content:
+def get_schedule_cache_age():
+    """Сколько секунд назад было разобрано расписание (None, если еще не разбиралось)"""
+    if _schedule_cache_time is None:
+        return None
+    return time_module.time() - _schedule_cache_time
+
+def _schedule_metrics():
+    age = get_schedule_cache_age()
+    groups = len(_schedule_cache) if isinstance(_schedule_cache, dict) else 0
+    return [
+        ("schedule_snapshot_age_seconds", "gauge", "Возраст разобранного расписания",
+         [({}, age)] if age is not None else []),
+        ("schedule_snapshot_groups", "gauge", "Число групп в разобранном расписании", [({}, groups)]),
+    ]
+
+register_collector(_schedule_metrics)
+
+def parse_replacements(content):
+    """Разбирает файл замен (docx) в {группа: {дата: [замены]}}"""
+    try:
+        if not content:
             print("Получен пустой файл замен")
             return {}
             
         try:
-            doc = Document(BytesIO(resp.content))
+            doc = Document(BytesIO(content))
         except Exception as e:
             logging.error(f"Ошибка при открытии файла Word с заменами: {e}")
             return {}
@@ -718,6 +834,30 @@ def fetch_replacements():
         else:
             logging.info(f"Найдены замены для групп: {list(replacements_data.keys())}")
         return replacements_data
+    except Exception as e:
+        print(f"Ошибка при разборе замен: {e}")
+        return {}
+
+def fetch_replacements():
+    """Получает и парсит замены в расписании"""
+    try:
+        try:
+            headers = get_random_headers()
+            fetch_started = time_module.perf_counter()
+            resp = requests.get(REPLACEMENTS_URL, headers=headers, timeout=FETCH_TIMEOUT)
+            resp.raise_for_status()
+            FETCH_SECONDS.observe(time_module.perf_counter() - fetch_started, source="docx")
+            add_span('replacements.fetch', time_module.perf_counter() - fetch_started, fetch_started)
+            FETCH_BYTES.observe(len(resp.content), source="docx")
+        except requests.exceptions.RequestException as e:
+            FETCH_ERRORS.inc(source="docx")
+            print(f"Ошибка при получении файла замен: {e}")
+            return {}
+        parse_started = time_module.perf_counter()
+        replacements_data = parse_replacements(resp.content)
+        PARSE_SECONDS.observe(time_module.perf_counter() - parse_started, source="docx")
+        add_span('replacements.parse', time_module.perf_counter() - parse_started, parse_started)
+        return replacements_data
     except Exception as e:
         print(f"Ошибка при получении замен: {e}")
         return {}
@@ -0,0 +1,198 @@
+import os
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+import asyncpg
+
+from .querystats import make_init
+from .tracing import add_span
+
+logger = logging.getLogger("pools")
+
+# Настройки пулов по умолчанию. Любой параметр можно переопределить через
+# переменные окружения вида DB_<ИМЯ>_<ПАРАМЕТР>, например DB_INTERACTIVE_MAX_SIZE=30
+POOL_DEFAULTS = {
+    # Обработчики апдейтов: короткие запросы, быстрый отказ при перегрузке
+    'interactive': {
+        'min_size': 5,
+        'max_size': 20,
+        'acquire_timeout': 5,
+        'command_timeout': 10,
+        'statement_timeout': 5000,
+    },
+    # Фоновые задачи (обновление расписания): длинные транзакции
+    'background': {
+        'min_size': 1,
+        'max_size': 4,
+        'acquire_timeout': 60,
+        'command_timeout': 300,
+        'statement_timeout': 0,
+    },
+    # Админская статистика: тяжелые агрегаты, только чтение
+    'admin': {
+        'min_size': 1,
+        'max_size': 3,
+        'acquire_timeout': 10,
+        'command_timeout': 60,
+        'statement_timeout': 30000,
+        'read_only': True,
+    },
+}
+
+
+def _pool_config(name):
+    """Собирает настройки пула с учетом переменных окружения"""
+    config = dict(POOL_DEFAULTS[name])
+    prefix = f"DB_{name.upper()}_"
+    for key in ('min_size', 'max_size', 'statement_timeout'):
+        value = os.getenv(prefix + key.upper())
+        if value and value.isdigit():
+            config[key] = int(value)
+    for key in ('acquire_timeout', 'command_timeout'):
+        value = os.getenv(prefix + key.upper())
+        if value:
+            try:
+                config[key] = float(value)
+            except ValueError:
+                logger.warning(f"Некорректное значение {prefix + key.upper()}={value}")
+    config['dsn'] = os.getenv(prefix + "DSN")
+    return config
+
+
+class NamedPool:
+    """Обертка над asyncpg.Pool, которая считает ожидание и выдачу соединений"""
+
+    def __init__(self, name, pool, acquire_timeout=None, statement_timeout=0):
+        self.name = name
+        self.pool = pool
+        self.acquire_timeout = acquire_timeout
+        self.statement_timeout = statement_timeout
+        self.acquired = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @asynccontextmanager
+    async def acquire(self, timeout=None):
+        started = time.monotonic()
+        try:
+            conn = await self.pool.acquire(timeout=timeout or self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.warning(f"[{self.name}] Таймаут ожидания соединения ({time.monotonic() - started:.2f} с)")
+            raise
+        waited = time.monotonic() - started
+        add_span('db.acquire', waited)
+        self.acquired += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        try:
+            yield conn
+        finally:
+            await self.pool.release(conn)
+
+    def stats(self):
+        """Возвращает текущие метрики пула"""
+        size = self.pool.get_size()
+        idle = self.pool.get_idle_size()
+        return {
+            'name': self.name,
+            'size': size,
+            'idle': idle,
+            'in_use': size - idle,
+            'min_size': self.pool.get_min_size(),
+            'max_size': self.pool.get_max_size(),
+            'acquired': self.acquired,
+            'timeouts': self.timeouts,
+            'wait_avg_ms': (self.wait_total / self.acquired * 1000) if self.acquired else 0.0,
+            'wait_max_ms': self.wait_max * 1000,
+        }
+
+    async def close(self):
+        await self.pool.close()
+
+    def __getattr__(self, item):
+        # fetch/execute/get_size и прочее пробрасываем в исходный пул
+        return getattr(self.pool, item)
+
+
+async def create_named_pool(name, dsn, replica_dsn=None):
+    """Создает именованный пул по настройкам из POOL_DEFAULTS и окружения"""
+    config = _pool_config(name)
+    pool_dsn = config['dsn'] or (replica_dsn if config.get('read_only') and replica_dsn else dsn)
+    server_settings = {'application_name': f"raspisanie-bot:{name}"}
+    if config['statement_timeout']:
+        server_settings['statement_timeout'] = str(config['statement_timeout'])
+    pool = await asyncpg.create_pool(
+        dsn=pool_dsn,
+        min_size=config['min_size'],
+        max_size=config['max_size'],
+        command_timeout=config['command_timeout'],
+        max_queries=50000,
+        server_settings=server_settings,
+        init=make_init(name),
+    )
+    logger.info(
+        f"Пул {name} создан: min={config['min_size']}, max={config['max_size']}, "
+        f"statement_timeout={config['statement_timeout']} мс, replica={bool(replica_dsn) and pool_dsn == replica_dsn}"
+    )
+    return NamedPool(name, pool, config['acquire_timeout'], config['statement_timeout'])
+
+
+async def create_pools(dsn, replica_dsn=None):
+    """Создает все именованные пулы: interactive, background, admin"""
+    pools = {}
+    try:
+        for name in POOL_DEFAULTS:
+            pools[name] = await create_named_pool(name, dsn, replica_dsn)
+    except Exception:
+        await close_pools(pools)
+        raise
+    return pools
+
+
+async def close_pools(pools):
+    """Закрывает все пулы"""
+    for name, pool in pools.items():
+        try:
+            await pool.close()
+            logger.info(f"Пул {name} закрыт")
+        except Exception as e:
+            logger.error(f"Ошибка при закрытии пула {name}: {e}")
+
+
+def pools_stats(pools):
+    """Метрики всех пулов"""
+    return [pool.stats() for pool in pools.values()]
+
+
+def pools_metrics(pools):
+    """Метрики пулов в формате коллектора bot.metrics"""
+    stats = pools_stats(pools)
+    return [
+        ("db_pool_connections", "gauge", "Соединения пула по состоянию",
+         [({"pool": s['name'], "state": "in_use"}, s['in_use']) for s in stats]
+         + [({"pool": s['name'], "state": "idle"}, s['idle']) for s in stats]),
+        ("db_pool_max_size", "gauge", "Максимальный размер пула",
+         [({"pool": s['name']}, s['max_size']) for s in stats]),
+        ("db_pool_acquired_total", "counter", "Выдано соединений",
+         [({"pool": s['name']}, s['acquired']) for s in stats]),
+        ("db_pool_acquire_timeouts_total", "counter", "Таймауты ожидания соединения",
+         [({"pool": s['name']}, s['timeouts']) for s in stats]),
+        ("db_pool_acquire_wait_seconds_total", "counter", "Суммарное ожидание соединения",
+         [({"pool": s['name']}, s['wait_avg_ms'] * s['acquired'] / 1000) for s in stats]),
+    ]
+
+
+def format_pools_stats(pools):
+    """Текст с метриками пулов для админов"""
+    lines = ["<b>🗄 Пулы соединений:</b>"]
+    for s in pools_stats(pools):
+        lines.append(
+            f"<b>{s['name']}</b>: {s['in_use']}/{s['size']} занято (max {s['max_size']}), "
+            f"выдано {s['acquired']}, таймаутов {s['timeouts']}, "
+            f"ожидание avg {s['wait_avg_ms']:.1f} мс / max {s['wait_max_ms']:.1f} мс"
+        )
+    return '\n'.join(lines)
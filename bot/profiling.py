@@ -0,0 +1,354 @@
+import os
+import sys
+import time
+import html
+import pstats
+import asyncio
+import cProfile
+import logging
+import threading
+import traceback
+import tracemalloc
+from io import StringIO
+from collections import Counter as TallyCounter, deque
+
+from .metrics import Counter, Histogram, register_collector
+
+logger = logging.getLogger("profiling")
+
+# Дольше профилировать по запросу нельзя: cProfile заметно замедляет обработку
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", 120))
+# Период сэмплирующего профилировщика, секунды
+SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", 0.005))
+# Как часто проверять отзывчивость event loop и с какой задержки считать его заблокированным, секунды
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", 0.1))
+LOOP_STALL_THRESHOLD = float(os.getenv("LOOP_STALL_THRESHOLD", 0.25))
+# Сколько последних блокировок loop хранить со стеками
+LOOP_STALLS_KEEP = int(os.getenv("LOOP_STALLS_KEEP", 20))
+# Глубина стека, которую запоминает tracemalloc
+TRACEMALLOC_FRAMES = int(os.getenv("TRACEMALLOC_FRAMES", 10))
+
+LOOP_LAG = Histogram(
+    "event_loop_lag_seconds", "Время от постановки колбэка в event loop до его выполнения",
+)
+LOOP_STALLS = Counter(
+    "event_loop_stalls_total", "Блокировки event loop дольше LOOP_STALL_THRESHOLD",
+)
+
+# Одновременно идет не больше одного профилирования
+_profile_lock = asyncio.Lock()
+
+
+class ProfilingBusy(Exception):
+    pass
+
+
+def _clamp_seconds(seconds):
+    return max(1.0, min(float(seconds), PROFILE_MAX_SECONDS))
+
+
+async def profile_cpu(seconds=10, limit=40, sort='cumulative'):
+    """cProfile потока event loop на seconds секунд; текст pstats.
+
+    Видно все, что выполняется в loop, в том числе синхронные вызовы
+    внутри корутин. Код в пуле потоков (run_in_executor) сюда не попадает —
+    для него есть sample_stacks.
+    """
+    if _profile_lock.locked():
+        raise ProfilingBusy("Профилирование уже идет")
+    seconds = _clamp_seconds(seconds)
+    async with _profile_lock:
+        profiler = cProfile.Profile()
+        logger.warning(f"cProfile включен на {seconds:.0f} с")
+        profiler.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+    out = StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return f"cProfile за {seconds:.0f} с, сортировка {sort}\n{out.getvalue()}"
+
+
+def _collect_samples(seconds, interval, skip_thread):
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    stacks = TallyCounter()
+    samples = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == skip_thread:
+                continue
+            entries = traceback.extract_stack(frame)
+            if not entries:
+                continue
+            # Свернутый стек в формате flamegraph.pl: поток;внешний;...;внутренний
+            name = names.get(thread_id) or str(thread_id)
+            stacks[";".join([name] + [f"{e.name} ({os.path.basename(e.filename)}:{e.lineno})" for e in entries])] += 1
+        samples += 1
+        time.sleep(interval)
+    return samples, stacks
+
+
+async def sample_stacks(seconds=10, interval=SAMPLE_INTERVAL, limit=40):
+    """Сэмплирующий профилировщик всех потоков процесса.
+
+    Накладные расходы малы, поэтому его можно включать под нагрузкой.
+    Возвращает число замеров и самые частые свернутые стеки, пригодные
+    для flamegraph.pl; блокирующий requests.get виден как стек, который
+    долго не меняется в потоке MainThread или в пуле.
+    """
+    if _profile_lock.locked():
+        raise ProfilingBusy("Профилирование уже идет")
+    seconds = _clamp_seconds(seconds)
+    async with _profile_lock:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def target():
+            try:
+                result = _collect_samples(seconds, interval, threading.get_ident())
+            except Exception as e:
+                loop.call_soon_threadsafe(future.set_exception, e)
+            else:
+                loop.call_soon_threadsafe(future.set_result, result)
+
+        # Отдельный поток, а не пул: пул может быть занят тем самым блокирующим кодом
+        threading.Thread(target=target, name="stack-sampler", daemon=True).start()
+        samples, stacks = await future
+    return {
+        'seconds': seconds,
+        'interval': interval,
+        'samples': samples,
+        'stacks': [{'stack': stack, 'count': count} for stack, count in stacks.most_common(limit)],
+    }
+
+
+def format_samples(result):
+    lines = [f"Сэмплирование {result['seconds']:.0f} с, {result['samples']} замеров по {result['interval'] * 1000:.0f} мс"]
+    for entry in result['stacks']:
+        share = entry['count'] / result['samples'] if result['samples'] else 0
+        lines.append(f"{share:6.1%} {entry['count']:>6} {entry['stack']}")
+    return '\n'.join(lines)
+
+
+# ---- Память ----
+
+_memory_baseline = None
+
+
+def _deep_size(obj, limit=200_000):
+    """Приблизительный размер объекта с содержимым; обход ограничен limit объектами"""
+    seen = set()
+    stack = [obj]
+    size = 0
+    while stack and len(seen) < limit:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset, deque)):
+            stack.extend(item)
+    return size
+
+
+def cache_sizes():
+    """Число записей и примерный объем процессных кэшей"""
+    from . import db, ics, inline
+    from .fsm import fsm_storage
+    from .parsers import schedule as schedule_parser
+    caches = {
+        'db.schedule': db._schedule_cache,
+        'parser.schedule': schedule_parser._schedule_cache or {},
+        'inline.results': inline._results_cache,
+        'fsm': fsm_storage._cache,
+        'ics.feeds': ics._feeds,
+    }
+    return {name: {'entries': len(cache), 'bytes': _deep_size(cache)} for name, cache in caches.items()}
+
+
+def _snapshot():
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ))
+
+
+def memory_start(frames=TRACEMALLOC_FRAMES):
+    """Включает tracemalloc и запоминает исходный снимок"""
+    global _memory_baseline
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+        logger.warning(f"tracemalloc включен, глубина {frames}")
+    _memory_baseline = _snapshot()
+
+
+def memory_stop():
+    global _memory_baseline
+    _memory_baseline = None
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+        logger.warning("tracemalloc выключен")
+
+
+def memory_diff(limit=15, group_by='lineno'):
+    """Прирост памяти по местам выделения с прошлого снимка; новый снимок становится базой.
+
+    Если tracemalloc еще не включен, включает его и возвращает None:
+    разница появится при следующем вызове.
+    """
+    global _memory_baseline
+    if not tracemalloc.is_tracing() or _memory_baseline is None:
+        memory_start()
+        return None
+    current = _snapshot()
+    diff = current.compare_to(_memory_baseline, group_by)
+    _memory_baseline = current
+    traced, peak = tracemalloc.get_traced_memory()
+    return {
+        'traced_bytes': traced,
+        'peak_bytes': peak,
+        'top': [
+            {
+                'where': str(stat.traceback[0]) if stat.traceback else "?",
+                'size_diff': stat.size_diff,
+                'size': stat.size,
+                'count_diff': stat.count_diff,
+                'traceback': stat.traceback.format()[-6:],
+            }
+            for stat in diff[:limit]
+        ],
+        'caches': cache_sizes(),
+    }
+
+
+def format_memory_diff(result):
+    if result is None:
+        return "🧠 tracemalloc включен, снимок памяти сохранен. Повторите /memory, чтобы увидеть прирост."
+    lines = [
+        f"<b>🧠 Память:</b> отслеживается {result['traced_bytes'] / 1048576:.1f} МБ, "
+        f"пик {result['peak_bytes'] / 1048576:.1f} МБ",
+        "",
+        "<b>Прирост с прошлого снимка:</b>",
+    ]
+    for stat in result['top']:
+        lines.append(
+            f"{stat['size_diff'] / 1024:+.1f} КБ ({stat['count_diff']:+d}) "
+            f"<code>{html.escape(stat['where'])}</code>"
+        )
+    lines += ["", "<b>Кэши:</b>"]
+    for name, cache in result['caches'].items():
+        lines.append(f"{name}: {cache['entries']} записей, ~{cache['bytes'] / 1024:.0f} КБ")
+    return '\n'.join(lines)
+
+
+# ---- Задержка event loop ----
+
+class LoopMonitor:
+    """Следит за отзывчивостью event loop.
+
+    Поток-сторож каждые LOOP_LAG_INTERVAL ставит в loop пустой колбэк и
+    меряет, через сколько тот выполнится. Если ответа нет дольше
+    LOOP_STALL_THRESHOLD, сторож снимает стек потока loop прямо во время
+    блокировки — так видно, какой синхронный вызов ее устроил.
+    """
+
+    def __init__(self, interval=LOOP_LAG_INTERVAL, threshold=LOOP_STALL_THRESHOLD, keep=LOOP_STALLS_KEEP):
+        self.interval = interval
+        self.threshold = threshold
+        self.stalls = deque(maxlen=keep)
+        self.max_lag = 0.0
+        self.last_lag = 0.0
+        self._loop = None
+        self._thread_id = None
+        self._watchdog = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        if self._watchdog and self._watchdog.is_alive():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._thread_id = threading.get_ident()
+        self._stopping.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stopping.set()
+
+    def _pong(self, sent, answered):
+        lag = time.perf_counter() - sent
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        LOOP_LAG.observe(lag)
+        answered.set()
+
+    def _watch(self):
+        while not self._stopping.wait(self.interval):
+            sent = time.perf_counter()
+            answered = threading.Event()
+            try:
+                self._loop.call_soon_threadsafe(self._pong, sent, answered)
+            except RuntimeError:
+                # loop закрыт
+                return
+            if answered.wait(self.threshold):
+                continue
+            frame = sys._current_frames().get(self._thread_id)
+            stack = ''.join(traceback.format_stack(frame)) if frame else ""
+            stall = {'at': time.time(), 'lag': time.perf_counter() - sent, 'stack': stack}
+            self.stalls.append(stall)
+            LOOP_STALLS.inc()
+            logger.warning(f"Event loop не отвечает {stall['lag'] * 1000:.0f} мс:\n{stack}")
+            # Дожидаемся конца блокировки, чтобы записать ее полную длительность
+            while not answered.wait(self.interval):
+                if self._stopping.is_set():
+                    return
+            stall['lag'] = self.last_lag
+
+    def reset(self):
+        self.stalls.clear()
+        self.max_lag = 0.0
+
+    def stats(self):
+        return {
+            'interval': self.interval,
+            'threshold': self.threshold,
+            'last_lag': self.last_lag,
+            'max_lag': self.max_lag,
+            'stalls': list(self.stalls),
+        }
+
+
+def format_loop_stats(stats, stacks=3):
+    lines = [
+        f"<b>⏱ Event loop:</b> задержка сейчас {stats['last_lag'] * 1000:.1f} мс, "
+        f"максимум {stats['max_lag'] * 1000:.1f} мс",
+        f"Блокировок дольше {stats['threshold'] * 1000:.0f} мс: {len(stats['stalls'])}",
+    ]
+    for stall in stats['stalls'][-stacks:][::-1]:
+        at = time.strftime('%d.%m %H:%M:%S', time.localtime(stall['at']))
+        # В сообщение влезает только хвост стека — место, где loop стоял
+        tail = '\n'.join(stall['stack'].strip().splitlines()[-8:])
+        lines += ["", f"<b>{stall['lag'] * 1000:.0f} мс</b> | {at}", f"<pre>{html.escape(tail)}</pre>"]
+    return '\n'.join(lines)
+
+
+loop_monitor = LoopMonitor()
+
+
+def _profiling_metrics():
+    traced = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+    return [
+        ("event_loop_max_lag_seconds", "gauge", "Максимальная задержка event loop с запуска", [({}, loop_monitor.max_lag)]),
+        ("tracemalloc_traced_bytes", "gauge", "Память, отслеживаемая tracemalloc", [({}, traced)]),
+    ]
+
+
+register_collector(_profiling_metrics)
@@ -0,0 +1,144 @@
+import os
+import re
+import html
+import logging
+from collections import deque
+
+from .tracing import add_span
+
+logger = logging.getLogger("queries")
+
+# Запросы дольше порога пишутся в лог (параметры скрываются)
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 200))
+# Сколько последних замеров хранить на запрос для перцентилей
+SAMPLES_PER_QUERY = 1024
+# Ограничение на число разных запросов, чтобы реестр не рос бесконечно
+MAX_STATEMENTS = 500
+
+_number_re = re.compile(r"(?<![$\w])\d+(\.\d+)?\b")
+_string_re = re.compile(r"'(?:[^']|'')*'")
+_space_re = re.compile(r"\s+")
+
+# {нормализованный запрос: QueryStat}
+_stats = {}
+
+
+def normalize_query(query):
+    """Приводит запрос к общему виду: без литералов и лишних пробелов"""
+    query = _string_re.sub("?", query)
+    query = _number_re.sub("?", query)
+    return _space_re.sub(" ", query).strip()[:300]
+
+
+def redact_args(args):
+    """Заменяет значения параметров на их типы"""
+    redacted = []
+    for arg in args or ():
+        if isinstance(arg, (list, tuple)):
+            redacted.append(f"<{type(arg).__name__}[{len(arg)}]>")
+        elif isinstance(arg, str):
+            redacted.append(f"<str:{len(arg)}>")
+        else:
+            redacted.append(f"<{type(arg).__name__}>")
+    return redacted
+
+
+def percentile(samples, q):
+    """Перцентиль по отсортированному списку замеров"""
+    if not samples:
+        return 0.0
+    idx = min(len(samples) - 1, max(0, int(round(q * (len(samples) - 1)))))
+    return samples[idx]
+
+
+class QueryStat:
+    __slots__ = ('query', 'count', 'errors', 'total', 'max', 'samples')
+
+    def __init__(self, query):
+        self.query = query
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=SAMPLES_PER_QUERY)
+
+    def add(self, elapsed, failed=False):
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        self.samples.append(elapsed)
+        if failed:
+            self.errors += 1
+
+    def as_dict(self):
+        samples = sorted(self.samples)
+        return {
+            'query': self.query,
+            'count': self.count,
+            'errors': self.errors,
+            'total_ms': self.total * 1000,
+            'avg_ms': self.total / self.count * 1000 if self.count else 0.0,
+            'p50_ms': percentile(samples, 0.50) * 1000,
+            'p95_ms': percentile(samples, 0.95) * 1000,
+            'p99_ms': percentile(samples, 0.99) * 1000,
+            'max_ms': self.max * 1000,
+        }
+
+
+def record_query(record, pool_name=None):
+    """Учитывает выполненный запрос (колбэк для Connection.add_query_logger)"""
+    key = normalize_query(record.query)
+    stat = _stats.get(key)
+    if stat is None:
+        if len(_stats) >= MAX_STATEMENTS:
+            key = "<other>"
+            stat = _stats.setdefault(key, QueryStat(key))
+        else:
+            stat = _stats[key] = QueryStat(key)
+    stat.add(record.elapsed, record.exception is not None)
+    add_span('db.query', record.elapsed)
+    elapsed_ms = record.elapsed * 1000
+    if elapsed_ms >= SLOW_QUERY_MS:
+        logger.warning(
+            f"[{pool_name or 'db'}] Медленный запрос {elapsed_ms:.1f} мс: {key} "
+            f"params={redact_args(record.args)}"
+        )
+
+
+def make_init(pool_name):
+    """init-хук для asyncpg.create_pool: подключает учет запросов к каждому соединению"""
+    def query_logger(record):
+        record_query(record, pool_name)
+
+    async def init(conn):
+        conn.add_query_logger(query_logger)
+    return init
+
+
+def top_queries(limit=10, order_by='total_ms'):
+    """Самые тяжелые запросы"""
+    rows = [stat.as_dict() for stat in list(_stats.values())]
+    rows.sort(key=lambda r: r[order_by], reverse=True)
+    return rows[:limit]
+
+
+def reset_query_stats():
+    _stats.clear()
+
+
+def format_query_stats(limit=10):
+    """Текст со статистикой запросов для админов"""
+    rows = top_queries(limit)
+    if not rows:
+        return "📉 Запросов к БД пока не было"
+    lines = [f"<b>🐘 Топ-{len(rows)} запросов по суммарному времени:</b>", ""]
+    for r in rows:
+        query = html.escape(r['query'][:120])
+        lines.append(f"<code>{query}</code>")
+        lines.append(
+            f"×{r['count']} | всего {r['total_ms']:.0f} мс | "
+            f"p50 {r['p50_ms']:.1f} / p95 {r['p95_ms']:.1f} / p99 {r['p99_ms']:.1f} мс"
+            + (f" | ошибок {r['errors']}" if r['errors'] else "")
+        )
+        lines.append("")
+    return '\n'.join(lines)
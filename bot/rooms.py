@@ -0,0 +1,163 @@
+import html
+from datetime import datetime, timedelta
+
+from aiogram import Router, F, types
+from aiogram.filters import Command, CommandObject
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from .edits import edit_message
+from .snapshot import get_snapshot
+from .parsers.lesson_times import lesson_number_at, LESSON_TIMES, WEEKDAY_TIMES, SATURDAY_TIMES
+
+try:
+    from zoneinfo import ZoneInfo
+    TZ_MSK = ZoneInfo("Europe/Moscow")
+except ImportError:
+    from pytz import timezone
+    TZ_MSK = timezone("Europe/Moscow")
+
+router = Router()
+
+WEEKDAYS = ['Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье']
+
+
+def _times_for(date):
+    if date.weekday() == 0:
+        return LESSON_TIMES
+    if date.weekday() == 5:
+        return SATURDAY_TIMES
+    return WEEKDAY_TIMES
+
+
+def _lesson_count(date):
+    return len([key for key in _times_for(date) if "пара" in key])
+
+
+def _now():
+    return datetime.now(TZ_MSK).replace(tzinfo=None)
+
+
+def render_free_rooms(snapshot, date, lesson_number):
+    rooms = snapshot.rooms.free_rooms(date, lesson_number)
+    time_str = _times_for(date).get(f"{lesson_number} пара", "")
+    header = f"🚪 Свободные кабинеты | {WEEKDAYS[date.weekday()]}, {lesson_number} пара"
+    if time_str:
+        header += f" ({time_str})"
+    if not rooms:
+        return header + "\n\nСвободных кабинетов нет"
+    return header + f"\n\n{html.escape(', '.join(rooms))}\n\nВсего: {len(rooms)} из {len(snapshot.rooms)}"
+
+
+def free_rooms_keyboard(date, lesson_number):
+    builder = InlineKeyboardBuilder()
+    count = _lesson_count(date)
+    for number in range(1, count + 1):
+        if number != lesson_number:
+            builder.button(text=f"{number} пара", callback_data=f"freerooms_{number}")
+    builder.adjust(count)
+    return builder.as_markup()
+
+
+def render_room(snapshot, room, date):
+    times = _times_for(date)
+    lines = [f"🚪 <b>Каб. {html.escape(room)}</b> | {date.strftime('%d.%m.%Y')}, {WEEKDAYS[date.weekday()]}", ""]
+    busy = snapshot.rooms.who_is_in(room, date, range(1, _lesson_count(date) + 1))
+    if not busy:
+        lines.append("Кабинет свободен весь день")
+    for number, occupants in sorted(busy.items()):
+        time_str = times.get(f"{number} пара", "")
+        lines.append(f"<b>{number} пара</b> {time_str}")
+        for occupant in occupants:
+            mark = " 🔄" if occupant.replacement else ""
+            teacher = f", {html.escape(occupant.teacher)}" if occupant.teacher else ""
+            lines.append(f"👥 {html.escape(occupant.group)}: {html.escape(occupant.subject)}{teacher}{mark}")
+        lines.append("")
+    return '\n'.join(lines).rstrip()
+
+
+def room_keyboard(room, day):
+    builder = InlineKeyboardBuilder()
+    if day == 'today':
+        builder.button(text="Завтра ➡️", callback_data=f"room_{room}_tomorrow")
+    else:
+        builder.button(text="⬅️ Сегодня", callback_data=f"room_{room}_today")
+    return builder.as_markup()
+
+
+@router.message(Command("free"))
+async def free_rooms(message: types.Message, command: CommandObject):
+    snapshot = get_snapshot()
+    if not snapshot.version:
+        await message.answer("⏳ Расписание еще загружается, попробуйте через минуту")
+        return
+    now = _now()
+    if now.weekday() == 6:
+        await message.answer("🎉 Сегодня выходной, все кабинеты свободны")
+        return
+    if command.args and command.args.strip().isdigit():
+        lesson_number = int(command.args.strip())
+    else:
+        lesson_number, _ = lesson_number_at(now)
+        if lesson_number is None:
+            await message.answer("✅ Пары на сегодня закончились. Укажите номер пары: <code>/free 2</code>",
+                                 parse_mode="HTML")
+            return
+    await message.answer(
+        render_free_rooms(snapshot, now, lesson_number),
+        reply_markup=free_rooms_keyboard(now, lesson_number),
+        parse_mode="HTML"
+    )
+
+
+@router.callback_query(F.data.startswith("freerooms_"))
+async def free_rooms_callback(callback: types.CallbackQuery):
+    await callback.answer()
+    lesson_number = int(callback.data.split("_", 1)[1])
+    now = _now()
+    await edit_message(
+        callback.message,
+        render_free_rooms(get_snapshot(), now, lesson_number),
+        reply_markup=free_rooms_keyboard(now, lesson_number),
+        parse_mode="HTML"
+    )
+
+
+@router.message(Command("room"))
+async def room_occupancy(message: types.Message, command: CommandObject):
+    snapshot = get_snapshot()
+    if not snapshot.version:
+        await message.answer("⏳ Расписание еще загружается, попробуйте через минуту")
+        return
+    if not command.args:
+        await message.answer("Укажите кабинет: <code>/room 305</code>", parse_mode="HTML")
+        return
+    rooms = snapshot.rooms.find(command.args)
+    if not rooms:
+        await message.answer("❌ Такого кабинета нет в расписании")
+        return
+    if len(rooms) > 1:
+        builder = InlineKeyboardBuilder()
+        for room in rooms[:20]:
+            builder.button(text=room, callback_data=f"room_{room}_today")
+        builder.adjust(4)
+        await message.answer("Найдено несколько кабинетов, выберите:", reply_markup=builder.as_markup())
+        return
+    await message.answer(
+        render_room(snapshot, rooms[0], _now()),
+        reply_markup=room_keyboard(rooms[0], 'today'),
+        parse_mode="HTML"
+    )
+
+
+@router.callback_query(F.data.startswith("room_"))
+async def room_callback(callback: types.CallbackQuery):
+    # В названии аудитории может быть «_», поэтому сначала снимаем префикс
+    room, day = callback.data[len("room_"):].rsplit("_", 1)
+    await callback.answer()
+    date = _now() + timedelta(days=1 if day == 'tomorrow' else 0)
+    await edit_message(
+        callback.message,
+        render_room(get_snapshot(), room, date),
+        reply_markup=room_keyboard(room, day),
+        parse_mode="HTML"
+    )
@@ -1,5 +1,10 @@
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from .parsers.schedule import fetch_schedule, fetch_replacements
+from .snapshot_store import refresh_and_publish
+from .notifications import notify_replacement_changes, cleanup_notifications
+from .fsm import cleanup_fsm_states
+from .digest import send_daily_digest, digest_time, TZ_MSK, DIGEST_WINDOW_MINUTES
+from .leader import leader, leader_only
+from datetime import datetime, timedelta
 import asyncio
 import logging
 
@@ -8,8 +13,17 @@ __all__ = ['setup_scheduler']
 async def update_data(pool):
     """Обновляет данные расписания и замен в БД"""
     try:
-        schedule = fetch_schedule()
-        replacements = fetch_replacements()
+        # Скачивание и разбор идут в пуле потоков, результат публикуется как новый снимок
+        # Новый снимок сохраняется в общее хранилище, ведомые реплики загружают его оттуда
+        snapshot = await refresh_and_publish()
+        schedule, replacements = snapshot.schedule, snapshot.replacements
+
+        # Рассылаем уведомления об изменившихся заменах (независимо от записи в БД ниже)
+        if replacements:
+            try:
+                await notify_replacement_changes(pool, replacements)
+            except Exception as e:
+                logging.error(f'Ошибка при рассылке уведомлений о заменах: {e}')
 
         # Миграция старых записей расписания (если есть)
         async def migrate_old_schedule(conn):
@@ -98,16 +112,61 @@ async def update_data(pool):
 def setup_scheduler(app):
     """Настраивает планировщик обновления данных"""
     scheduler = AsyncIOScheduler()
-    pool = app['db_pool']
-    
+    # Обновление держит длинную транзакцию, поэтому работает в отдельном пуле
+    pool = app['db_pools']['background']
+
+    # Задачи запускаются на всех репликах, но выполняет их только лидер;
+    # ведомые загружают новый снимок из общего хранилища по событию шины
     scheduler.add_job(
-        update_data,
+        leader_only(update_data),
         'interval',
         minutes=20,
         args=[pool],
         id='update_schedule_job',
         replace_existing=True
     )
+
+    digest_hour, digest_minute = digest_time()
+    scheduler.add_job(
+        leader_only(send_daily_digest),
+        'cron',
+        hour=digest_hour,
+        minute=digest_minute,
+        timezone=TZ_MSK,
+        args=[pool],
+        id='daily_digest_job',
+        replace_existing=True,
+        misfire_grace_time=15 * 60
+    )
+
+    scheduler.add_job(
+        leader_only(cleanup_notifications),
+        'cron',
+        hour=4,
+        args=[pool],
+        id='cleanup_notifications_job',
+        replace_existing=True
+    )
+
+    scheduler.add_job(
+        leader_only(cleanup_fsm_states),
+        'cron',
+        hour=4,
+        minute=30,
+        args=[pool],
+        id='cleanup_fsm_job',
+        replace_existing=True
+    )
     
+    def on_elected():
+        # Новый лидер сразу обновляет данные: прошлый мог упасть посреди интервала
+        now = datetime.now(TZ_MSK)
+        scheduler.modify_job('update_schedule_job', next_run_time=now)
+        # Сводка продолжается с контрольной точки, если лидер сменился во время рассылки
+        digest_start = now.replace(hour=digest_hour, minute=digest_minute, second=0, microsecond=0)
+        if digest_start <= now < digest_start + timedelta(minutes=DIGEST_WINDOW_MINUTES):
+            scheduler.modify_job('daily_digest_job', next_run_time=now)
+
+    leader.on_elected(on_elected)
     scheduler.start()
     return scheduler
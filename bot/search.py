@@ -0,0 +1,54 @@
+import html
+
+from aiogram import Router, F, types
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from .indexes import teacher_key
+from .snapshot import get_snapshot
+from .tracing import span
+
+router = Router()
+
+# Сколько результатов показывать
+SEARCH_LIMIT = 8
+
+
+def render_search(snapshot, query):
+    """Текст и клавиатура с результатами поиска"""
+    with span("search"):
+        hits = snapshot.search.search(query, limit=SEARCH_LIMIT)
+    if not hits:
+        return f"🔎 По запросу «{html.escape(query)}» ничего не найдено", None
+    lines = [f"🔎 Результаты по запросу «{html.escape(query)}»:"]
+    builder = InlineKeyboardBuilder()
+    for hit in hits:
+        if hit.kind == 'group':
+            # Поиск заменяет листание списка групп, поэтому группу можно сразу выбрать своей
+            builder.row(
+                types.InlineKeyboardButton(text=f"👥 {hit.value}", callback_data=f"schedule_{hit.value}_today"),
+                types.InlineKeyboardButton(text="✅ Моя группа", callback_data=f"group_{hit.value}"),
+            )
+        elif hit.kind == 'teacher':
+            builder.row(types.InlineKeyboardButton(
+                text=f"👤 {hit.value}", callback_data=f"teacher_{teacher_key(hit.value)}_today"
+            ))
+        else:
+            groups, teachers = snapshot.search.subject_info(hit.value)
+            line = f"📚 {html.escape(hit.value)}: {html.escape(', '.join(groups[:6]))}"
+            if len(groups) > 6:
+                line += f" и еще {len(groups) - 6}"
+            if teachers:
+                line += f" ({html.escape(', '.join(teachers[:3]))})"
+            lines.append(line)
+    return '\n'.join(lines), builder.as_markup()
+
+
+# Роутер подключается последним: сюда попадает только текст, который не обработали кнопки и команды
+@router.message(F.chat.type == "private", F.text, ~F.text.startswith("/"))
+async def free_text_search(message: types.Message):
+    snapshot = get_snapshot()
+    if not snapshot.version:
+        await message.answer("⏳ Расписание еще загружается, попробуйте через минуту")
+        return
+    text, markup = render_search(snapshot, message.text.strip()[:64])
+    await message.answer(text, reply_markup=markup, parse_mode="HTML")
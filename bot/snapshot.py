@@ -0,0 +1,155 @@
+import re
+import time
+import asyncio
+import bisect
+import hashlib
+import logging
+from datetime import datetime, timedelta
+
+from .parsers.schedule import fetch_schedule, fetch_replacements
+from .metrics import register_collector
+from .indexes import TeacherIndex, RoomIndex, SearchIndex
+from .merge import render_day
+
+try:
+    from zoneinfo import ZoneInfo
+    TZ_MSK = ZoneInfo("Europe/Moscow")
+except ImportError:
+    from pytz import timezone
+    TZ_MSK = timezone("Europe/Moscow")
+
+logger = logging.getLogger("snapshot")
+
+_group_key_re = re.compile(r"[^0-9a-zа-я]+")
+
+
+def normalize_group(name):
+    """Ключ группы для поиска: без регистра, пробелов и дефисов (Исп-221 -> исп221)"""
+    return _group_key_re.sub("", str(name).lower().replace("ё", "е"))
+
+
+class ScheduleSnapshot:
+    """Неизменяемый снимок разобранного расписания и замен.
+
+    Версия растет при каждом изменении содержимого, поэтому по ней можно
+    ключевать кэши производных данных (тексты, индексы).
+    """
+
+    __slots__ = ('version', 'schedule', 'replacements', 'built_at', 'digest', 'groups', 'teachers', 'rooms', 'search',
+                 '_group_keys', '_days')
+
+    def __init__(self, version, schedule, replacements, digest=None, built_at=None):
+        self.version = version
+        self.schedule = schedule
+        self.replacements = replacements
+        self.digest = digest
+        self.built_at = built_at or time.time()
+        self.groups = sorted(g for g, days in schedule.items() if isinstance(days, dict))
+        self._group_keys = sorted((normalize_group(g), g) for g in self.groups)
+        self.teachers = TeacherIndex(schedule, replacements)
+        self.rooms = RoomIndex(schedule, replacements)
+        self.search = SearchIndex(self.groups, self.teachers.names, schedule)
+        # {(группа, дата): (пары, текст)} — расписание с заменами на конкретные даты
+        self._days = {}
+        if self.groups:
+            today = datetime.now(TZ_MSK).date()
+            self.precompute([today, today + timedelta(days=1)])
+
+    @property
+    def last_update(self):
+        return datetime.fromtimestamp(self.built_at, TZ_MSK)
+
+    def precompute(self, dates):
+        """Заранее собирает расписание с заменами для всех групп на даты"""
+        for date in dates:
+            for group in self.groups:
+                self.day(group, date)
+
+    def day(self, group, date):
+        """(пары, текст) группы на дату: четность недели и замены уже учтены"""
+        key = (group, date.strftime('%d.%m.%Y'))
+        cached = self._days.get(key)
+        if cached is None:
+            cached = self._days[key] = render_day(
+                self.schedule, self.replacements, group, date, self.last_update
+            )
+        return cached
+
+    def find_groups(self, query, limit=None):
+        """Группы, чье название начинается с query (без учета регистра и дефисов)"""
+        key = normalize_group(query)
+        if not key:
+            return []
+        found = []
+        idx = bisect.bisect_left(self._group_keys, (key,))
+        while idx < len(self._group_keys) and self._group_keys[idx][0].startswith(key):
+            found.append(self._group_keys[idx][1])
+            if limit and len(found) >= limit:
+                break
+            idx += 1
+        return found
+
+
+_current = ScheduleSnapshot(0, {}, {})
+_refresh_lock = asyncio.Lock()
+
+
+def get_snapshot():
+    """Текущий снимок расписания (версия 0 — еще не загружен)"""
+    return _current
+
+
+def _content_digest(schedule, replacements):
+    return hashlib.sha1(repr((schedule, replacements)).encode("utf-8")).hexdigest()
+
+
+async def refresh_snapshot():
+    """Скачивает расписание и замены и публикует новый снимок, если содержимое изменилось"""
+    global _current
+    async with _refresh_lock:
+        loop = asyncio.get_running_loop()
+        schedule = await loop.run_in_executor(None, fetch_schedule)
+        replacements = await loop.run_in_executor(None, fetch_replacements)
+        previous = _current
+        # Пустой результат — это ошибка скачивания, оставляем прошлые данные
+        if not schedule:
+            logger.warning("Расписание не получено, снимок не обновлен")
+            schedule = previous.schedule
+        if not replacements:
+            replacements = previous.replacements
+        digest = _content_digest(schedule, replacements)
+        if digest == previous.digest:
+            return previous
+        # Индексы и тексты на сегодня и завтра строятся в пуле потоков
+        _current = await loop.run_in_executor(
+            None, ScheduleSnapshot, previous.version + 1, schedule, replacements, digest
+        )
+        logger.info(f"Снимок расписания v{_current.version}: {len(_current.groups)} групп")
+        return _current
+
+
+async def install_snapshot(snapshot):
+    """Делает текущим готовый снимок (например, из общего хранилища).
+
+    Версия назначается заново: кэши процесса ключуются версией, и она должна
+    расти монотонно независимо от того, на какой реплике снимок собран.
+    """
+    global _current
+    async with _refresh_lock:
+        if snapshot.digest == _current.digest:
+            return _current
+        snapshot.version = _current.version + 1
+        _current = snapshot
+        return snapshot
+
+
+def _snapshot_metrics():
+    snapshot = _current
+    return [
+        ("schedule_snapshot_version", "gauge", "Версия текущего снимка расписания", [({}, snapshot.version)]),
+        ("schedule_snapshot_teachers", "gauge", "Число преподавателей в индексе", [({}, len(snapshot.teachers))]),
+        ("schedule_snapshot_rooms", "gauge", "Число кабинетов в индексе занятости", [({}, len(snapshot.rooms))]),
+    ]
+
+
+register_collector(_snapshot_metrics)
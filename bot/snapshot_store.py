@@ -0,0 +1,234 @@
+import os
+import mmap
+import time
+import zlib
+import pickle
+import asyncio
+import logging
+
+from .snapshot import ScheduleSnapshot, get_snapshot, install_snapshot, refresh_snapshot
+from .bus import bus, SNAPSHOT_PUBLISHED
+from .metrics import Histogram, SIZE_BUCKETS
+
+logger = logging.getLogger("snapshot_store")
+
+# Сколько последних снимков хранить в базе
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", 5))
+# Файл для процессов одной машины (лаунчер WEB_WORKERS); пусто — только база
+SNAPSHOT_FILE = os.getenv("SNAPSHOT_FILE", "")
+# Заголовок файла: сигнатура и дайджест содержимого, затем блоб
+FILE_MAGIC = b"RSNP1\n"
+
+SNAPSHOTS_TABLE = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id BIGSERIAL PRIMARY KEY,
+    digest TEXT NOT NULL UNIQUE,
+    data BYTEA NOT NULL,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+"""
+
+SNAPSHOT_LOAD_SECONDS = Histogram(
+    "snapshot_store_load_seconds", "Время распаковки снимка из базы", (),
+)
+SNAPSHOT_BLOB_BYTES = Histogram(
+    "snapshot_store_blob_bytes", "Размер сериализованного снимка", (), buckets=SIZE_BUCKETS,
+)
+
+
+async def create_snapshot_tables(conn):
+    await conn.execute(SNAPSHOTS_TABLE)
+
+
+def serialize_snapshot(snapshot):
+    """Снимок целиком (данные, индексы, готовые тексты) в сжатый бинарный блоб.
+
+    Блоб читают только реплики этого же бота из своей базы, поэтому pickle
+    допустим; версия протокола фиксирована самой новой из поддерживаемых.
+    """
+    return zlib.compress(pickle.dumps(snapshot, protocol=pickle.HIGHEST_PROTOCOL), 6)
+
+
+def deserialize_snapshot(blob):
+    snapshot = pickle.loads(zlib.decompress(blob))
+    if not isinstance(snapshot, ScheduleSnapshot):
+        raise TypeError(f"Ожидался ScheduleSnapshot, получен {type(snapshot).__name__}")
+    return snapshot
+
+
+def write_snapshot_file(path, snapshot, blob):
+    """Атомарно заменяет файл снимка: читатели со старым mmap дочитывают прежний inode"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(FILE_MAGIC + snapshot.digest.encode("ascii") + b"\n")
+        f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_snapshot_file(path, known_digest=None):
+    """Снимок из файла через read-only mmap; None, если файла нет или дайджест уже известен"""
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    with f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        header_end = mapped.find(b"\n", len(FILE_MAGIC))
+        if not mapped[:len(FILE_MAGIC)] == FILE_MAGIC or header_end < 0:
+            raise ValueError(f"{path}: неизвестный формат файла снимка")
+        digest = mapped[len(FILE_MAGIC):header_end].decode("ascii")
+        if digest == known_digest:
+            return None
+        with memoryview(mapped) as view:
+            return deserialize_snapshot(view[header_end + 1:])
+
+
+class SnapshotStore:
+    """Общее хранилище снимков: лидер сохраняет, ведомые и новые реплики загружают"""
+
+    def __init__(self, keep=SNAPSHOT_KEEP, path=SNAPSHOT_FILE):
+        self.keep = keep
+        self.path = path
+        self._pool = None
+
+    def start(self, pool):
+        self._pool = pool
+
+    async def save(self, snapshot):
+        """Сохраняет снимок и удаляет старые сверх keep"""
+        if self._pool is None or not snapshot.digest:
+            return False
+        loop = asyncio.get_running_loop()
+        blob = await loop.run_in_executor(None, serialize_snapshot, snapshot)
+        SNAPSHOT_BLOB_BYTES.observe(len(blob))
+        if self.path:
+            # Сначала файл: соседние воркеры подхватят его, не обращаясь к базе
+            try:
+                await loop.run_in_executor(None, write_snapshot_file, self.path, snapshot, blob)
+            except OSError as e:
+                logger.error(f"Не удалось записать файл снимка {self.path}: {e}")
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    """
+                    INSERT INTO snapshots (digest, data) VALUES ($1, $2)
+                    ON CONFLICT (digest) DO UPDATE SET created_at = NOW()
+                    """,
+                    snapshot.digest, blob
+                )
+                await conn.execute(
+                    """
+                    DELETE FROM snapshots WHERE id NOT IN (
+                        SELECT id FROM snapshots ORDER BY created_at DESC, id DESC LIMIT $1
+                    )
+                    """,
+                    self.keep
+                )
+        logger.info(f"Снимок v{snapshot.version} сохранен: {len(blob)} байт")
+        return True
+
+    async def load_file(self):
+        """Устанавливает снимок из локального файла, если он новее текущего"""
+        if not self.path:
+            return None
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        snapshot = await loop.run_in_executor(None, read_snapshot_file, self.path, get_snapshot().digest)
+        if snapshot is None:
+            return None
+        SNAPSHOT_LOAD_SECONDS.observe(time.perf_counter() - started)
+        snapshot = await install_snapshot(snapshot)
+        logger.info(f"Снимок загружен из файла за {(time.perf_counter() - started) * 1000:.0f} мс, v{snapshot.version}")
+        return snapshot
+
+    async def load_latest(self):
+        """Устанавливает последний сохраненный снимок; None, если загружать нечего"""
+        try:
+            snapshot = await self.load_file()
+            if snapshot is not None:
+                return snapshot
+        except Exception as e:
+            logger.error(f"Не удалось прочитать файл снимка {self.path}: {e}")
+        if self._pool is None:
+            return None
+        async with self._pool.acquire() as conn:
+            row = await conn.fetchrow(
+                "SELECT digest, data FROM snapshots ORDER BY created_at DESC, id DESC LIMIT 1"
+            )
+        if row is None:
+            return None
+        if row['digest'] == get_snapshot().digest:
+            return get_snapshot()
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        snapshot = await loop.run_in_executor(None, deserialize_snapshot, row['data'])
+        SNAPSHOT_LOAD_SECONDS.observe(time.perf_counter() - started)
+        snapshot = await install_snapshot(snapshot)
+        logger.info(
+            f"Снимок загружен из базы за {(time.perf_counter() - started) * 1000:.0f} мс "
+            f"({len(row['data'])} байт), v{snapshot.version}"
+        )
+        return snapshot
+
+    async def load_or_refresh(self):
+        """Снимок из хранилища, а если его нет или он битый — скачивание и разбор"""
+        try:
+            snapshot = await self.load_latest()
+            if snapshot is not None:
+                return snapshot
+        except Exception as e:
+            logger.error(f"Не удалось загрузить снимок из базы: {e}")
+        return await refresh_snapshot()
+
+
+# Общее хранилище процесса
+snapshot_store = SnapshotStore()
+
+
+async def refresh_and_publish():
+    """Обновление на лидере: новый снимок сохраняется в базу и объявляется репликам"""
+    previous_version = get_snapshot().version
+    snapshot = await refresh_snapshot()
+    if snapshot.version != previous_version:
+        try:
+            await snapshot_store.save(snapshot)
+        except Exception as e:
+            logger.error(f"Не удалось сохранить снимок в базу: {e}")
+        await bus.publish(SNAPSHOT_PUBLISHED, digest=snapshot.digest, version=snapshot.version)
+    return snapshot
+
+
+async def _on_snapshot_published(data):
+    # Лидер опубликовал новый снимок: забираем готовый из базы вместо скачивания.
+    # Без дайджеста (после переподключения шины) сверяемся с базой безусловно
+    if data.get('digest') and data['digest'] == get_snapshot().digest:
+        return
+    await snapshot_store.load_or_refresh()
+
+
+bus.subscribe(SNAPSHOT_PUBLISHED, _on_snapshot_published)
+
+
+# Сравнение с обычным путем: python -m bot.snapshot_store
+if __name__ == "__main__":
+    from .parsers.schedule import fetch_schedule, fetch_replacements
+
+    started = time.perf_counter()
+    schedule = fetch_schedule()
+    replacements = fetch_replacements()
+    fetched = time.perf_counter()
+    snapshot = ScheduleSnapshot(1, schedule, replacements, digest="bench")
+    built = time.perf_counter()
+    blob = serialize_snapshot(snapshot)
+    serialized = time.perf_counter()
+    rounds = 20
+    for _ in range(rounds):
+        deserialize_snapshot(blob)
+    loaded = time.perf_counter()
+    raw = len(pickle.dumps(snapshot, protocol=pickle.HIGHEST_PROTOCOL))
+    print(f"Скачивание и разбор XLS/DOCX: {(fetched - started) * 1000:.0f} мс")
+    print(f"Построение индексов и текстов:  {(built - fetched) * 1000:.0f} мс")
+    print(f"Сериализация:                  {(serialized - built) * 1000:.1f} мс")
+    print(f"Загрузка из блоба:             {(loaded - serialized) * 1000 / rounds:.1f} мс")
+    print(f"Размер блоба: {len(blob)} байт (без сжатия {raw} байт), групп: {len(snapshot.groups)}")
@@ -0,0 +1,184 @@
+import html
+import logging
+from datetime import datetime, timedelta
+
+from aiogram import Router, F, types
+from aiogram.filters import Command, CommandObject
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from .activity import user_activity
+from .edits import edit_message
+from .indexes import teacher_key, week_number_for
+from .snapshot import get_snapshot
+from .parsers.lesson_times import LESSON_TIMES, WEEKDAY_TIMES, SATURDAY_TIMES
+
+try:
+    from zoneinfo import ZoneInfo
+    TZ_MSK = ZoneInfo("Europe/Moscow")
+except ImportError:
+    from pytz import timezone
+    TZ_MSK = timezone("Europe/Moscow")
+
+logger = logging.getLogger("teachers")
+
+router = Router()
+
+WEEKDAYS = ['Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье']
+NUM_EMOJI = ["1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣", "6️⃣", "7️⃣", "8️⃣"]
+# Сколько найденных преподавателей показывать кнопками
+MAX_CHOICES = 20
+
+
+def _times_for(day):
+    if day == 'Понедельник':
+        return LESSON_TIMES
+    if day == 'Суббота':
+        return SATURDAY_TIMES
+    return WEEKDAY_TIMES
+
+
+def _lesson_lines(lessons, day):
+    times = _times_for(day)
+    lines = []
+    for lesson in lessons:
+        n = lesson.lesson_number
+        num = NUM_EMOJI[n - 1] if isinstance(n, int) and 1 <= n <= len(NUM_EMOJI) else str(n or "")
+        time_str = times.get(lesson.time, lesson.time)
+        lines.append(f"{num} {html.escape(lesson.subject)} | {time_str}")
+        group = html.escape(lesson.group)
+        lines.append(f"👥 {group} ({lesson.subgroup})" if lesson.subgroup else f"👥 {group}")
+        if lesson.room and lesson.room != '—':
+            lines.append(f"🚪 Каб. {html.escape(lesson.room)}")
+        lines.append("")
+    return lines
+
+
+def render_teacher_day(snapshot, name, date):
+    """Пары и замены преподавателя на дату (воскресенье показывается как понедельник)"""
+    if date.weekday() == 6:
+        date = date + timedelta(days=1)
+    day = WEEKDAYS[date.weekday()]
+    date_str = date.strftime('%d.%m.%Y')
+    lessons = snapshot.teachers.day(name, day, week_number_for(date))
+    lines = [f"📅 {date_str} | {day}", f"👤 <b>{html.escape(name)}</b>", ""]
+    lines.extend(_lesson_lines(lessons, day) or ["Пар по расписанию нет", ""])
+    replacements = snapshot.teachers.replacements_on(name, date_str)
+    if replacements:
+        lines.append("🔄 Замены:")
+        for rep in replacements:
+            room = f", каб. {html.escape(rep.room)}" if rep.room else ""
+            lines.append(f"Занятие №{html.escape(rep.lesson)}: {html.escape(rep.subject)} — {html.escape(rep.group)}{room}")
+    return '\n'.join(lines).rstrip()
+
+
+def render_teacher_week(snapshot, name, date):
+    """Пары преподавателя на учебную неделю, в которую попадает дата"""
+    if date.weekday() == 6:
+        date = date + timedelta(days=1)
+    week = week_number_for(date)
+    lines = [f"👤 <b>{html.escape(name)}</b> | {week}-я неделя", ""]
+    for day in WEEKDAYS[:6]:
+        lessons = snapshot.teachers.day(name, day, week)
+        if not lessons:
+            continue
+        lines.append(f"📅 <b>{day}</b>")
+        lines.extend(_lesson_lines(lessons, day))
+    if len(lines) == 2:
+        lines.append("Пар на этой неделе нет")
+    return '\n'.join(lines).rstrip()
+
+
+def teacher_keyboard(name, view, is_own=False):
+    key = teacher_key(name)
+    builder = InlineKeyboardBuilder()
+    for target, label in (('today', "Сегодня"), ('tomorrow', "Завтра"), ('week', "Неделя")):
+        if target != view:
+            builder.button(text=label, callback_data=f"teacher_{key}_{target}")
+    if not is_own:
+        builder.button(text="✅ Это я", callback_data=f"teacherme_{key}")
+    builder.adjust(2)
+    return builder.as_markup()
+
+
+def render_teacher(snapshot, name, view):
+    now = datetime.now(TZ_MSK)
+    if view == 'tomorrow':
+        return render_teacher_day(snapshot, name, now + timedelta(days=1))
+    if view == 'week':
+        return render_teacher_week(snapshot, name, now)
+    return render_teacher_day(snapshot, name, now)
+
+
+async def get_own_teacher(db, user_id):
+    if not db:
+        return None
+    return await db.fetchval("SELECT teacher_name FROM users WHERE user_id = $1", user_id)
+
+
+@router.message(F.text == "Мои пары 👨‍🏫")
+@router.message(Command("teacher"))
+async def teacher_schedule(message: types.Message, command: CommandObject = None, db=None):
+    snapshot = get_snapshot()
+    if not snapshot.version:
+        await message.answer("⏳ Расписание еще загружается, попробуйте через минуту")
+        return
+    query = (command.args or '').strip() if command else ''
+    own = await get_own_teacher(db, message.from_user.id)
+    if not query:
+        if not own:
+            await message.answer("Укажите фамилию: <code>/teacher Иванов</code>", parse_mode="HTML")
+            return
+        names = [own]
+    else:
+        names = snapshot.teachers.find(query)
+    if not names:
+        await message.answer("❌ Преподаватель не найден")
+        return
+    if len(names) > 1:
+        builder = InlineKeyboardBuilder()
+        for name in names[:MAX_CHOICES]:
+            builder.button(text=name, callback_data=f"teacher_{teacher_key(name)}_today")
+        builder.adjust(2)
+        await message.answer("Найдено несколько преподавателей, выберите:", reply_markup=builder.as_markup())
+        return
+    name = names[0]
+    await message.answer(
+        render_teacher(snapshot, name, 'today'),
+        reply_markup=teacher_keyboard(name, 'today', is_own=name == own),
+        parse_mode="HTML"
+    )
+
+
+@router.callback_query(F.data.startswith("teacher_"))
+async def teacher_schedule_callback(callback: types.CallbackQuery, db=None):
+    _, key, view = callback.data.split("_", 2)
+    snapshot = get_snapshot()
+    name = snapshot.teachers.by_key(key)
+    if not name:
+        await callback.answer("Преподаватель не найден в текущем расписании", show_alert=True)
+        return
+    await callback.answer()
+    own = await get_own_teacher(db, callback.from_user.id)
+    await edit_message(
+        callback.message,
+        render_teacher(snapshot, name, view),
+        reply_markup=teacher_keyboard(name, view, is_own=name == own),
+        parse_mode="HTML"
+    )
+
+
+@router.callback_query(F.data.startswith("teacherme_"))
+async def teacher_me_callback(callback: types.CallbackQuery, db=None):
+    name = get_snapshot().teachers.by_key(callback.data.replace("teacherme_", "", 1))
+    if not name or not db:
+        await callback.answer("Не удалось сохранить выбор", show_alert=True)
+        return
+    await db.execute(
+        """
+        INSERT INTO users (user_id, username, teacher_name) VALUES ($1, $2, $3)
+        ON CONFLICT (user_id) DO UPDATE SET teacher_name = EXCLUDED.teacher_name
+        """,
+        callback.from_user.id, callback.from_user.username, name
+    )
+    user_activity.set_role(callback.from_user.id, 'teacher')
+    await callback.answer(f"✅ Сохранено: {name}. Теперь /teacher без фамилии покажет ваши пары", show_alert=True)
@@ -0,0 +1,179 @@
+import os
+import html
+import time
+import functools
+import heapq
+import itertools
+import contextvars
+from contextlib import contextmanager
+from typing import Callable, Awaitable, Any
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+# Сколько самых медленных трассировок хранить
+TRACE_SLOWEST = int(os.getenv("TRACE_SLOWEST", 50))
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+# Min-heap по длительности: в корне самая быстрая из сохраненных
+_slowest = []
+_counter = itertools.count()
+
+
+class Trace:
+    """Трассировка одного апдейта: общее время и разбивка по участкам.
+
+    Участки могут быть вложенными (например, render включает schedule.fetch),
+    поэтому их сумма не обязана совпадать с общим временем.
+    """
+
+    __slots__ = ('update_id', 'label', 'user_id', 'started_at', 'started', 'duration', 'spans')
+
+    def __init__(self, update_id, label, user_id=None):
+        self.update_id = update_id
+        self.label = label
+        self.user_id = user_id
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+        # [(участок, смещение от начала, длительность), ...]
+        self.spans = []
+
+    def add(self, name, seconds, started=None):
+        offset = (started if started is not None else time.perf_counter() - seconds) - self.started
+        self.spans.append((name, offset, seconds))
+
+    def totals(self):
+        """Суммарное время по каждому участку"""
+        totals = {}
+        for name, _, seconds in self.spans:
+            totals[name] = totals.get(name, 0.0) + seconds
+        return totals
+
+    def as_dict(self):
+        return {
+            'update_id': self.update_id,
+            'label': self.label,
+            'user_id': self.user_id,
+            'started_at': self.started_at,
+            'duration_ms': (self.duration or 0) * 1000,
+            'totals_ms': {name: s * 1000 for name, s in self.totals().items()},
+            'spans': [
+                {'name': name, 'offset_ms': offset * 1000, 'duration_ms': s * 1000}
+                for name, offset, s in self.spans
+            ],
+        }
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def add_span(name, seconds, started=None):
+    """Добавляет готовый замер в трассировку текущего апдейта (если она есть)"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(name, seconds, started)
+
+
+@contextmanager
+def span(name):
+    """Замеряет участок кода внутри текущего апдейта"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - started, started)
+
+
+def traced(name):
+    """Декоратор для синхронных функций: замеряет вызов как участок трассировки"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _remember(trace):
+    item = (trace.duration, next(_counter), trace)
+    if len(_slowest) < TRACE_SLOWEST:
+        heapq.heappush(_slowest, item)
+    elif trace.duration > _slowest[0][0]:
+        heapq.heapreplace(_slowest, item)
+
+
+def slowest_traces(limit=None):
+    """Самые медленные трассировки, от медленной к быстрой"""
+    traces = [item[2] for item in sorted(_slowest, key=lambda item: item[0], reverse=True)]
+    return traces[:limit] if limit else traces
+
+
+def reset_traces():
+    _slowest.clear()
+
+
+def _update_label(update: Update):
+    if update.callback_query is not None:
+        data = update.callback_query.data or ''
+        return f"callback:{data[:40]}", update.callback_query.from_user.id
+    if update.message is not None:
+        text = update.message.text or ''
+        user_id = update.message.from_user.id if update.message.from_user else None
+        return f"message:{text[:40]}", user_id
+    return update.event_type, None
+
+
+class TracingMiddleware(BaseMiddleware):
+    """Внешний middleware: замеряет апдейт целиком и собирает участки"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any]
+    ) -> Any:
+        if isinstance(event, Update):
+            label, user_id = _update_label(event)
+            trace = Trace(event.update_id, label, user_id)
+        else:
+            trace = Trace(None, type(event).__name__)
+        token = _current_trace.set(trace)
+        try:
+            return await handler(event, data)
+        finally:
+            trace.duration = time.perf_counter() - trace.started
+            _current_trace.reset(token)
+            _remember(trace)
+
+
+class TelegramTracingMiddleware(BaseRequestMiddleware):
+    """Замеряет вызовы Telegram Bot API как участки трассировки"""
+
+    async def __call__(self, make_request, bot, method):
+        with span(f"telegram.{method.__api_method__}"):
+            return await make_request(bot, method)
+
+
+def format_traces(limit=5):
+    """Текст с самыми медленными апдейтами для админов"""
+    traces = slowest_traces(limit)
+    if not traces:
+        return "🐢 Трассировок пока нет"
+    lines = [f"<b>🐢 Самые медленные апдейты ({len(traces)}):</b>", ""]
+    for trace in traces:
+        started = time.strftime('%d.%m %H:%M:%S', time.localtime(trace.started_at))
+        label = html.escape(trace.label)
+        lines.append(f"<b>{trace.duration * 1000:.0f} мс</b> | {started} | {label}")
+        totals = sorted(trace.totals().items(), key=lambda item: item[1], reverse=True)
+        for name, seconds in totals:
+            lines.append(f"  {name}: {seconds * 1000:.1f} мс")
+        lines.append("")
+    return '\n'.join(lines)
@@ -0,0 +1,136 @@
+import os
+import hmac
+import logging
+from aiohttp import web
+
+from .querystats import top_queries
+from .metrics import render_metrics
+from .tracing import slowest_traces
+from .ics import handle_ics
+from .profiling import (
+    ProfilingBusy, profile_cpu, sample_stacks, format_samples, memory_diff, memory_stop, loop_monitor,
+)
+
+logger = logging.getLogger("web")
+
+# Токен для служебных HTTP-ручек. Если не задан, ручки закрыты
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+# Токен для /metrics (bearer_token в конфиге Prometheus). Если не задан, /metrics открыт
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+
+def _is_admin_request(request: web.Request) -> bool:
+    if not ADMIN_TOKEN:
+        return False
+    token = request.headers.get("X-Admin-Token") or request.query.get("token", "")
+    auth = request.headers.get("Authorization", "")
+    if auth.startswith("Bearer "):
+        token = auth[len("Bearer "):]
+    return hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+
+def admin_required(handler):
+    """Пускает к ручке только запросы с ADMIN_TOKEN"""
+    async def wrapper(request: web.Request):
+        if not _is_admin_request(request):
+            logger.warning(f"Отказано в доступе к {request.path} с {request.remote}")
+            return web.Response(text="Forbidden", status=403)
+        return await handler(request)
+    return wrapper
+
+
+@admin_required
+async def handle_queries(request: web.Request):
+    """Статистика запросов к БД в JSON"""
+    try:
+        limit = int(request.query.get("limit", 20))
+    except ValueError:
+        limit = 20
+    order_by = request.query.get("order", "total_ms")
+    if order_by not in ("total_ms", "count", "p95_ms", "p99_ms", "max_ms", "avg_ms"):
+        order_by = "total_ms"
+    return web.json_response({'queries': top_queries(limit, order_by)})
+
+
+@admin_required
+async def handle_traces(request: web.Request):
+    """Самые медленные апдейты с разбивкой по участкам"""
+    try:
+        limit = int(request.query.get("limit", 20))
+    except ValueError:
+        limit = 20
+    return web.json_response({'traces': [t.as_dict() for t in slowest_traces(limit)]})
+
+
+@admin_required
+async def handle_profile(request: web.Request):
+    """cProfile (mode=cpu) или сэмплирование стеков (mode=sample) на seconds секунд"""
+    try:
+        seconds = float(request.query.get("seconds", 10))
+        limit = int(request.query.get("limit", 40))
+    except ValueError:
+        return web.Response(text="Bad seconds or limit", status=400)
+    mode = request.query.get("mode", "cpu")
+    try:
+        if mode == "sample":
+            result = await sample_stacks(seconds, limit=limit)
+            if request.query.get("format") == "json":
+                return web.json_response(result)
+            text = format_samples(result)
+        else:
+            sort = request.query.get("sort", "cumulative")
+            if sort not in ("cumulative", "tottime", "calls"):
+                sort = "cumulative"
+            text = await profile_cpu(seconds, limit=limit, sort=sort)
+    except ProfilingBusy as e:
+        return web.Response(text=str(e), status=409)
+    return web.Response(text=text)
+
+
+@admin_required
+async def handle_memory(request: web.Request):
+    """Прирост памяти по tracemalloc с прошлого вызова и размеры кэшей; action=stop выключает трассировку"""
+    if request.query.get("action") == "stop":
+        memory_stop()
+        return web.json_response({'tracing': False})
+    try:
+        limit = int(request.query.get("limit", 15))
+    except ValueError:
+        limit = 15
+    group_by = request.query.get("group_by", "lineno")
+    if group_by not in ("lineno", "filename", "traceback"):
+        group_by = "lineno"
+    result = memory_diff(limit, group_by)
+    return web.json_response({'tracing': True, 'baseline_only': result is None, **(result or {})})
+
+
+@admin_required
+async def handle_loop(request: web.Request):
+    """Задержка event loop и стеки последних блокировок"""
+    if request.query.get("action") == "reset":
+        loop_monitor.reset()
+    return web.json_response(loop_monitor.stats())
+
+
+async def handle_metrics(request: web.Request):
+    """Метрики в текстовом формате Prometheus"""
+    if METRICS_TOKEN:
+        auth = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(auth.encode(), f"Bearer {METRICS_TOKEN}".encode()):
+            return web.Response(text="Forbidden", status=403)
+    return web.Response(
+        text=render_metrics(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+def setup_routes(app: web.Application):
+    """Регистрирует служебные HTTP-ручки на приложении вебхука"""
+    app.router.add_get("/admin/queries", handle_queries)
+    app.router.add_get("/admin/traces", handle_traces)
+    app.router.add_get("/admin/profile", handle_profile)
+    app.router.add_get("/admin/memory", handle_memory)
+    app.router.add_get("/admin/loop", handle_loop)
+    app.router.add_get("/metrics", handle_metrics)
+    app.router.add_get("/ics/teacher/{name}.ics", handle_ics)
+    app.router.add_get("/ics/{name}.ics", handle_ics)
@@ -0,0 +1,174 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
+
+from .metrics import Counter, Histogram, register_collector
+
+logger = logging.getLogger("webhook")
+
+# queue — ответ Telegram сразу, обработка в пуле воркеров по порядку внутри чата;
+# background — прежнее поведение SimpleRequestHandler: ответ сразу, каждый апдейт
+# в отдельной задаче без порядка и ограничений; inline — обработка внутри запроса
+WEBHOOK_MODE = os.getenv("WEBHOOK_MODE", "queue")
+# Сколько апдейтов обрабатывается одновременно
+WEBHOOK_MAX_IN_FLIGHT = int(os.getenv("WEBHOOK_MAX_IN_FLIGHT", 32))
+# Сколько апдейтов может ждать обработки; дальше вебхук перестает сразу отвечать
+WEBHOOK_MAX_PENDING = int(os.getenv("WEBHOOK_MAX_PENDING", 1000))
+# Сколько держать запрос Telegram при переполнении, прежде чем ответить 503
+WEBHOOK_BACKPRESSURE_TIMEOUT = float(os.getenv("WEBHOOK_BACKPRESSURE_TIMEOUT", 5))
+# Сколько ждать обработки оставшихся апдейтов при остановке
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", 10))
+
+WEBHOOK_UPDATES = Counter(
+    "webhook_updates_total", "Апдейты, принятые вебхуком", ("status",),
+)
+WEBHOOK_QUEUE_WAIT = Histogram(
+    "webhook_queue_wait_seconds", "Время от приема апдейта до начала обработки",
+)
+
+# Типы апдейтов, у которых есть чат, и путь к нему
+_CHAT_PATHS = (
+    ('message', 'chat'),
+    ('edited_message', 'chat'),
+    ('channel_post', 'chat'),
+    ('edited_channel_post', 'chat'),
+    ('my_chat_member', 'chat'),
+    ('chat_member', 'chat'),
+    ('chat_join_request', 'chat'),
+)
+# Апдейты без чата упорядочиваются по пользователю
+_USER_PATHS = ('callback_query', 'inline_query', 'chosen_inline_result', 'pre_checkout_query', 'shipping_query')
+
+
+def update_order_key(update):
+    """Ключ упорядочивания: апдейты с одним ключом обрабатываются строго по очереди"""
+    for kind, field in _CHAT_PATHS:
+        obj = update.get(kind)
+        if obj and obj.get(field):
+            return f"chat:{obj[field]['id']}"
+    for kind in _USER_PATHS:
+        obj = update.get(kind)
+        if obj:
+            message = obj.get('message')
+            if message and message.get('chat'):
+                return f"chat:{message['chat']['id']}"
+            if obj.get('from'):
+                return f"user:{obj['from']['id']}"
+    return f"update:{update.get('update_id')}"
+
+
+class QueuedRequestHandler(SimpleRequestHandler):
+    """Вебхук, который отвечает Telegram сразу и обрабатывает апдейты в фоне.
+
+    Апдейты одного чата обрабатываются по порядку, разные чаты — параллельно,
+    не больше max_in_flight одновременно. Когда ожидающих больше max_pending,
+    запрос Telegram придерживается (Telegram сам снижает темп доставки), а после
+    backpressure_timeout получает 503 и будет доставлен повторно.
+    """
+
+    def __init__(self, dispatcher, bot, max_in_flight=WEBHOOK_MAX_IN_FLIGHT,
+                 max_pending=WEBHOOK_MAX_PENDING, backpressure_timeout=WEBHOOK_BACKPRESSURE_TIMEOUT, **kwargs):
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True, **kwargs)
+        self.max_in_flight = max_in_flight
+        self.max_pending = max_pending
+        self.backpressure_timeout = backpressure_timeout
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._pending = asyncio.Semaphore(max_pending)
+        self._pending_count = 0
+        self._running = 0
+        # {ключ порядка: очередь апдейтов}; ключ есть, пока для него работает задача
+        self._chains = {}
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def _handle_request_background(self, bot, request):
+        update = await request.json(loads=bot.session.json_loads)
+        try:
+            await asyncio.wait_for(self._pending.acquire(), timeout=self.backpressure_timeout)
+        except asyncio.TimeoutError:
+            WEBHOOK_UPDATES.inc(status="rejected")
+            logger.warning(f"Очередь апдейтов переполнена ({self._pending_count}), апдейт {update.get('update_id')} отклонен")
+            return web.Response(status=503, text="Too many pending updates")
+        WEBHOOK_UPDATES.inc(status="accepted")
+        self._pending_count += 1
+        self._idle.clear()
+
+        key = update_order_key(update)
+        chain = self._chains.get(key)
+        if chain is not None:
+            chain.append((update, time.perf_counter()))
+        else:
+            self._chains[key] = deque([(update, time.perf_counter())])
+            task = asyncio.create_task(self._run_chain(bot, key))
+            self._background_feed_update_tasks.add(task)
+            task.add_done_callback(self._background_feed_update_tasks.discard)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def _run_chain(self, bot, key):
+        chain = self._chains[key]
+        try:
+            while chain:
+                update, accepted = chain.popleft()
+                try:
+                    async with self._in_flight:
+                        WEBHOOK_QUEUE_WAIT.observe(time.perf_counter() - accepted)
+                        self._running += 1
+                        try:
+                            await self._background_feed_update(bot=bot, update=update)
+                        finally:
+                            self._running -= 1
+                except Exception as e:
+                    logger.error(f"Ошибка обработки апдейта {update.get('update_id')}: {e}")
+                finally:
+                    self._pending_count -= 1
+                    self._pending.release()
+        finally:
+            del self._chains[key]
+            if not self._chains:
+                self._idle.set()
+
+    async def close(self):
+        if self._pending_count:
+            logger.info(f"Дожидаемся обработки {self._pending_count} апдейтов")
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout=WEBHOOK_DRAIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning(f"Не обработано {self._pending_count} апдейтов при остановке")
+        await super().close()
+
+    def stats(self):
+        return {
+            'pending': self._pending_count,
+            'running': self._running,
+            'chains': len(self._chains),
+            'max_in_flight': self.max_in_flight,
+            'max_pending': self.max_pending,
+        }
+
+
+def create_webhook_handler(dispatcher, bot, secret_token=None):
+    """Обработчик вебхука в режиме WEBHOOK_MODE"""
+    if WEBHOOK_MODE in ("inline", "background"):
+        return SimpleRequestHandler(
+            dispatcher=dispatcher, bot=bot, handle_in_background=WEBHOOK_MODE == "background",
+            secret_token=secret_token
+        )
+    if WEBHOOK_MODE != "queue":
+        logger.error(f"Неизвестный WEBHOOK_MODE={WEBHOOK_MODE}, используем queue")
+    handler = QueuedRequestHandler(dispatcher=dispatcher, bot=bot, secret_token=secret_token)
+    register_collector(lambda: _webhook_metrics(handler))
+    return handler
+
+
+def _webhook_metrics(handler):
+    stats = handler.stats()
+    return [
+        ("webhook_pending_updates", "gauge", "Принятые, но еще не обработанные апдейты", [({}, stats['pending'])]),
+        ("webhook_running_updates", "gauge", "Апдейты в обработке", [({}, stats['running'])]),
+        ("webhook_max_in_flight", "gauge", "Лимит одновременно обрабатываемых апдейтов", [({}, stats['max_in_flight'])]),
+    ]
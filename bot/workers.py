@@ -0,0 +1,126 @@
+import os
+import time
+import signal
+import asyncio
+import logging
+import multiprocessing
+
+from .pools import POOL_DEFAULTS
+
+logger = logging.getLogger("workers")
+
+# Сколько процессов обслуживают вебхук на одном порту (SO_REUSEPORT); 1 — без лаунчера
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", 1))
+# Файл со снимком расписания, общий для процессов одной машины
+DEFAULT_SNAPSHOT_FILE = "/tmp/raspisanie-snapshot.bin"
+# Пауза перед перезапуском упавшего процесса, секунды
+RESTART_DELAY = 2
+# Соединения вне пулов у каждого процесса: LISTEN шины и advisory lock лидера
+DEDICATED_CONNECTIONS = 2
+# Общий для бота лимит рассылки, сообщений в секунду (как FANOUT_RATE по умолчанию)
+DEFAULT_FANOUT_RATE = 25
+
+
+def worker_index():
+    """Номер процесса в лаунчере; None, если бот запущен одним процессом"""
+    value = os.getenv("WORKER_INDEX")
+    return int(value) if value is not None and value.isdigit() else None
+
+
+def _env_size(name, default):
+    value = os.getenv(name)
+    return int(value) if value and value.isdigit() else default
+
+
+def _configure_env(count):
+    """Делит лимиты процесса между воркерами, если они не заданы явно.
+
+    Бюджет соединений — столько же, сколько у одного процесса: пулы
+    interactive, background и admin по умолчанию плюс два выделенных
+    соединения (LISTEN шины и advisory lock лидера), которые есть у каждого
+    воркера. Пулы background и admin делятся поровну (не меньше двух и одного
+    соединения: фоновый пул делят запись активности, рассылка и обновление),
+    interactive получает остаток. Явно заданные DB_*_MAX_SIZE
+    и FANOUT_RATE не меняются; явный FANOUT_RATE считается лимитом воркера.
+    """
+    os.environ.setdefault("SNAPSHOT_FILE", DEFAULT_SNAPSHOT_FILE)
+    budget = sum(config['max_size'] for config in POOL_DEFAULTS.values()) + DEDICATED_CONNECTIONS
+    per_worker = budget // count
+    background = _env_size("DB_BACKGROUND_MAX_SIZE", max(2, POOL_DEFAULTS['background']['max_size'] // count))
+    admin = _env_size("DB_ADMIN_MAX_SIZE", max(1, POOL_DEFAULTS['admin']['max_size'] // count))
+    interactive = _env_size("DB_INTERACTIVE_MAX_SIZE", max(1, per_worker - DEDICATED_CONNECTIONS - background - admin))
+    os.environ["DB_BACKGROUND_MAX_SIZE"] = str(background)
+    os.environ["DB_ADMIN_MAX_SIZE"] = str(admin)
+    os.environ["DB_INTERACTIVE_MAX_SIZE"] = str(interactive)
+    os.environ.setdefault("DB_BACKGROUND_MIN_SIZE", "1")
+    os.environ.setdefault("DB_ADMIN_MIN_SIZE", "1")
+    os.environ.setdefault("DB_INTERACTIVE_MIN_SIZE", "1")
+    total = count * (interactive + background + admin + DEDICATED_CONNECTIONS)
+    if total > budget:
+        logger.warning(
+            f"{count} воркеров займут до {total} соединений с базой против {budget} у одного процесса"
+        )
+    # Лимит Telegram общий на бота, а рассылку ведет каждый воркер
+    os.environ.setdefault("FANOUT_RATE", str(DEFAULT_FANOUT_RATE / count))
+
+
+def _run_worker(main, index):
+    os.environ["WORKER_INDEX"] = str(index)
+    # Останавливает родитель; Ctrl+C в терминале приходит всей группе процессов
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    async def run():
+        # SIGTERM от родителя отменяет main(), и приложение проходит обычный on_shutdown
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        try:
+            await main()
+        except asyncio.CancelledError:
+            pass
+
+    asyncio.run(run())
+
+
+def run_workers(main, count=WEB_WORKERS):
+    """Запускает count процессов с main() и перезапускает упавшие.
+
+    Процессы создаются через spawn, поэтому модули бота импортируются в них
+    заново и видят лимиты, выставленные _configure_env. Обновление данных
+    по-прежнему выполняет один лидер, остальные процессы берут готовый
+    снимок из SNAPSHOT_FILE.
+    """
+    _configure_env(count)
+    context = multiprocessing.get_context("spawn")
+    processes = {}
+    stopping = False
+
+    def start(index):
+        process = context.Process(target=_run_worker, args=(main, index), name=f"bot-worker-{index}")
+        process.start()
+        processes[index] = process
+        logger.info(f"Воркер {index} запущен, pid {process.pid}")
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for index in range(count):
+        start(index)
+    while not stopping:
+        time.sleep(1)
+        for index, process in list(processes.items()):
+            if process.is_alive() or stopping:
+                continue
+            logger.error(f"Воркер {index} завершился с кодом {process.exitcode}, перезапуск")
+            time.sleep(RESTART_DELAY)
+            start(index)
+
+    logger.warning("Остановка воркеров...")
+    for process in processes.values():
+        if process.is_alive():
+            process.terminate()
+    for process in processes.values():
+        process.join(timeout=30)
+        if process.is_alive():
+            process.kill()
@@ -0,0 +1,10 @@
+import asyncio
+
+from bot.bus import bus
+from bot.fsm import fsm_storage
+
+
+def test_resync_clears_fsm_cache():
+    fsm_storage._remember("fsm:1:1", "ProfileStates:choosing_group", {})
+    asyncio.run(bus._resync())
+    assert not fsm_storage._cache
@@ -0,0 +1,26 @@
+from bot.indexes import SearchIndex, TeacherIndex, RoomIndex
+from bot.snapshot import ScheduleSnapshot
+
+PRACTICE = {'practice': [{'is_practice': True, 'practice_info': "Учебная практика с 01.10 по 14.10"}], 'updated': True}
+LESSON = {'number': 1, 'time': "08:30-10:00", 'subject': "Математика", 'teacher': "Иванов И.И.", 'room': "101"}
+SCHEDULE = {
+    'Исп-221': PRACTICE,
+    'Бд-231': {'Понедельник': {1: [LESSON], 2: []}},
+}
+
+
+def test_search_index_skips_practice_marker():
+    index = SearchIndex(['Исп-221'], [], {'Исп-221': PRACTICE})
+    assert [hit.value for hit in index.search("исп221")] == ['Исп-221']
+
+
+def test_indexes_accept_practice_groups():
+    TeacherIndex(SCHEDULE, {})
+    RoomIndex(SCHEDULE, {})
+    index = SearchIndex(sorted(SCHEDULE), [], SCHEDULE)
+    assert any(hit.value == "Математика" for hit in index.search("математика"))
+
+
+def test_snapshot_with_practice_group():
+    snapshot = ScheduleSnapshot(1, SCHEDULE, {})
+    assert snapshot.groups == ['Бд-231', 'Исп-221']
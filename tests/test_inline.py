@@ -0,0 +1,14 @@
+from bot.inline import _fit, MESSAGE_LIMIT
+
+
+def test_fit_cuts_at_line_boundary():
+    line = "1️⃣ <b>Математика</b> | 08:30 - 10:00 &amp; Каб. 101"
+    text = "\n".join([line] * 200)
+    fitted = _fit(text)
+    assert len(fitted) <= MESSAGE_LIMIT
+    assert fitted.endswith("\n…")
+    assert all(part == line for part in fitted.split("\n")[:-1])
+
+
+def test_fit_keeps_short_text():
+    assert _fit("<b>Исп-221</b>\nПусто") == "<b>Исп-221</b>\nПусто"
@@ -0,0 +1,44 @@
+from io import BytesIO
+
+from openpyxl import Workbook
+
+from bot.parsers.schedule import parse_schedule
+from bench.fixtures import make_schedule
+
+
+def test_fixture_structure():
+    fixture = make_schedule(groups=12, split_ratio=0.5, practice_groups=2, seed=3)
+    schedule = parse_schedule(fixture.content)
+    assert len(schedule) == fixture.groups
+    practice = {group for group, days in schedule.items() if 'practice' in days}
+    assert practice == set(fixture.practice)
+
+
+def _xlsx(rows):
+    wb = Workbook()
+    for row in rows:
+        wb.active.append(row)
+    buffer = BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+def _rooms(schedule, group):
+    return [lesson['room'] for lesson in schedule[group]['Понедельник'][1]]
+
+
+def test_room_column_without_header():
+    header = ['День', 'Интервал', 'Исп-221', None, 'Бд-231', 'Ауд.']
+    # Пустая колонка аудитории без заголовка: сосед — следующая группа, а не кабинет
+    schedule = parse_schedule(_xlsx([
+        header,
+        ['Понедельник', '1 пара', 'Математика Иванов И.И.', None, 'Физика Петров П.П.', 101],
+    ]))
+    assert _rooms(schedule, 'Исп-221') == ['—']
+    assert _rooms(schedule, 'Бд-231') == ['101']
+    # Та же колонка с кабинетами
+    schedule = parse_schedule(_xlsx([
+        header,
+        ['Понедельник', '1 пара', 'Математика Иванов И.И.', 205, 'Физика Петров П.П.', 101],
+    ]))
+    assert _rooms(schedule, 'Исп-221') == ['205']
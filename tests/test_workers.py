@@ -0,0 +1,34 @@
+import os
+
+import pytest
+
+from bot.pools import POOL_DEFAULTS
+from bot.workers import _configure_env, DEDICATED_CONNECTIONS
+
+ENV = (
+    "SNAPSHOT_FILE", "FANOUT_RATE",
+    *(f"DB_{name.upper()}_{key}" for name in POOL_DEFAULTS for key in ("MAX_SIZE", "MIN_SIZE")),
+)
+
+
+@pytest.fixture(autouse=True)
+def clean_env(monkeypatch):
+    for name in ENV:
+        monkeypatch.delenv(name, raising=False)
+
+
+@pytest.mark.parametrize("count", [2, 3, 4])
+def test_workers_fit_single_process_budget(count):
+    _configure_env(count)
+    budget = sum(config['max_size'] for config in POOL_DEFAULTS.values()) + DEDICATED_CONNECTIONS
+    per_worker = sum(int(os.environ[f"DB_{name.upper()}_MAX_SIZE"]) for name in POOL_DEFAULTS) + DEDICATED_CONNECTIONS
+    assert count * per_worker <= budget
+    assert float(os.environ["FANOUT_RATE"]) * count == pytest.approx(25)
+
+
+def test_explicit_settings_are_kept(monkeypatch):
+    monkeypatch.setenv("FANOUT_RATE", "10")
+    monkeypatch.setenv("DB_INTERACTIVE_MAX_SIZE", "5")
+    _configure_env(4)
+    assert os.environ["FANOUT_RATE"] == "10"
+    assert os.environ["DB_INTERACTIVE_MAX_SIZE"] == "5"